@@ -550,14 +550,11 @@ class COTEditHardware(ReadWriteCommand):
             self.vm.set_serial_connectivity(self.serial_connectivity,
                                             self.profiles)
 
-    def run(self):
-        """Do the actual work of this command.
+    def _run_update_hardware(self):
+        """Apply all requested hardware changes to the VM.
 
-        Raises:
-          InvalidInputError: if :func:`ready_to_run` reports ``False``
+        Helper for :meth:`run`.
         """
-        super(COTEditHardware, self).run()
-
         self._run_update_profiles()
 
         vm = self.vm
@@ -589,6 +586,18 @@ class COTEditHardware(ReadWriteCommand):
         if self.ide_subtypes is not None:
             vm.set_ide_subtypes(self.ide_subtypes, self.profiles)
 
+    def run(self):
+        """Do the actual work of this command.
+
+        Raises:
+          InvalidInputError: if :func:`ready_to_run` reports ``False``
+        """
+        super(COTEditHardware, self).run()
+
+        # Validate each modified hardware item once, after all edits
+        with self.vm.batch_edit():
+            self._run_update_hardware()
+
     def create_subparser(self):
         """Create 'edit-hardware' CLI subparser."""
         wrapper = textwrap.TextWrapper(width=self.ui.terminal_width - 1,
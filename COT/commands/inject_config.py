@@ -21,7 +21,8 @@ import os.path
 import shutil
 
 from COT.data_validation import ValueUnsupportedError, InvalidInputError
-from COT.disks import DiskRepresentation
+from COT.disks.cache import config_disk_cache
+from COT.disks.vmdk import StreamOptimizedWriter
 from COT.utilities import directory_size
 from .command import command_classes, ReadWriteCommand
 from .add_disk import add_disk_worker
@@ -160,6 +161,8 @@ class COTInjectConfig(ReadWriteCommand):
             # RAW image size ~= size of files contained, rounded up to 8MiB
             # see RAW._create_file()
             extra_required += ((8 << 20) - extra_required) % (8 << 20)
+            # plus the VMDK converted from it, see ConfigDiskCache._build()
+            extra_required += StreamOptimizedWriter.max_size(extra_required)
 
         logger.debug("Config disk estimated size is %s, for a total of %s",
                      extra_required, base_required + extra_required)
@@ -234,16 +237,18 @@ class COTInjectConfig(ReadWriteCommand):
             bootstrap_file = os.path.join(vm.working_dir, 'config.iso')
             disk_format = 'iso'
         elif platform.BOOTSTRAP_DISK_TYPE == 'harddisk':
-            bootstrap_file = os.path.join(vm.working_dir, 'config.img')
-            disk_format = 'raw'
+            # Built and cached as the VMDK to be packaged, so that
+            # reusing it doesn't require converting it again either
+            bootstrap_file = os.path.join(vm.working_dir, 'config.vmdk')
+            disk_format = 'vmdk'
         else:
             raise ValueUnsupportedError("bootstrap disk drive type",
                                         platform.BOOTSTRAP_DISK_TYPE,
                                         "'cdrom' or 'harddisk'")
 
-        disk_image = DiskRepresentation.for_new_file(bootstrap_file,
-                                                     disk_format,
-                                                     files=config_files)
+        # Identical configuration reuses the disk image built last time
+        disk_image = config_disk_cache.create(bootstrap_file, disk_format,
+                                              config_files)
 
         # Inject the disk image into the OVA, using "add-disk" functionality
         add_disk_worker(
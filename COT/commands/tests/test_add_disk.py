@@ -19,14 +19,17 @@
 import filecmp
 import os.path
 import re
+import tarfile
 import mock
 
 from COT.commands.tests.command_testcase import CommandTestCase
 from COT.commands.add_disk import COTAddDisk
 from COT.data_validation import InvalidInputError, ValueMismatchError
 from COT.data_validation import ValueUnsupportedError, ValueTooHighError
+from COT.data_validation import file_checksum
 from COT.disks import DiskRepresentation
 from COT.disks.qcow2 import QCOW2
+from COT.disks.vmdk import StreamOptimizedReader
 
 
 # pylint: disable=missing-param-doc,missing-type-doc
@@ -549,6 +552,47 @@ ovf:diskId="new.vmdk" ovf:fileRef="new.vmdk" ovf:format=\
         self.assertEqual(diskrep.disk_format, 'vmdk')
         self.assertEqual(diskrep.disk_subformat, "streamOptimized")
 
+    def test_disk_conversion_into_ova(self):
+        """A raw disk is converted straight into the output OVA."""
+        new_raw = os.path.join(self.temp_dir, "new.img")
+        data = os.urandom(100000)
+        with open(new_raw, 'wb') as fileobj:
+            fileobj.seek(4 * 1048576)
+            fileobj.write(data)
+            fileobj.truncate(16 * 1048576)
+        output = os.path.join(self.temp_dir, "out.ova")
+        self.command.package = self.input_ovf
+        self.command.output = output
+        self.command.disk_image = new_raw
+        self.command.controller = 'scsi'
+        self.command.run()
+        self.assertLogged(**self.DRIVE_TYPE_GUESSED_HARDDISK)
+        self.command.finished()
+        # No intermediate copy of the converted disk was made
+        self.assertFalse(os.path.exists(os.path.join(
+            self.command.vm.working_dir, "new.vmdk")))
+
+        with tarfile.open(output, 'r') as tarf:
+            self.assertEqual(tarf.getnames()[:2], ["out.ovf", "out.mf"])
+            member = tarf.getmember("new.vmdk")
+            descriptor = tarf.extractfile("out.ovf").read().decode()
+            self.assertIn('<ovf:File ovf:href="new.vmdk" ovf:id="new.vmdk" '
+                          'ovf:size="{0}" />'.format(member.size), descriptor)
+            manifest = tarf.extractfile("out.mf").read().decode()
+            self.assertIn("(new.vmdk)=", manifest)
+            for line in manifest.splitlines():
+                match = re.match(r"(\w+)\((.*)\)= (\w+)$", line)
+                self.assertTrue(match, line)
+                self.assertEqual(
+                    file_checksum(tarf.extractfile(match.group(2)),
+                                  match.group(1).lower()),
+                    match.group(3), line)
+
+            reader = StreamOptimizedReader(tarf.extractfile(member))
+            self.assertEqual(reader.capacity, 16 * 1048576)
+            reader.seek(4 * 1048576)
+            self.assertEqual(reader.read(len(data)), data)
+
     def test_disk_conversion_and_replacement(self):
         """Convert a disk to implicitly replace an existing disk."""
         # Create a qcow2 image and add it as replacement for the existing vmdk
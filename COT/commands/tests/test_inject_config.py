@@ -29,7 +29,8 @@ from COT.commands.inject_config import COTInjectConfig
 from COT.data_validation import InvalidInputError, ValueUnsupportedError
 from COT.platforms import CSR1000V, IOSv, IOSXRv, IOSXRvLC
 from COT.helpers import helpers
-from COT.disks import DiskRepresentation
+from COT.disks import DiskRepresentation, ISO, RAW
+from COT.disks.vmdk import StreamOptimizedWriter
 from COT.commands.remove_file import COTRemoveFile
 
 logger = logging.getLogger(__name__)
@@ -363,6 +364,57 @@ ovf:size="{config_size}" />
                                 config_size=os.path.getsize(os.path.join(
                                     self.temp_dir, 'config.iso'))))
 
+    def test_inject_config_cached(self):
+        """An identical config disk is reused instead of built again."""
+        self.command.package = self.input_ovf
+        self.command.config_file = self.config_file
+        self.command.run()
+        self.assertLogged(**self.OVERWRITING_DISK_ITEM)
+        self.command.finished()
+        config_iso = os.path.join(self.temp_dir, 'config.iso')
+        with open(config_iso, 'rb') as fileobj:
+            first = fileobj.read()
+
+        self.command.package = self.temp_file
+        self.command.config_file = self.config_file
+        with mock.patch.object(ISO, 'create_file') as mock_create:
+            self.command.run()
+            mock_create.assert_not_called()
+        self.assertLogged(**self.OVERWRITE_CONFIG_DISK)
+        self.assertLogged(**self.OVERWRITING_FILE)
+        self.assertLogged(**self.OVERWRITING_DISK_ITEM)
+        self.command.finished()
+        with open(config_iso, 'rb') as fileobj:
+            self.assertEqual(fileobj.read(), first)
+
+    def test_inject_config_vmdk_cached(self):
+        """An identical hard disk config reuses the VMDK built before."""
+        self.command.package = self.iosv_ovf
+        self.command.config_file = self.config_file
+        self.command.run()
+        self.assertLogged(**self.OVERWRITING_DISK)
+        self.assertLogged(**self.OVERWRITING_DISK_ITEM)
+        self.command.finished()
+        config_vmdk = os.path.join(self.temp_dir, 'config.vmdk')
+        with open(config_vmdk, 'rb') as fileobj:
+            first = fileobj.read()
+
+        self.command.package = self.temp_file
+        self.command.config_file = self.config_file
+        with mock.patch.object(RAW, 'create_file') as mock_create, \
+                mock.patch.object(StreamOptimizedWriter,
+                                  'convert') as mock_convert:
+            self.command.run()
+            mock_create.assert_not_called()
+            mock_convert.assert_not_called()
+        self.assertLogged(**self.OVERWRITE_CONFIG_DISK)
+        self.assertLogged(**self.OVERWRITING_FILE)
+        self.assertLogged(**self.OVERWRITING_DISK)
+        self.assertLogged(**self.OVERWRITING_DISK_ITEM)
+        self.command.finished()
+        with open(config_vmdk, 'rb') as fileobj:
+            self.assertEqual(fileobj.read(), first)
+
     def test_inject_config_fail_no_disk_available(self):
         """Error handling if the OVF doesn't have an appropriate drive."""
         self.command.package = self.minimal_ovf
@@ -22,6 +22,7 @@ API
   :nosignatures:
 
   DiskRepresentation
+  NativeUnsupportedError
 
 Disk modules
 ------------
@@ -29,15 +30,17 @@ Disk modules
 .. autosummary::
   :toctree:
 
+  COT.disks.cache
   COT.disks.iso
   COT.disks.qcow2
   COT.disks.raw
+  COT.disks.scheduler
   COT.disks.vmdk
 """
 
 # flake8: noqa: F401
 
-from .disk import DiskRepresentation
+from .disk import DiskRepresentation, NativeUnsupportedError
 from .iso import ISO
 from .qcow2 import QCOW2
 from .raw import RAW
@@ -45,4 +48,5 @@ from .vmdk import VMDK
 
 __all__ = (
     'DiskRepresentation',
+    'NativeUnsupportedError',
 )
@@ -0,0 +1,746 @@
+# cache.py - Persistent cache of disk image metadata
+# Copyright (c) 2026 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Persistent caching of information about disk image files.
+
+Probing a disk image (its format, capacity, contents, etc.) may require
+running a helper program such as ``qemu-img`` or ``isoinfo``. Since the
+same images are often used by many successive COT invocations, the results
+are remembered across invocations, keyed by the path of each file and
+invalidated whenever the file is modified.
+
+Similarly, converting a disk image to another format is slow, and the same
+source images are often converted again and again, so converted images are
+kept in a size-limited cache keyed by the contents of their source. Likewise
+for configuration disks built from the same files.
+
+The cache directory is ``$COT_CACHE_DIR`` if set, else
+``$XDG_CACHE_HOME/cot``, else ``~/.cache/cot``. Setting ``COT_CACHE_DIR``
+to an empty string disables persistent caching. The converted image cache
+is limited to ``$COT_CONVERSION_CACHE_SIZE`` bytes if set (0 disables it),
+else :attr:`ConversionCache.DEFAULT_MAX_SIZE`.
+
+**Classes**
+
+.. autosummary::
+  :nosignatures:
+
+  ConfigDiskCache
+  ConversionCache
+  DiskMetadataCache
+
+**Functions**
+
+.. autosummary::
+  :nosignatures:
+
+  clone_file
+  default_cache_dir
+  file_digest
+  file_identity
+
+**Attributes**
+
+.. autosummary::
+  :nosignatures:
+
+  config_disk_cache
+  conversion_cache
+  disk_metadata_cache
+"""
+
+import atexit
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from COT import __version__
+
+logger = logging.getLogger(__name__)
+
+FICLONE = 0x40049409
+"""Linux ioctl to make a copy-on-write clone of a file."""
+
+
+def default_cache_dir():
+    """Get the directory where COT should keep persistent caches.
+
+    Returns:
+      str: Directory path, or None if persistent caching is disabled.
+    """
+    directory = os.environ.get('COT_CACHE_DIR')
+    if directory is not None:
+        return directory or None
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "cot")
+
+
+def file_identity(path):
+    """Get a value that changes whenever the given file is modified.
+
+    Args:
+      path (str): Path to an existing file.
+
+    Returns:
+      list: Device, inode, size, modification time, and change time.
+
+    Raises:
+      OSError: if the file does not exist.
+    """
+    stat = os.stat(path)
+    return [stat.st_dev, stat.st_ino, stat.st_size,
+            getattr(stat, 'st_mtime_ns', int(stat.st_mtime * 1e9)),
+            getattr(stat, 'st_ctime_ns', int(stat.st_ctime * 1e9))]
+
+
+def file_digest(path, algorithm='sha256'):
+    """Get the digest of a file's contents.
+
+    The digest is remembered in :attr:`disk_metadata_cache`, so an
+    unmodified file is only read once.
+
+    Args:
+      path (str): Path to an existing file.
+      algorithm (str): Any algorithm supported by :mod:`hashlib`, such as
+          'sha1' or 'sha256'.
+
+    Returns:
+      str: Hexadecimal digest.
+    """
+    digest = disk_metadata_cache.get(path).get(algorithm)
+    if digest:
+        return digest
+    hash_obj = hashlib.new(algorithm)
+    with open(path, 'rb') as fileobj:
+        while True:
+            data = fileobj.read(1 << 20)
+            if not data:
+                break
+            hash_obj.update(data)
+    digest = hash_obj.hexdigest()
+    disk_metadata_cache.update(path, {algorithm: digest})
+    return digest
+
+
+def clone_file(source, destination):
+    """Create a file with the same contents as another, as cheaply as possible.
+
+    Tries, in order, a copy-on-write clone (on Linux file systems that
+    support it), a hard link, and finally a plain copy. Any existing file at
+    the destination is replaced, never overwritten in place.
+
+    Args:
+      source (str): Path to an existing file.
+      destination (str): Path of the file to create.
+
+    Returns:
+      str: 'reflink', 'hardlink', or 'copy'
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    if fcntl is not None:
+        try:
+            with open(source, 'rb') as src, open(destination, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return 'reflink'
+        except (IOError, OSError):
+            if os.path.exists(destination):
+                os.remove(destination)
+    try:
+        os.link(source, destination)
+        return 'hardlink'
+    except (AttributeError, OSError):
+        pass
+    shutil.copyfile(source, destination)
+    return 'copy'
+
+
+class DiskMetadataCache(object):
+    """Persistent record of what is known about each disk image file.
+
+    Each entry is a dict of JSON-serializable values describing one file,
+    such as its detected format. Entries are discarded once their file's
+    :func:`file_identity` changes. Updated entries are saved to the cache
+    file in batches of :attr:`BATCH_SIZE`, or by :meth:`flush`, rather than
+    one at a time.
+
+    Examples:
+      ::
+
+        >>> cache = DiskMetadataCache(tempfile.mkdtemp())
+        >>> path = os.path.join(cache.directory, "disk.img")
+        >>> with open(path, 'w') as fileobj:
+        ...     _ = fileobj.write("hello")
+        >>> cache.get(path)
+        {}
+        >>> cache.update(path, {'format': 'raw'})
+        >>> cache.flush()
+        >>> DiskMetadataCache(cache.directory).get(path)
+        {'format': 'raw'}
+        >>> with open(path, 'a') as fileobj:
+        ...     _ = fileobj.write(" world")
+        >>> cache.get(path)
+        {}
+        >>> import shutil
+        >>> shutil.rmtree(cache.directory)
+    """
+
+    FILENAME = "disk_metadata.json"
+    """Name of the cache file within the cache directory."""
+
+    VERSION = 1
+    """Version of the cache file layout; other versions are ignored."""
+
+    BATCH_SIZE = 100
+    """Number of updated entries to accumulate before saving them."""
+
+    def __init__(self, directory=None):
+        """Create a cache stored in the given directory.
+
+        Args:
+          directory (str): Cache directory; if unset, defaults to
+              :func:`default_cache_dir` at time of use.
+        """
+        self._directory = directory
+        self._entries = None
+        self._dirty = {}
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        """Directory containing the cache file, or None if disabled."""
+        if self._directory is not None:
+            return self._directory
+        return default_cache_dir()
+
+    @directory.setter
+    def directory(self, value):
+        with self._lock:
+            self._flush()
+            self._directory = value
+            self._entries = None
+
+    @property
+    def path(self):
+        """Path to the cache file, or None if persistent caching is off."""
+        directory = self.directory
+        if not directory:
+            return None
+        return os.path.join(directory, self.FILENAME)
+
+    def _read(self):
+        """Read all entries from the cache file.
+
+        Returns:
+          dict: Dict of file path to entry; empty if the cache file is
+          missing, unreadable, or of a different version.
+        """
+        path = self.path
+        if path is None:
+            return {}
+        try:
+            with open(path, 'r') as fileobj:
+                data = json.load(fileobj)
+        except (IOError, OSError, ValueError) as exc:
+            if getattr(exc, 'errno', None) != errno.ENOENT:
+                logger.debug("Ignoring unreadable disk cache %s: %s",
+                             path, exc)
+            return {}
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return {}
+        return data.get('entries', {})
+
+    def _write(self):
+        """Atomically replace the cache file with the current entries."""
+        path = self.path
+        if path is None:
+            return
+        directory = os.path.dirname(path)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            (handle, temp_path) = tempfile.mkstemp(dir=directory,
+                                                   prefix=".disk_metadata")
+            with os.fdopen(handle, 'w') as fileobj:
+                json.dump({'version': self.VERSION,
+                           'entries': self._entries}, fileobj)
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # Windows will not rename over an existing file
+                os.remove(path)
+                os.rename(temp_path, path)
+        except (IOError, OSError) as exc:
+            logger.debug("Unable to save disk cache %s: %s", path, exc)
+
+    def get(self, path):
+        """Get the cached information about the given file, if still valid.
+
+        Args:
+          path (str): Path to the file of interest.
+
+        Returns:
+          dict: Cached information, empty if none is known.
+        """
+        key = os.path.realpath(path)
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._read()
+            entry = self._entries.get(key)
+            if not entry:
+                return {}
+            try:
+                if entry.get('id') != file_identity(path):
+                    logger.debug("Cached information about %s is stale",
+                                 path)
+                    del self._entries[key]
+                    return {}
+            except OSError:
+                return {}
+            return entry.get('data', {}).copy()
+
+    def update(self, path, values):
+        """Add to or replace the cached information about the given file.
+
+        Args:
+          path (str): Path to the file of interest.
+          values (dict): Items to store. Items not named here are kept
+              if the existing entry is still valid.
+        """
+        if self.path is None:
+            return
+        key = os.path.realpath(path)
+        try:
+            identity = file_identity(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._read()
+            entry = self._entries.get(key)
+            if not entry or entry.get('id') != identity:
+                entry = {'id': identity, 'data': {}}
+            entry['data'].update(values)
+            self._entries[key] = entry
+            self._dirty[key] = entry
+            if len(self._dirty) >= self.BATCH_SIZE:
+                self._flush()
+
+    def flush(self):
+        """Save any updated entries to the cache file."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        """Save any updated entries to the cache file.
+
+        Must be called with :attr:`_lock` held.
+        """
+        if not self._dirty:
+            return
+        # Merge with any changes saved meanwhile by other processes
+        self._entries = self._read()
+        self._entries.update(self._dirty)
+        self._dirty = {}
+        # Don't keep records of files that no longer exist
+        for other in list(self._entries):
+            if not os.path.exists(other):
+                del self._entries[other]
+        self._write()
+
+    def clear(self):
+        """Forget all cached information."""
+        with self._lock:
+            self._entries = {}
+            self._dirty = {}
+            self._write()
+
+
+disk_metadata_cache = DiskMetadataCache()
+"""Cache shared by all :class:`~COT.disks.disk.DiskRepresentation`."""
+
+atexit.register(disk_metadata_cache.flush)
+
+
+class ConversionCache(object):
+    """Size-limited persistent store of converted disk images.
+
+    Each converted image is stored under a key derived from the SHA-256
+    digest of its source image, the target format and subformat, and the
+    program (and version) that performed the conversion. Once the cache
+    exceeds its maximum size, the least recently used images are removed.
+
+    Cached images are placed into the requested directory by
+    :func:`clone_file`, so a cache hit costs next to nothing in time or (on
+    file systems supporting reflinks or hard links) space. As an image may
+    therefore share its storage with the cache, it must be replaced rather
+    than modified in place.
+    """
+
+    DIRNAME = "conversions"
+    """Name of the cache subdirectory within :func:`default_cache_dir`."""
+
+    DEFAULT_MAX_SIZE = 20 << 30
+    """Default maximum total size of cached images, in bytes."""
+
+    METADATA = ".metadata.json"
+    """Name of the file, within each entry, holding the image's metadata."""
+
+    def __init__(self, directory=None, max_size=None):
+        """Create a cache stored in the given directory.
+
+        Args:
+          directory (str): Cache directory; if unset, defaults to a
+              subdirectory of :func:`default_cache_dir` at time of use.
+          max_size (int): Maximum total size of cached images, in bytes;
+              if unset, defaults to ``$COT_CONVERSION_CACHE_SIZE`` or
+              :attr:`DEFAULT_MAX_SIZE`.
+        """
+        self.directory = directory
+        self._max_size = max_size
+
+    @property
+    def directory(self):
+        """Directory containing cached images, or None if disabled."""
+        if self._directory is not None:
+            return self._directory
+        directory = default_cache_dir()
+        if not directory:
+            return None
+        return os.path.join(directory, self.DIRNAME)
+
+    @directory.setter
+    def directory(self, value):
+        self._directory = value
+
+    @property
+    def max_size(self):
+        """Maximum total size of cached images, in bytes."""
+        if self._max_size is not None:
+            return self._max_size
+        value = os.environ.get('COT_CONVERSION_CACHE_SIZE')
+        if value:
+            try:
+                return int(value)
+            except ValueError:
+                logger.debug("Ignoring invalid COT_CONVERSION_CACHE_SIZE %s",
+                             value)
+        return self.DEFAULT_MAX_SIZE
+
+    @property
+    def enabled(self):
+        """Whether converted images are to be cached at all."""
+        return bool(self.directory) and self.max_size > 0
+
+    @staticmethod
+    def key(source_path, new_format, new_subformat, converter):
+        """Get the cache key for a conversion.
+
+        Args:
+          source_path (str): Path to the source image.
+          new_format (str): Format to convert to.
+          new_subformat (str): Sub-format to convert to, if any.
+          converter (str): Program and version performing the conversion.
+
+        Returns:
+          str: Hexadecimal key.
+        """
+        return hashlib.sha256(json.dumps(
+            [file_digest(source_path), new_format, new_subformat, converter]
+        ).encode('utf-8')).hexdigest()
+
+    def _entries(self):
+        """List the current cache entries.
+
+        Returns:
+          list: (last use time, size, path) tuples, oldest first.
+        """
+        entries = []
+        directory = self.directory
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            # Missing or inaccessible cache directory
+            return []
+        for name in names:
+            path = os.path.join(directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, member))
+                           for member in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                # Removed by someone else meanwhile
+                continue
+        return sorted(entries)
+
+    def lookup(self, key):
+        """Find the cached image, if any, for the given key.
+
+        Args:
+          key (str): Key identifying the image.
+
+        Returns:
+          str: Path to the cached image, or None if not cached.
+        """
+        entry = os.path.join(self.directory, key)
+        try:
+            (name,) = [name for name in os.listdir(entry)
+                       if not name.startswith(".")]
+        except (OSError, ValueError):
+            return None
+        return os.path.join(entry, name)
+
+    def fetch(self, key, path):
+        """Place the cached image, if any, at the given path.
+
+        Whatever was known about the cached image, such as its format and
+        digests, is recorded in :attr:`disk_metadata_cache` for the new
+        file as well.
+
+        Args:
+          key (str): Key identifying the image.
+          path (str): Path of the file to create.
+
+        Returns:
+          bool: Whether the image was cached.
+        """
+        cached = self.lookup(key)
+        if cached is None:
+            return False
+        entry = os.path.dirname(cached)
+        try:
+            method = clone_file(cached, path)
+            # Mark as recently used
+            os.utime(entry, None)
+        except (IOError, OSError) as exc:
+            logger.debug("Unable to use cached image %s: %s", cached, exc)
+            if os.path.lexists(path):
+                os.remove(path)
+            return False
+        try:
+            with open(os.path.join(entry, self.METADATA), 'r') as fileobj:
+                metadata = json.load(fileobj)
+            disk_metadata_cache.update(path, metadata)
+        except (IOError, OSError, ValueError) as exc:
+            logger.debug("No metadata for cached image %s: %s", cached, exc)
+        logger.verbose("Reusing cached image %s as %s (%s)",
+                       cached, path, method)
+        return True
+
+    def store(self, key, path):
+        """Add an image to the cache.
+
+        Args:
+          key (str): Key identifying the image.
+          path (str): Path to the image.
+        """
+        if os.path.getsize(path) > self.max_size:
+            return
+        directory = self.directory
+        metadata = disk_metadata_cache.get(path)
+        temp_dir = None
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            temp_dir = tempfile.mkdtemp(dir=directory, prefix=".")
+            clone_file(path, os.path.join(temp_dir, os.path.basename(path)))
+            # A new hard link changes the file's ctime, and hence identity
+            disk_metadata_cache.update(path, metadata)
+            with open(os.path.join(temp_dir, self.METADATA), 'w') as fileobj:
+                json.dump(metadata, fileobj)
+            os.rename(temp_dir, os.path.join(directory, key))
+            temp_dir = None
+        except (IOError, OSError) as exc:
+            # Including if another process cached the same image meanwhile
+            logger.debug("Unable to cache image %s: %s", path, exc)
+            return
+        finally:
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used images beyond the size limit."""
+        entries = self._entries()
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in entries:
+            if total <= self.max_size:
+                break
+            logger.debug("Evicting %s from cache", path)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove all cached images."""
+        directory = self.directory
+        if directory and os.path.isdir(directory):
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def convert(self, disk_image, new_format, new_directory,
+                new_subformat=None):
+        """Convert a disk image, reusing a cached conversion if possible.
+
+        Args:
+          disk_image (COT.disks.DiskRepresentation): Image to convert.
+          new_format (str): Format to convert to.
+          new_directory (str): Directory path to store new image into.
+          new_subformat (str): (optional) Sub-format to convert to.
+
+        Returns:
+          COT.disks.DiskRepresentation: Converted disk
+
+        .. seealso:: :meth:`~COT.disks.DiskRepresentation.convert_to`
+        """
+        subclass = disk_image.class_for_format(new_format)
+        if not self.enabled or subclass is None:
+            return disk_image.convert_to(new_format=new_format,
+                                         new_subformat=new_subformat,
+                                         new_directory=new_directory)
+        key = self.key(disk_image.path, new_format, new_subformat,
+                       subclass.converter(disk_image, new_subformat))
+        cached = self.lookup(key)
+        if cached is not None:
+            # Name the image as if just converted from this source
+            (prefix, _) = os.path.splitext(os.path.basename(disk_image.path))
+            (_, extension) = os.path.splitext(cached)
+            path = os.path.join(new_directory, prefix + extension)
+            if self.fetch(key, path):
+                return subclass(path)
+        new_image = disk_image.convert_to(new_format=new_format,
+                                          new_subformat=new_subformat,
+                                          new_directory=new_directory)
+        self.store(key, new_image.path)
+        return new_image
+
+
+class ConfigDiskCache(ConversionCache):
+    """Size-limited persistent store of generated configuration disks.
+
+    Each disk is stored under a key derived from its format and the name
+    and SHA-256 digest of each file it contains, so that injecting the same
+    configuration again reuses the disk built the first time, along with
+    its digests for the package manifest. A hard disk is stored as the
+    streamOptimized VMDK to be packaged, so reusing it needs no conversion.
+    """
+
+    DIRNAME = "config_disks"
+
+    DEFAULT_MAX_SIZE = 1 << 30
+
+    DIGESTS = ('sha1', 'sha256')
+    """Digests to record for each cached disk, as used in manifests."""
+
+    @staticmethod
+    def contents_key(disk_format, files, builder):
+        """Get the cache key for a disk containing the given files.
+
+        Args:
+          disk_format (str): Format of the disk, such as 'iso' or 'raw'.
+          files (list): Paths of files and/or directories to include.
+          builder (str): Program and version building the disk.
+
+        Returns:
+          str: Hexadecimal key.
+        """
+        contents = []
+        for path in files:
+            name = os.path.basename(path)
+            if not os.path.isdir(path):
+                contents.append([name, file_digest(path)])
+                continue
+            contents.append([name, None])
+            for (dirpath, dirnames, filenames) in os.walk(path):
+                dirnames.sort()
+                relpath = os.path.relpath(dirpath, os.path.dirname(path))
+                for dirname in dirnames:
+                    contents.append([os.path.join(relpath, dirname), None])
+                for filename in sorted(filenames):
+                    contents.append([
+                        os.path.join(relpath, filename),
+                        file_digest(os.path.join(dirpath, filename))])
+        return hashlib.sha256(json.dumps(
+            [disk_format, contents, builder]).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _build(path, disk_format, files):
+        """Create a disk containing the given files, without caching.
+
+        Args:
+          path (str): Location to create the disk image.
+          disk_format (str): Format of the disk, such as 'iso' or 'raw', or
+              'vmdk' for a RAW image converted to a streamOptimized VMDK,
+              as used for hard disks in OVF packages.
+          files (list): Paths of files and/or directories to include.
+
+        Returns:
+          COT.disks.DiskRepresentation: Created disk.
+        """
+        from COT.disks import DiskRepresentation
+        if disk_format != 'vmdk':
+            return DiskRepresentation.for_new_file(path, disk_format,
+                                                   files=files)
+        from COT.disks.vmdk import VMDK, StreamOptimizedWriter
+        (prefix, _) = os.path.splitext(path)
+        raw_image = DiskRepresentation.for_new_file(prefix + ".img", 'raw',
+                                                    files=files)
+        try:
+            StreamOptimizedWriter.convert(raw_image.path, path)
+        finally:
+            os.remove(raw_image.path)
+        return VMDK(path)
+
+    def create(self, path, disk_format, files):
+        """Create a disk containing the given files, reusing one if possible.
+
+        Args:
+          path (str): Location to create the disk image.
+          disk_format (str): Format of the disk, as for :meth:`_build`.
+          files (list): Paths of files and/or directories to include.
+
+        Returns:
+          COT.disks.DiskRepresentation: Created disk.
+
+        .. seealso:: :meth:`~COT.disks.DiskRepresentation.for_new_file`
+        """
+        from COT.disks import DiskRepresentation
+        if not self.enabled:
+            return self._build(path, disk_format, files)
+        subclass = DiskRepresentation.class_for_format(disk_format)
+        key = self.contents_key(disk_format, files,
+                                "COT {0}".format(__version__))
+        if self.fetch(key, path):
+            return subclass(path)
+        disk_image = self._build(path, disk_format, files)
+        for algorithm in self.DIGESTS:
+            file_digest(path, algorithm)
+        self.store(key, path)
+        return disk_image
+
+
+conversion_cache = ConversionCache()
+"""Cache used for disk conversions when building OVF packages."""
+
+config_disk_cache = ConfigDiskCache()
+"""Cache used for configuration disks built by ``cot inject-config``."""
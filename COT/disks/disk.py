@@ -12,21 +12,51 @@
 
 """Abstract base class for representations of disk image files."""
 
+from contextlib import contextmanager
 import logging
 import os
 import re
+import struct
 
+from COT import __version__
 from COT.helpers import helpers, HelperError
+from .cache import disk_metadata_cache
 
 logger = logging.getLogger(__name__)
 
 
+class NativeUnsupportedError(NotImplementedError):
+    """COT can't build this image natively, but a helper program might."""
+
+
 class DiskRepresentation(object):
     """Abstract disk image file representation."""
 
     disk_format = None
     """Disk format represented by this class."""
 
+    MAGIC_NUMBERS = (
+        (0, b"KDMV", "vmdk"),
+        (0, b"COWD", "vmdk"),
+        (0, b"# Disk DescriptorFile", "vmdk"),
+        (0, b"QFI\xfb\x00\x00\x00\x01", "qcow"),
+        (0, b"QFI\xfb", "qcow2"),
+        (0, b"conectix", "vpc"),
+        (0, b"vhdxfile", "vhdx"),
+        (0x40, b"\x7f\x10\xda\xbe", "vdi"),
+        (0x8001, b"CD001", "iso"),
+        (0x8801, b"CD001", "iso"),
+        (0x9001, b"CD001", "iso"),
+    )
+    """(Offset, magic number, disk format) triples, checked in order.
+
+    Includes some formats COT does not support, so that such files can be
+    rejected without further probing.
+    """
+
+    MAGIC_PROBE_SIZE = 4096
+    """Number of bytes read from the start of a file to check its magic."""
+
     @staticmethod
     def subclasses():
         """List of subclasses of DiskRepresentation.
@@ -53,10 +83,162 @@ class DiskRepresentation(object):
                      if subclass.disk_format == disk_format),
                     None)
 
+    @staticmethod
+    @contextmanager
+    def _opened(path_or_obj):
+        """Get a binary file object for reading the given file.
+
+        Args:
+          path_or_obj (str): File path OR an opened, seekable binary file
+            object, which is used as-is and left open.
+
+        Yields:
+          file: File object
+        """
+        try:
+            path_or_obj.read(0)
+        except AttributeError:
+            with open(path_or_obj, 'rb') as fileobj:
+                yield fileobj
+        else:
+            yield path_or_obj
+
+    @staticmethod
+    def _file_size(fileobj):
+        """Get the size of the given file object by seeking to its end.
+
+        Args:
+          fileobj (file): Seekable file object.
+
+        Returns:
+          int: Size of the file in bytes.
+        """
+        fileobj.seek(0, os.SEEK_END)
+        return fileobj.tell()
+
+    @classmethod
+    def format_from_magic(cls, path_or_obj):
+        """Identify the format of a file from its magic number, if possible.
+
+        Reads the start of the file and the ISO 9660 volume descriptor
+        offsets once, and compares them against :attr:`MAGIC_NUMBERS`.
+
+        Args:
+          path_or_obj (str): Path of existing file to check OR an opened,
+            seekable binary file object.
+
+        Returns:
+          str: Disk format, such as 'vmdk' or 'qcow', or None if no
+          known magic number was found.
+        """
+        with cls._opened(path_or_obj) as fileobj:
+            fileobj.seek(0)
+            head = fileobj.read(cls.MAGIC_PROBE_SIZE)
+            for (offset, magic, disk_format) in cls.MAGIC_NUMBERS:
+                if offset + len(magic) <= cls.MAGIC_PROBE_SIZE:
+                    data = head[offset:offset + len(magic)]
+                else:
+                    fileobj.seek(offset)
+                    data = fileobj.read(len(magic))
+                if data == magic:
+                    logger.debug("File %s has the magic number of a %s",
+                                 path_or_obj, disk_format)
+                    return disk_format
+        return None
+
+    @staticmethod
+    def identify(path_or_obj):
+        """Identify a disk image and get its properties from its header.
+
+        Unlike :meth:`from_file`, this never runs a helper program and only
+        reads the few KB of the file needed by :meth:`format_from_magic`
+        and :meth:`read_header`, so it is well suited to files that are not
+        directly on disk, such as a member of an OVA's TAR archive.
+        As with ``qemu-img``, a file with no known magic number is assumed
+        to be a raw image.
+
+        Args:
+          path_or_obj (str): Path of existing file to check OR an opened,
+            seekable binary file object.
+
+        Returns:
+          tuple: ``(disk_format, disk_subformat, capacity_bytes)``, where
+          the subformat and capacity may be ``None`` if not determined,
+          or ``None`` if the file is not of a supported type or its header
+          could not be understood.
+        """
+        try:
+            with DiskRepresentation._opened(path_or_obj) as fileobj:
+                disk_format = (DiskRepresentation.format_from_magic(fileobj) or
+                               'raw')
+                subclass = DiskRepresentation.class_for_format(disk_format)
+                if subclass is None:
+                    logger.debug("No support for files of type '%s'",
+                                 disk_format)
+                    return None
+                header = subclass.read_header(fileobj)
+        except (IOError, ValueError, struct.error) as exc:
+            logger.debug("Unable to parse header of %s: %s",
+                         path_or_obj, exc)
+            return None
+        if header is None:
+            return None
+        (subformat, capacity) = header
+        return (disk_format, subformat, capacity)
+
+    @staticmethod
+    def _class_from_cache(path):
+        """Get the subclass for the given file as previously determined.
+
+        Args:
+          path (str): Path of existing file.
+
+        Returns:
+          class: DiskRepresentation subclass, or None if not known.
+        """
+        disk_format = disk_metadata_cache.get(path).get('format')
+        if disk_format is None:
+            return None
+        subclass = DiskRepresentation.class_for_format(disk_format)
+        if subclass is not None:
+            logger.verbose("File %s is a %s, based on previous inspection",
+                           path, disk_format)
+        return subclass
+
+    @staticmethod
+    def _class_from_magic(path):
+        """Get the subclass for the given file based on its magic number.
+
+        Args:
+          path (str): Path of existing file.
+
+        Returns:
+          class: DiskRepresentation subclass, or None if the file has no
+          known magic number.
+
+        Raises:
+          NotImplementedError: if the magic number is of an unsupported type.
+        """
+        disk_format = DiskRepresentation.format_from_magic(path)
+        if disk_format is None:
+            return None
+        subclass = DiskRepresentation.class_for_format(disk_format)
+        if subclass is None:
+            raise NotImplementedError("No support for files of type '{0}'"
+                                      .format(disk_format))
+        logger.verbose("File %s appears to be a %s, based on its magic "
+                       "number", path, disk_format)
+        disk_metadata_cache.update(path, {'format': disk_format})
+        return subclass
+
     @staticmethod
     def from_file(path):
         """Get a DiskRepresentation instance appropriate to the given file.
 
+        Formats recognized by :meth:`format_from_magic` are identified
+        directly; otherwise each remaining subclass is asked how confident
+        it is that the file is of its type (see :meth:`file_is_this_type`).
+
         Args:
           path (str): Path of existing file to represent.
 
@@ -69,9 +251,20 @@ class DiskRepresentation(object):
         """
         if not os.path.exists(path):
             raise IOError(2, "No such file or directory: {0}".format(path))
+        subclass = DiskRepresentation._class_from_cache(path)
+        if subclass is None:
+            subclass = DiskRepresentation._class_from_magic(path)
+        if subclass is not None:
+            return subclass(path)
+
+        # Only formats without a magic number need to be probed further
+        magic_formats = set(entry[2] for entry in
+                            DiskRepresentation.MAGIC_NUMBERS)
         best_guess = None
         best_confidence = 0
         for subclass in DiskRepresentation.subclasses():
+            if subclass.disk_format in magic_formats:
+                continue
             confidence = subclass.file_is_this_type(path)
             if confidence > best_confidence:
                 logger.debug("File %s may be a %s, with confidence %d%%",
@@ -91,6 +284,9 @@ class DiskRepresentation(object):
                                "image, but COT has low confidence (%s%%) "
                                "in this guess.",
                                path, best_guess.disk_format, best_confidence)
+            else:
+                disk_metadata_cache.update(
+                    path, {'format': best_guess.disk_format})
             return best_guess(path)
         else:
             raise NotImplementedError("No support for files of this type")
@@ -135,6 +331,61 @@ class DiskRepresentation(object):
         self._disk_subformat = None
         self._capacity = None
         self._files = None
+        self._header_read = False
+        self._metadata = {}
+        if self.disk_format is not None:
+            self._metadata = disk_metadata_cache.get(path).get(
+                self.disk_format, {})
+            self._disk_subformat = self._metadata.get('subformat')
+            self._capacity = self._metadata.get('capacity')
+            self._files = self._metadata.get('files')
+
+    def _read_header_info(self):
+        """Fill in subformat and capacity from the file header, if possible.
+
+        Uses :meth:`read_header`, at most once per instance. Any values that
+        it is unable to determine are left unset for the caller to fill in
+        by other means (typically ``qemu-img``).
+        """
+        if self._header_read:
+            return
+        self._header_read = True
+        try:
+            header = self.read_header(self.path)
+        except (IOError, ValueError, struct.error) as exc:
+            logger.debug("Unable to parse %s header of %s: %s",
+                         self.disk_format, self.path, exc)
+            header = None
+        if header is None:
+            return
+        (subformat, capacity) = header
+        if self._disk_subformat is None:
+            self._disk_subformat = subformat
+        if self._capacity is None and capacity is not None:
+            self._capacity = str(capacity)
+            logger.debug("Disk %s capacity is %s bytes (from %s header)",
+                         self.path, self._capacity, self.disk_format)
+        self._save_metadata()
+
+    def _save_metadata(self):
+        """Record any newly learned properties in the disk metadata cache.
+
+        Subclass properties should call this after determining a value by
+        inspecting the file, so that later instances (including in later
+        COT invocations) representing the unmodified file can reuse it.
+        """
+        if self.disk_format is None:
+            return
+        metadata = {}
+        for (key, value) in (('subformat', self._disk_subformat),
+                             ('capacity', self._capacity),
+                             ('files', self._files)):
+            if value is not None:
+                metadata[key] = value
+        if metadata == self._metadata:
+            return
+        self._metadata = metadata
+        disk_metadata_cache.update(self.path, {self.disk_format: metadata})
 
     @property
     def path(self):
@@ -149,6 +400,8 @@ class DiskRepresentation(object):
     @property
     def capacity(self):
         """Capacity of this disk image, in bytes."""
+        if self._capacity is None:
+            self._read_header_info()
         # default implementation - qemu-img handles most types we need
         if self._capacity is None:
             output = helpers['qemu-img'].call(['info', self.path])
@@ -160,6 +413,7 @@ class DiskRepresentation(object):
             self._capacity = match.group(1)
             logger.debug("Disk %s capacity is %s bytes", self.path,
                          self._capacity)
+            self._save_metadata()
         return self._capacity
 
     @property
@@ -169,6 +423,29 @@ class DiskRepresentation(object):
             return self._files
         raise NotImplementedError("Unable to determine file contents")
 
+    def iter_files(self, contents=False):
+        """Iterate over the files embedded in this disk image.
+
+        Subclasses that can read their file system natively override this
+        to walk it lazily, so that callers can stop early or inspect file
+        contents without extracting the image.
+
+        Args:
+          contents (bool): Whether to also read the contents of each file.
+
+        Yields:
+          str: Path of each file or directory, relative to the root, or if
+          ``contents`` is set, a tuple (path, data) where data is the file
+          contents as bytes, or None for a directory.
+
+        Raises:
+          NotImplementedError: if the contents cannot be read.
+        """
+        if contents:
+            raise NotImplementedError("Unable to read file contents")
+        for path in self.files:
+            yield path
+
     @property
     def predicted_drive_type(self):
         """Disk drive type typically used for a Disk of this type.
@@ -216,6 +493,44 @@ class DiskRepresentation(object):
         """
         raise NotImplementedError("Not a valid target for conversion")
 
+    @classmethod
+    def converter(cls, input_image,  # pylint: disable=unused-argument
+                  output_subformat=None):  # pylint: disable=unused-argument
+        """Identify the programs :meth:`from_other_image` would use.
+
+        Any change in the result means that a conversion may produce
+        different output, so earlier conversions should not be reused.
+
+        Args:
+          input_image (DiskRepresentation): Existing image representation.
+          output_subformat (str): Any relevant subformat information.
+
+        Returns:
+          str: Description of the converting programs and their versions.
+        """
+        # Most conversions use qemu-img, possibly alongside COT itself
+        return "COT {0}, qemu-img {1}".format(__version__,
+                                              helpers['qemu-img'].version)
+
+    @classmethod
+    def read_header(cls, path_or_obj):
+        """Natively parse the header of a file of this type.
+
+        Subclasses for formats with a well-defined header should override
+        this, so that common queries do not require a helper program.
+
+        Args:
+          path_or_obj (str): Path to file to read OR an opened, seekable
+            binary file object.
+
+        Returns:
+          tuple: ``(disk_subformat, capacity_bytes)``, either of which may
+          be ``None`` if not determined, or ``None`` if the file does not
+          appear to be of this type or its header could not be understood.
+        """
+        # pylint: disable=unused-argument
+        return None
+
     @classmethod
     def file_is_this_type(cls, path):
         """Check if the given file is image type represented by this class.
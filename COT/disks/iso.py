@@ -10,13 +10,26 @@
 # of COT, including this file, may be copied, modified, propagated, or
 # distributed except according to the terms contained in the LICENSE.txt file.
 
-"""Handling of ISO files."""
+"""Handling of ISO files.
+
+**Classes**
+
+.. autosummary::
+  :nosignatures:
+
+  ISO
+  ISO9660Reader
+  ISO9660Writer
+"""
 
 import logging
 import os
 import re
+import stat
+import struct
+import time
 
-from COT.disks.disk import DiskRepresentation
+from COT.disks.disk import DiskRepresentation, NativeUnsupportedError
 from COT.helpers import helpers, HelperError, helper_select
 
 logger = logging.getLogger(__name__)
@@ -27,6 +40,105 @@ class ISO(DiskRepresentation):
 
     disk_format = "iso"
 
+    SECTOR_SIZE = 2048
+    """Size of an ISO 9660 logical sector."""
+
+    FIRST_VOLUME_DESCRIPTOR = 16
+    """Sector number of the first volume descriptor."""
+
+    MAX_VOLUME_DESCRIPTORS = 32
+    """Give up looking for the primary volume descriptor after this many."""
+
+    ROCK_RIDGE_ENTRIES = frozenset([
+        b"RR", b"PX", b"PN", b"SL", b"NM", b"CL", b"PL", b"RE", b"TF", b"SF",
+    ])
+    """System Use Sharing Protocol signatures defined by Rock Ridge."""
+
+    ROCK_RIDGE_IDS = frozenset([b"RRIP_1991A", b"IEEE_P1282", b"IEEE_1282"])
+    """Extension identifiers declaring Rock Ridge in an ``ER`` entry."""
+
+    @classmethod
+    def read_header(cls, path_or_obj):
+        """Parse the volume descriptors and root directory of an ISO.
+
+        For the parameters, see :meth:`DiskRepresentation.read_header`.
+        """
+        with cls._opened(path_or_obj) as fileobj:
+            pvd = cls._primary_volume_descriptor(fileobj)
+            if pvd is None:
+                return None
+            if cls._root_has_rock_ridge(fileobj, pvd):
+                subformat = "rockridge"
+            else:
+                subformat = ""
+            # Like qemu-img, treat the image as a block device of its own size
+            return (subformat, cls._file_size(fileobj))
+
+    @classmethod
+    def _primary_volume_descriptor(cls, fileobj):
+        """Find the primary volume descriptor of an ISO 9660 image.
+
+        Args:
+          fileobj (file): Image opened for binary reading.
+
+        Returns:
+          bytearray: Primary volume descriptor, or None if not an ISO.
+        """
+        for index in range(cls.MAX_VOLUME_DESCRIPTORS):
+            fileobj.seek((cls.FIRST_VOLUME_DESCRIPTOR + index) *
+                         cls.SECTOR_SIZE)
+            descriptor = bytearray(fileobj.read(cls.SECTOR_SIZE))
+            if (len(descriptor) < cls.SECTOR_SIZE or
+                    descriptor[1:6] != b"CD001"):
+                return None
+            if descriptor[0] == 1:
+                return descriptor
+            if descriptor[0] == 255:
+                # Volume descriptor set terminator
+                return None
+        return None
+
+    @classmethod
+    def _root_has_rock_ridge(cls, fileobj, pvd):
+        """Check the root directory's System Use area for Rock Ridge entries.
+
+        Args:
+          fileobj (file): Image opened for binary reading.
+          pvd (bytearray): Primary volume descriptor.
+
+        Returns:
+          bool: Whether Rock Ridge extensions are present.
+        """
+        (block_size,) = struct.unpack_from("<H", pvd, 128)
+        # The root directory record is at offset 156 of the PVD, and
+        # the location of its extent is at offset 2 of the record.
+        (extent,) = struct.unpack_from("<I", pvd, 158)
+        fileobj.seek(extent * block_size)
+        # The first record in the root directory is its '.' entry
+        record = bytearray(fileobj.read(255))
+        if len(record) < 34:
+            return False
+        record_len = record[0]
+        name_len = record[32]
+        # System Use area follows the name, padded to an even offset
+        offset = 33 + name_len + (1 - name_len % 2)
+        while offset + 4 <= record_len:
+            signature = bytes(record[offset:offset + 2])
+            entry_len = record[offset + 2]
+            if entry_len < 4:
+                break
+            if signature in cls.ROCK_RIDGE_ENTRIES:
+                return True
+            if signature == b"ER":
+                id_len = record[offset + 4]
+                ext_id = bytes(record[offset + 8:offset + 8 + id_len])
+                if ext_id in cls.ROCK_RIDGE_IDS:
+                    return True
+            if signature == b"ST":
+                break
+            offset += entry_len
+        return False
+
     @property
     def disk_subformat(self):
         """ISO sub-format.
@@ -36,6 +148,8 @@ class ISO(DiskRepresentation):
         - "" - not Rock Ridge
         - "rockridge" - has Rock Ridge extensions
         """
+        if self._disk_subformat is None:
+            self._read_header_info()
         if self._disk_subformat is None:
             output = helpers['isoinfo'].call(['-i', self.path, '-d'])
             if re.search(r"Rock Ridge.*found", output):
@@ -43,11 +157,18 @@ class ISO(DiskRepresentation):
             else:
                 # At this time we don't care about Joliet extensions
                 self._disk_subformat = ""
+            self._save_metadata()
         return self._disk_subformat
 
     @property
     def files(self):
         """Get the list of files contained in this ISO."""
+        if self._files is None:
+            try:
+                self._files = list(self.iter_files())
+            except (IOError, ValueError, struct.error) as exc:
+                logger.debug("Unable to read directories of %s natively "
+                             "(%s); trying isoinfo instead", self.path, exc)
         if self._files is None:
             if helpers['isoinfo']:    # TODO
                 # It's safe to specify -R even for non-rockridge ISOs
@@ -68,8 +189,20 @@ class ISO(DiskRepresentation):
                     # Strip the leading '/'
                     result.append(line[1:])
                 self._files = result
+        self._save_metadata()
         return self._files
 
+    def iter_files(self, contents=False):
+        """Iterate over the files and directories contained in this ISO.
+
+        The directory tables are read natively by :class:`ISO9660Reader`.
+
+        For the parameters, see :meth:`DiskRepresentation.iter_files`.
+        """
+        with open(self.path, 'rb') as fileobj:
+            for item in ISO9660Reader(fileobj).walk(contents):
+                yield item
+
     @property
     def predicted_drive_type(self):
         """Disk drive type typically used for a Disk of this type.
@@ -83,6 +216,10 @@ class ISO(DiskRepresentation):
     def _create_file(path, disk_subformat="rockridge", files=None, **kwargs):
         """Create an ISO file.
 
+        The image is built natively by :class:`ISO9660Writer` where
+        possible, falling back to ``mkisofs``, ``genisoimage``, or
+        ``xorriso`` for contents it does not support.
+
         Args:
           path (str): Location to create the ISO file.
           disk_subformat (str): Defaults to "rockridge". Set to "" to not
@@ -92,6 +229,13 @@ class ISO(DiskRepresentation):
         """
         if not files:
             raise RuntimeError("Unable to create an empty ISO file")
+        try:
+            ISO9660Writer.create(path, files,
+                                 rock_ridge=(disk_subformat == 'rockridge'))
+            return
+        except NativeUnsupportedError as exc:
+            logger.verbose("Unable to build ISO natively (%s); "
+                           "using an external tool instead", exc)
         # We can use mkisofs, genisoimage, or xorriso, and fortunately
         # all three take similar parameters
         args = ['-output', path, '-full-iso9660-filenames',
@@ -120,21 +264,15 @@ class ISO(DiskRepresentation):
         if not os.path.exists(path):
             raise HelperError(2, "No such file or directory: '{0}'"
                               .format(path))
-        if helpers['isoinfo']:
-            logger.debug("Using 'isoinfo' to check whether %s is an ISO", path)
-            try:
-                helpers['isoinfo'].call(['-i', path, '-d'])
-                return 100
-            except HelperError:
-                # Not an ISO
-                return 0
-
-        # else, try to detect ISO files by file magic number
+        # Detect ISO files by the magic number in their volume descriptors;
+        # any file isoinfo would accept has one.
         with open(path, 'rb') as fileobj:
             for offset in (0x8001, 0x8801, 0x9001):
                 fileobj.seek(offset)
                 magic = fileobj.read(5).decode('ascii', 'ignore')
                 if magic == "CD001":
+                    logger.debug("Found ISO 9660 volume descriptor in %s",
+                                 path)
                     return 100
         return 0
 
@@ -151,3 +289,907 @@ class ISO(DiskRepresentation):
           NotImplementedError: non-trivial to convert other types to ISO
         """
         raise NotImplementedError("Not a valid target for conversion")
+
+
+def _both16(value):
+    """Encode a 16-bit value in both-byte-order form (ECMA-119 7.2.3)."""
+    return struct.pack("<H", value) + struct.pack(">H", value)
+
+
+def _both32(value):
+    """Encode a 32-bit value in both-byte-order form (ECMA-119 7.3.3)."""
+    return struct.pack("<I", value) + struct.pack(">I", value)
+
+
+class _ISOEntry(object):
+    """A file or directory to be recorded in an ISO 9660 image."""
+
+    def __init__(self, name, parent=None, path=None):
+        """Create an entry.
+
+        Args:
+          name (str): Original (Rock Ridge) name of this entry.
+          parent (_ISOEntry): Containing directory, or None for the root.
+          path (str): Source file path, or None for a directory.
+        """
+        self.name = name
+        self.parent = parent
+        self.path = path
+        self.depth = parent.depth + 1 if parent else 1
+        self.children = {} if path is None else None
+        self.entries = []
+        """Children, sorted by ISO 9660 identifier."""
+        self.records = []
+        """Directory records making up this directory's extent."""
+        self.identifier = None
+        self.number = None
+        self.lba = 0
+        self.size = 0
+        self.mtime = 0
+        self.mode = 0o40555
+
+    @property
+    def is_dir(self):
+        """Whether this entry is a directory."""
+        return self.children is not None
+
+
+class _ISORecord(object):
+    """A directory record, as laid out by :class:`ISO9660Writer`."""
+
+    CE_LENGTH = 28
+    """Length of a SUSP continuation area (``CE``) entry."""
+
+    def __init__(self, entry, identifier, system_use=b"", continuation=b""):
+        """Create a record.
+
+        Args:
+          entry (_ISOEntry): File or directory described by this record.
+          identifier (bytes): File identifier.
+          system_use (bytes): System Use entries recorded in the record.
+          continuation (bytes): System Use entries that must be recorded
+            in a continuation area instead.
+        """
+        self.entry = entry
+        self.identifier = identifier
+        self.system_use = system_use
+        self.continuation = continuation
+        self.continuation_location = None
+
+    @property
+    def length(self):
+        """Length of this record in bytes."""
+        length = (33 + len(self.identifier) + 1 - len(self.identifier) % 2 +
+                  len(self.system_use))
+        if self.continuation:
+            length += self.CE_LENGTH
+        return length + length % 2
+
+
+class ISO9660Writer(object):
+    """Writer of ISO 9660 level 2 images, optionally with Rock Ridge.
+
+    Produces the same directory contents as ``mkisofs -iso-level 2 -r``:
+    each listed file is placed at the root of the image and the contents
+    of each listed directory are merged into the root. Rock Ridge ownership
+    and permissions are normalized as by ``-r``, and every timestamp comes
+    from the input files (or ``$SOURCE_DATE_EPOCH``), so the same inputs
+    always produce an identical image.
+
+    Raises :exc:`~COT.disks.disk.NativeUnsupportedError` for inputs that
+    this writer does not handle, such as files too large for a single
+    extent, directories nested deeper than ISO 9660 permits, or special
+    files.
+
+    Examples:
+      ::
+
+        >>> import io, shutil, tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> path = os.path.join(directory, "config.txt")
+        >>> with open(path, 'w') as fileobj:
+        ...     _ = fileobj.write("hostname foo")
+        >>> output = io.BytesIO()
+        >>> ISO9660Writer([path], timestamp=0).write(output)
+        47104
+        >>> ISO.read_header(output)
+        ('rockridge', 47104)
+        >>> shutil.rmtree(directory)
+    """
+
+    SECTOR_SIZE = ISO.SECTOR_SIZE
+
+    MAX_DEPTH = 8
+    """Maximum number of levels in the directory hierarchy."""
+
+    MAX_FILE_SIZE = 0xffffffff
+    """Largest file that can be recorded as a single extent."""
+
+    MAX_NAME_LENGTH = 30
+    """Maximum length of a level 2 file name plus extension."""
+
+    MAX_EXTENSION_LENGTH = 8
+    """Extensions longer than this are truncated in ISO 9660 names."""
+
+    RRIP_ID = b"RRIP_1991A"
+    RRIP_DESCRIPTOR = (b"THE ROCK RIDGE INTERCHANGE PROTOCOL PROVIDES "
+                       b"SUPPORT FOR POSIX FILE SYSTEM SEMANTICS")
+    RRIP_SOURCE = (b"PLEASE CONTACT DISC PUBLISHER FOR SPECIFICATION "
+                   b"SOURCE.  SEE PUBLISHER IDENTIFIER IN PRIMARY VOLUME "
+                   b"DESCRIPTOR FOR CONTACT INFORMATION.")
+
+    def __init__(self, files, rock_ridge=True, volume_id="CDROM",
+                 timestamp=None):
+        """Prepare to write an ISO containing the given files.
+
+        Args:
+          files (list): Paths of files and/or directories to include.
+          rock_ridge (bool): Whether to include Rock Ridge extensions.
+          volume_id (str): Volume identifier.
+          timestamp (int): Time (seconds since the epoch) to record for
+            the volume and its directories; defaults to
+            ``$SOURCE_DATE_EPOCH`` if set, else the newest file time.
+
+        Raises:
+          NativeUnsupportedError: if the files cannot be recorded natively.
+          ValueError: if two files would have the same name.
+        """
+        self.rock_ridge = rock_ridge
+        self.volume_id = volume_id
+        self.root = _ISOEntry("")
+        for path in files:
+            if os.path.isdir(path):
+                self._add_directory(self.root, path)
+            else:
+                self._add_file(self.root, os.path.basename(path), path)
+        if timestamp is None:
+            if os.environ.get('SOURCE_DATE_EPOCH'):
+                timestamp = int(os.environ['SOURCE_DATE_EPOCH'])
+            else:
+                timestamp = max([0] + [entry.mtime for entry in
+                                       self._walk(self.root)])
+        self.timestamp = timestamp
+        self._directories = []
+        self._files = []
+        self._continuation_sectors = []
+        self._path_table_size = 0
+        self._path_table_lbas = (0, 0)
+        self._total_sectors = 0
+
+    @classmethod
+    def create(cls, path, files, **kwargs):
+        """Create an ISO file containing the given files.
+
+        Args:
+          path (str): Path of the ISO file to create.
+          files (list): Paths of files and/or directories to include.
+          **kwargs: Passed through to the class constructor.
+
+        Returns:
+          int: Size of the created ISO file, in bytes.
+        """
+        writer = cls(files, **kwargs)
+        try:
+            with open(path, 'wb') as fileobj:
+                return writer.write(fileobj)
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+    def _walk(self, directory):
+        """Iterate over all files and directories within a directory.
+
+        Args:
+          directory (_ISOEntry): Directory to walk.
+
+        Yields:
+          _ISOEntry: Each entry, depth-first.
+        """
+        for entry in directory.children.values():
+            yield entry
+            if entry.is_dir:
+                for child in self._walk(entry):
+                    yield child
+
+    def _add_file(self, directory, name, path):
+        """Add a file to the given directory.
+
+        Args:
+          directory (_ISOEntry): Directory to add to.
+          name (str): Name of the file within the image.
+          path (str): Path of the source file.
+
+        Raises:
+          NativeUnsupportedError: if not a regular file or too large.
+          ValueError: if the name is already in use.
+        """
+        if name in directory.children:
+            raise ValueError("Multiple files named '{0}' in the same "
+                             "ISO directory".format(name))
+        info = os.stat(path)
+        if not stat.S_ISREG(info.st_mode):
+            raise NativeUnsupportedError("'{0}' is not a regular file"
+                                         .format(path))
+        if info.st_size > self.MAX_FILE_SIZE:
+            raise NativeUnsupportedError("'{0}' is too large for a single "
+                                         "ISO 9660 extent".format(path))
+        entry = _ISOEntry(name, directory, path)
+        entry.size = info.st_size
+        entry.mtime = int(info.st_mtime)
+        entry.mode = stat.S_IFREG | 0o444
+        if info.st_mode & 0o111:
+            entry.mode |= 0o111
+        directory.children[name] = entry
+
+    def _add_directory(self, directory, path):
+        """Merge the contents of a directory into the given directory.
+
+        Args:
+          directory (_ISOEntry): Directory to add to.
+          path (str): Path of the source directory.
+
+        Raises:
+          NativeUnsupportedError: if nested too deeply.
+          ValueError: if a name is already in use.
+        """
+        for name in sorted(os.listdir(path)):
+            child_path = os.path.join(path, name)
+            if not os.path.isdir(child_path):
+                self._add_file(directory, name, child_path)
+                continue
+            child = directory.children.get(name)
+            if child is None:
+                if directory.depth >= self.MAX_DEPTH:
+                    raise NativeUnsupportedError(
+                        "'{0}' is nested too deeply for ISO 9660"
+                        .format(child_path))
+                child = _ISOEntry(name, directory)
+                directory.children[name] = child
+            elif not child.is_dir:
+                raise ValueError("Multiple files named '{0}' in the same "
+                                 "ISO directory".format(name))
+            self._add_directory(child, child_path)
+
+    def _assign_identifiers(self, directory):
+        """Choose unique ISO 9660 identifiers for a directory's children.
+
+        Like ``mkisofs -allow-lowercase``, characters other than letters,
+        digits, and underscores are replaced, and overlong names truncated.
+
+        Args:
+          directory (_ISOEntry): Directory whose children to name.
+        """
+        used = set()
+        keys = {}
+        for name in sorted(directory.children):
+            entry = directory.children[name]
+            clean = re.sub(r"[^A-Za-z0-9_.]", "_", name)
+            if entry.is_dir:
+                (stem, ext) = (clean.replace(".", "_"), None)
+            else:
+                (stem, dot, ext) = clean.rpartition(".")
+                if not dot:
+                    (stem, ext) = (ext, "")
+                stem = stem.replace(".", "_")
+                ext = ext[:self.MAX_EXTENSION_LENGTH]
+            counter = 0
+            while True:
+                suffix = str(counter) if counter else ""
+                if ext is None:
+                    room = self.MAX_NAME_LENGTH + 1 - len(suffix)
+                    (name_part, ext_part) = (stem[:room] + suffix, "")
+                    identifier = name_part
+                else:
+                    room = self.MAX_NAME_LENGTH - len(ext) - len(suffix)
+                    (name_part, ext_part) = (stem[:room] + suffix, ext)
+                    identifier = name_part + "." + ext_part + ";1"
+                if identifier.upper() not in used:
+                    break
+                counter += 1
+            used.add(identifier.upper())
+            entry.identifier = identifier.encode('ascii')
+            keys[entry.identifier] = (name_part, ext_part)
+        directory.entries = sorted(directory.children.values(),
+                                   key=lambda e: keys[e.identifier])
+
+    def _record_date(self, timestamp):
+        """Encode a directory record date and time (ECMA-119 9.1.5).
+
+        Args:
+          timestamp (int): Seconds since the epoch.
+
+        Returns:
+          bytes: 7-byte recording date and time, in UTC.
+        """
+        when = time.gmtime(timestamp)
+        return struct.pack("7B", max(0, min(when.tm_year - 1900, 255)),
+                           when.tm_mon, when.tm_mday, when.tm_hour,
+                           when.tm_min, when.tm_sec, 0)
+
+    def _volume_date(self, timestamp):
+        """Encode a volume descriptor date and time (ECMA-119 8.4.26.1).
+
+        Args:
+          timestamp (int): Seconds since the epoch.
+
+        Returns:
+          bytes: 17-byte date and time, in UTC.
+        """
+        text = time.strftime("%Y%m%d%H%M%S", time.gmtime(timestamp))
+        return text.encode('ascii') + b"00\0"
+
+    def _system_use(self, entry, named, is_root_dot=False):
+        """Build the Rock Ridge System Use entries for a directory record.
+
+        Args:
+          entry (_ISOEntry): File or directory described by the record.
+          named (bool): Whether to record the name of the entry (i.e., the
+            record is not a '.' or '..' record).
+          is_root_dot (bool): Whether this is the root '.' record, which
+            identifies the extensions in use.
+
+        Returns:
+          tuple: (list of entries, bytes that must be in a continuation area)
+        """
+        if not self.rock_ridge:
+            return ([], b"")
+        entries = []
+        continuation = b""
+        if is_root_dot:
+            entries.append(b"SP\x07\x01\xbe\xef\x00")
+            continuation = (
+                b"ER" +
+                struct.pack("6B", 8 + len(self.RRIP_ID) +
+                            len(self.RRIP_DESCRIPTOR) + len(self.RRIP_SOURCE),
+                            1, len(self.RRIP_ID), len(self.RRIP_DESCRIPTOR),
+                            len(self.RRIP_SOURCE), 1) +
+                self.RRIP_ID + self.RRIP_DESCRIPTOR + self.RRIP_SOURCE)
+        # RR entry flags: PX and TF always, NM where named
+        entries.append(b"RR\x05\x01" +
+                       struct.pack("B", 0x89 if named else 0x81))
+        if entry.is_dir:
+            links = 2 + len([child for child in entry.entries
+                             if child.is_dir])
+        else:
+            links = 1
+        entries.append(b"PX\x24\x01" + _both32(entry.mode) + _both32(links) +
+                       _both32(0) + _both32(0))
+        # Modification, access, and attribute change times
+        entries.append(b"TF\x1a\x01\x0e" + self._record_date(entry.mtime) * 3)
+        if named:
+            name = entry.name
+            if not isinstance(name, bytes):
+                name = name.encode('utf-8')
+            for start in range(0, len(name), 250):
+                chunk = name[start:start + 250]
+                more = 1 if start + 250 < len(name) else 0
+                entries.append(b"NM" + struct.pack("3B", 5 + len(chunk), 1,
+                                                   more) + chunk)
+        return (entries, continuation)
+
+    def _make_record(self, entry, identifier, named=True, is_root_dot=False):
+        """Lay out a directory record, moving System Use data as needed.
+
+        Args:
+          entry (_ISOEntry): File or directory described by the record.
+          identifier (bytes): File identifier of the record.
+          named (bool): See :meth:`_system_use`.
+          is_root_dot (bool): See :meth:`_system_use`.
+
+        Returns:
+          _ISORecord: Record whose length is at most 255 bytes.
+        """
+        (entries, continuation) = self._system_use(entry, named,
+                                                   is_root_dot)
+        record = _ISORecord(entry, identifier)
+        # Leave room for padding the record to an even length
+        room = 254 - record.length
+        if not continuation and sum(len(item) for item in entries) <= room:
+            record.system_use = b"".join(entries)
+            return record
+        rest = []
+        used = record.CE_LENGTH
+        for item in entries:
+            if not rest and used + len(item) <= room:
+                record.system_use += item
+                used += len(item)
+            else:
+                rest.append(item)
+        record.continuation = b"".join(rest) + continuation
+        return record
+
+    def _layout(self):
+        """Assign identifiers, records, and locations to everything.
+
+        Returns:
+          int: Total size of the image, in sectors.
+        """
+        sector = self.SECTOR_SIZE
+        directories = [self.root]
+        for directory in directories:
+            self._assign_identifiers(directory)
+            directories.extend(entry for entry in directory.entries
+                               if entry.is_dir)
+        self._directories = directories
+        self._files = [entry for directory in directories
+                       for entry in directory.entries if not entry.is_dir]
+
+        path_table_size = 0
+        for (number, directory) in enumerate(directories, 1):
+            directory.number = number
+            directory.mtime = self.timestamp
+            length = len(directory.identifier or b"\0")
+            path_table_size += 8 + length + length % 2
+        self._path_table_size = path_table_size
+        path_table_sectors = -(-path_table_size // sector)
+
+        for directory in directories:
+            self._layout_directory(directory)
+
+        # System area, volume descriptor set, then two path tables
+        lba = ISO.FIRST_VOLUME_DESCRIPTOR + 2
+        self._path_table_lbas = (lba, lba + path_table_sectors)
+        lba += 2 * path_table_sectors
+        for directory in directories:
+            directory.lba = lba
+            lba += directory.size // sector
+
+        lba = self._layout_continuations(lba)
+
+        for entry in self._files:
+            entry.lba = lba
+            lba += -(-entry.size // sector)
+        self._total_sectors = lba
+        return lba
+
+    def _layout_directory(self, directory):
+        """Lay out the records of a directory and hence its size.
+
+        Helper method for :meth:`_layout`.
+
+        Args:
+          directory (_ISOEntry): Directory whose children have already
+            been assigned identifiers.
+        """
+        sector = self.SECTOR_SIZE
+        directory.records = [
+            self._make_record(directory, b"\0", False,
+                              directory is self.root),
+            self._make_record(directory.parent or directory, b"\1", False),
+        ] + [self._make_record(entry, entry.identifier)
+             for entry in directory.entries]
+        size = 0
+        for record in directory.records:
+            # Records may not span sector boundaries
+            if size % sector + record.length > sector:
+                size += sector - size % sector
+            size += record.length
+        directory.size = -(-size // sector) * sector
+
+    def _layout_continuations(self, lba):
+        """Pack the continuation areas of all records into sectors.
+
+        Helper method for :meth:`_layout`.
+
+        Args:
+          lba (int): First sector available for continuation areas.
+
+        Returns:
+          int: First sector after the continuation areas.
+        """
+        sector = self.SECTOR_SIZE
+        self._continuation_sectors = []
+        offset = sector
+        records = [record for directory in self._directories
+                   for record in directory.records if record.continuation]
+        for record in records:
+            if offset + len(record.continuation) > sector:
+                self._continuation_sectors.append(bytearray(sector))
+                lba += 1
+                offset = 0
+            record.continuation_location = (lba - 1, offset)
+            self._continuation_sectors[-1][
+                offset:offset + len(record.continuation)] = (
+                    record.continuation)
+            offset += len(record.continuation)
+        return lba
+
+    def _record_bytes(self, record):
+        """Encode a directory record (ECMA-119 9.1).
+
+        Args:
+          record (_ISORecord): Laid-out record.
+
+        Returns:
+          bytes: Encoded record.
+        """
+        entry = record.entry
+        identifier = record.identifier
+        system_use = record.system_use
+        if record.continuation:
+            (lba, offset) = record.continuation_location
+            system_use += (b"CE\x1c\x01" + _both32(lba) + _both32(offset) +
+                           _both32(len(record.continuation)))
+        padding = b"\0" if len(identifier) % 2 == 0 else b""
+        if (len(identifier) + len(padding) + len(system_use)) % 2 == 0:
+            system_use += b"\0"
+        data = (struct.pack("2B", record.length, 0) + _both32(entry.lba) +
+                _both32(entry.size) + self._record_date(entry.mtime) +
+                struct.pack("3B", 2 if entry.is_dir else 0, 0, 0) +
+                _both16(1) + struct.pack("B", len(identifier)) +
+                identifier + padding + system_use)
+        assert len(data) == record.length
+        return data
+
+    def _path_table(self, big_endian):
+        """Encode the path table (ECMA-119 9.4).
+
+        Args:
+          big_endian (bool): Whether to encode the type M (big-endian)
+            table rather than the type L (little-endian) one.
+
+        Returns:
+          bytes: Path table, padded to a whole number of sectors.
+        """
+        order = ">" if big_endian else "<"
+        data = b""
+        for directory in self._directories:
+            identifier = directory.identifier or b"\0"
+            parent = directory.parent or directory
+            data += (struct.pack(order + "BBIH", len(identifier), 0,
+                                 directory.lba, parent.number) +
+                     identifier + b"\0" * (len(identifier) % 2))
+        return data + b"\0" * (-len(data) % self.SECTOR_SIZE)
+
+    def _volume_descriptors(self):
+        """Encode the primary volume descriptor and set terminator.
+
+        Returns:
+          bytes: Both volume descriptors.
+        """
+        pvd = bytearray(b" " * self.SECTOR_SIZE)
+        pvd[0:8] = b"\x01CD001\x01\x00"
+        pvd[40:72] = self.volume_id.upper().encode('ascii')[:32].ljust(32)
+        pvd[72:80] = bytearray(8)
+        pvd[80:88] = _both32(self._total_sectors)
+        pvd[88:120] = bytearray(32)
+        pvd[120:124] = _both16(1)
+        pvd[124:128] = _both16(1)
+        pvd[128:132] = _both16(self.SECTOR_SIZE)
+        pvd[132:140] = _both32(self._path_table_size)
+        pvd[140:148] = struct.pack("<II", self._path_table_lbas[0], 0)
+        pvd[148:156] = struct.pack(">II", self._path_table_lbas[1], 0)
+        pvd[156:190] = self._record_bytes(_ISORecord(self.root, b"\0"))
+        created = self._volume_date(self.timestamp)
+        pvd[813:830] = created
+        pvd[830:847] = created
+        pvd[847:864] = b"0" * 16 + b"\0"
+        pvd[864:881] = created
+        pvd[881:883] = b"\x01\x00"
+        pvd[883:] = bytearray(self.SECTOR_SIZE - 883)
+        terminator = bytearray(self.SECTOR_SIZE)
+        terminator[0:7] = b"\xffCD001\x01"
+        return bytes(pvd + terminator)
+
+    def write(self, fileobj):
+        """Write the ISO image to the given file.
+
+        Args:
+          fileobj (file): Writable binary file or stream.
+
+        Returns:
+          int: Number of bytes written.
+
+        Raises:
+          IOError: if a file shrinks while it is being added.
+        """
+        sector = self.SECTOR_SIZE
+        total = self._layout()
+        fileobj.write(bytes(bytearray(ISO.FIRST_VOLUME_DESCRIPTOR * sector)))
+        fileobj.write(self._volume_descriptors())
+        fileobj.write(self._path_table(False))
+        fileobj.write(self._path_table(True))
+        for directory in self._directories:
+            data = bytearray()
+            for record in directory.records:
+                encoded = self._record_bytes(record)
+                if len(data) % sector + len(encoded) > sector:
+                    data += bytearray(sector - len(data) % sector)
+                data += encoded
+            data += bytearray(directory.size - len(data))
+            fileobj.write(bytes(data))
+        for data in self._continuation_sectors:
+            fileobj.write(bytes(data))
+        for entry in self._files:
+            logger.spam("Adding %s to ISO at sector %d", entry.path,
+                        entry.lba)
+            remaining = entry.size
+            with open(entry.path, 'rb') as source:
+                while remaining:
+                    data = source.read(min(remaining, 1 << 20))
+                    if not data:
+                        raise IOError("File '{0}' changed while being "
+                                      "added to ISO".format(entry.path))
+                    fileobj.write(data)
+                    remaining -= len(data)
+            fileobj.write(bytes(bytearray(-entry.size % sector)))
+        logger.debug("Wrote ISO of %d sectors with %d files", total,
+                     len(self._files))
+        return total * sector
+
+
+class ISO9660Reader(object):
+    """Reader of ISO 9660 directory tables, including Rock Ridge names.
+
+    Directories are read one at a time as the walk proceeds, so listing an
+    image costs one small read per directory regardless of the size of
+    the files within it. As with ``isoinfo -f``, each directory's entries
+    are listed before the contents of its subdirectories, and without
+    Rock Ridge, ISO 9660 names are reported in lower case without their
+    version suffix. Joliet extensions are ignored.
+
+    Examples:
+      ::
+
+        >>> import io, shutil, tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> path = os.path.join(directory, "config.txt")
+        >>> with open(path, 'w') as fileobj:
+        ...     _ = fileobj.write("hostname foo")
+        >>> image = io.BytesIO()
+        >>> _ = ISO9660Writer([path]).write(image)
+        >>> reader = ISO9660Reader(image)
+        >>> [str(path) for path in reader.walk()]
+        ['config.txt']
+        >>> [data.decode() for (_, data) in reader.walk(contents=True)]
+        ['hostname foo']
+        >>> shutil.rmtree(directory)
+    """
+
+    MAX_CONTINUATIONS = 64
+    """Give up following System Use continuation areas after this many."""
+
+    MAX_DIRECTORIES = 1 << 20
+    """Give up on images claiming more directories than this."""
+
+    def __init__(self, fileobj):
+        """Read the volume descriptors of an ISO image.
+
+        Args:
+          fileobj (file): Image opened for binary reading.
+
+        Raises:
+          ValueError: if the file is not an ISO 9660 image.
+        """
+        self.fileobj = fileobj
+        pvd = ISO._primary_volume_descriptor(fileobj)
+        if pvd is None:
+            raise ValueError("No ISO 9660 primary volume descriptor found")
+        (self.block_size,) = struct.unpack_from("<H", pvd, 128)
+        if not self.block_size:
+            raise ValueError("Invalid ISO 9660 logical block size")
+        # The root directory record is at offset 156 of the PVD
+        (self.root_extent, self.root_size) = struct.unpack_from(
+            "<I4xI", pvd, 158)
+        self.rock_ridge = ISO._root_has_rock_ridge(fileobj, pvd)
+        self.susp_skip = 0
+        if self.rock_ridge:
+            # The root's '.' entry may declare bytes to skip in all others
+            record = next(self._records(self.root_extent, self.root_size))
+            system_use = self._system_use(record)
+            if system_use[:2] == b"SP" and len(system_use) >= 7:
+                self.susp_skip = bytearray(system_use)[6]
+
+    def _read(self, offset, length):
+        """Read exactly the requested bytes from the image.
+
+        Args:
+          offset (int): Byte offset into the image.
+          length (int): Number of bytes to read.
+
+        Returns:
+          bytes: Data read.
+
+        Raises:
+          ValueError: if the image is truncated.
+        """
+        self.fileobj.seek(offset)
+        data = self.fileobj.read(length)
+        if len(data) < length:
+            raise ValueError("ISO image is truncated")
+        return data
+
+    def _records(self, extent, size):
+        """Iterate over the directory records in a directory's extent.
+
+        Args:
+          extent (int): Logical block number of the directory.
+          size (int): Size of the directory, in bytes.
+
+        Yields:
+          bytearray: Each directory record.
+
+        Raises:
+          ValueError: if a record is malformed.
+        """
+        data = bytearray(self._read(extent * self.block_size, size))
+        offset = 0
+        while offset < len(data):
+            length = data[offset]
+            if length == 0:
+                # Records never span blocks; skip the padding at the end
+                offset = (offset // self.block_size + 1) * self.block_size
+                continue
+            if length < 34 or offset + length > len(data):
+                raise ValueError("Malformed ISO 9660 directory record")
+            yield data[offset:offset + length]
+            offset += length
+
+    @staticmethod
+    def _system_use(record):
+        """Get the System Use area of a directory record.
+
+        Args:
+          record (bytearray): Directory record.
+
+        Returns:
+          bytearray: Contents following the (padded) file identifier.
+        """
+        name_len = record[32]
+        return record[33 + name_len + (1 - name_len % 2):]
+
+    def _susp_entries(self, system_use):
+        """Iterate over System Use Sharing Protocol entries.
+
+        Args:
+          system_use (bytearray): System Use area of a directory record.
+
+        Yields:
+          tuple: (signature, data) of each entry, following any ``CE``
+          continuation areas.
+
+        Raises:
+          ValueError: if there are too many continuation areas.
+        """
+        data = system_use[self.susp_skip:]
+        for _ in range(self.MAX_CONTINUATIONS):
+            continuation = None
+            offset = 0
+            while offset + 4 <= len(data):
+                signature = bytes(data[offset:offset + 2])
+                length = data[offset + 2]
+                if length < 4 or signature == b"ST":
+                    break
+                if signature == b"CE":
+                    continuation = struct.unpack_from("<I4xI4xI", data,
+                                                      offset + 4)
+                else:
+                    yield (signature, data[offset + 4:offset + length])
+                offset += length
+            if continuation is None:
+                return
+            (extent, offset, length) = continuation
+            data = bytearray(self._read(extent * self.block_size + offset,
+                                        length))
+        raise ValueError("Too many System Use continuation areas")
+
+    def _rock_ridge_info(self, record):
+        """Get the Rock Ridge name and relocation details of a record.
+
+        Helper method for :meth:`_entries`.
+
+        Args:
+          record (bytearray): Directory record.
+
+        Returns:
+          tuple: (name, relocated, child), where name is the alternate
+          name (``NM``), or None if not given; relocated is whether this is
+          a relocated directory (``RE``); and child is the block number of
+          the directory this record stands in for (``CL``), if any.
+        """
+        parts = []
+        relocated = False
+        child = None
+        for (signature, data) in self._susp_entries(self._system_use(record)):
+            if signature == b"NM" and data and not data[0] & 0x06:
+                parts.append(bytes(data[1:]))
+            elif signature == b"RE":
+                relocated = True
+            elif signature == b"CL":
+                (child,) = struct.unpack_from("<I", data)
+        name = None
+        if parts:
+            name = b"".join(parts).decode('utf-8', 'replace')
+        return (name, relocated, child)
+
+    def _entries(self, extent, size):
+        """Iterate over the files and directories in a directory.
+
+        Args:
+          extent (int): Logical block number of the directory.
+          size (int): Size of the directory, in bytes.
+
+        Yields:
+          tuple: (name, is_dir, extents) for each entry other than '.' and
+          '..', where extents is a list of (block, size) tuples.
+        """
+        extents = []
+        for record in self._records(extent, size):
+            identifier = bytes(record[33:33 + record[32]])
+            if identifier in (b"\x00", b"\x01"):
+                continue
+            flags = record[25]
+            (location, length) = struct.unpack_from("<I4xI", record, 2)
+            name = None
+            if self.rock_ridge:
+                (name, relocated, child) = self._rock_ridge_info(record)
+                if relocated:
+                    # Shown at its original location via a CL entry
+                    continue
+                if child is not None:
+                    # Placeholder for a relocated directory
+                    (location, length) = (child, None)
+                    flags |= 0x02
+            if name is None:
+                name = identifier.decode('ascii', 'replace')
+                if not flags & 0x02:
+                    name = name.split(";")[0].rstrip(".")
+                name = name.lower()
+            extents.append((location, length))
+            if flags & 0x80:
+                # Multi-extent file, continued by the next record
+                continue
+            yield (name, bool(flags & 0x02), extents)
+            extents = []
+
+    def _read_extents(self, extents):
+        """Read the contents of a file.
+
+        Args:
+          extents (list): (block, size) tuples making up the file.
+
+        Returns:
+          bytes: File contents.
+        """
+        return b"".join(self._read(location * self.block_size, length)
+                        for (location, length) in extents)
+
+    def walk(self, contents=False):
+        """Iterate over all files and directories in the image.
+
+        Args:
+          contents (bool): Whether to also read the contents of each file.
+
+        Yields:
+          str: Path of each file or directory, relative to the root, or if
+          ``contents`` is set, a tuple (path, data) where data is the file
+          contents as bytes, or None for a directory.
+
+        Raises:
+          ValueError: if the directory tables are malformed.
+        """
+        visited = set()
+        pending = [("", self.root_extent, self.root_size)]
+        while pending:
+            (prefix, extent, size) = pending.pop(0)
+            if extent in visited or len(visited) >= self.MAX_DIRECTORIES:
+                raise ValueError("ISO 9660 directory tree contains a loop")
+            visited.add(extent)
+            if size is None:
+                # Relocated directory; its size is in its own '.' record
+                (size,) = struct.unpack_from(
+                    "<I", next(self._records(extent, self.block_size)), 10)
+            subdirectories = []
+            for (name, is_dir, extents) in self._entries(extent, size):
+                path = prefix + name
+                if is_dir:
+                    subdirectories.append((path + "/",) + extents[0])
+                if not contents:
+                    yield path
+                elif is_dir:
+                    yield (path, None)
+                else:
+                    yield (path, self._read_extents(extents))
+            # Like 'isoinfo -f', list each subdirectory's contents in turn
+            pending[0:0] = subdirectories
@@ -13,9 +13,10 @@
 """Handling of QCOW2 files."""
 
 import os
+import struct
 
 from COT.disks.disk import DiskRepresentation
-from COT.helpers import helpers, helper_select
+from COT.helpers import helpers, helper_select, HelperError
 
 
 class QCOW2(DiskRepresentation):
@@ -23,6 +24,44 @@ class QCOW2(DiskRepresentation):
 
     disk_format = "qcow2"
 
+    MAGIC = b"QFI\xfb"
+    """Magic number at the start of any QCOW image."""
+
+    HEADER = struct.Struct(">4sIQIIQ")
+    """Leading fields of a QCOW header.
+
+    These are magic, version, backing_file_offset, backing_file_size,
+    cluster_bits, and size (the virtual disk size in bytes).
+    """
+
+    @classmethod
+    def read_header(cls, path_or_obj):
+        """Parse the QCOW2 image header.
+
+        For the parameters, see :meth:`DiskRepresentation.read_header`.
+        """
+        with cls._opened(path_or_obj) as fileobj:
+            fileobj.seek(0)
+            header = fileobj.read(cls.HEADER.size)
+        if len(header) < cls.HEADER.size or not header.startswith(cls.MAGIC):
+            return None
+        (_, version, _, _, _, size) = cls.HEADER.unpack(header)
+        if version < 2:
+            # QCOW (version 1) is a different format that we don't support
+            return None
+        return (None, size)
+
+    @classmethod
+    def file_is_this_type(cls, path):
+        """Check whether the given file is a QCOW2 image, by its header.
+
+        For the parameters, see :meth:`DiskRepresentation.file_is_this_type`.
+        """
+        if not os.path.exists(path):
+            raise HelperError(2, "No such file or directory: '{0}'"
+                              .format(path))
+        return 100 if cls.read_header(path) is not None else 0
+
     @classmethod
     def from_other_image(cls, input_image, output_dir, output_subformat=None):
         """Convert the other disk image into an image of this type.
@@ -10,14 +10,28 @@
 # of COT, including this file, may be copied, modified, propagated, or
 # distributed except according to the terms contained in the LICENSE.txt file.
 
-"""Handling of raw disk image files."""
+"""Handling of raw disk image files.
+
+**Classes**
+
+.. autosummary::
+  :nosignatures:
+
+  RAW
+  FATReader
+  FATWriter
+"""
 
 import logging
 import os
 import re
+import stat
+import struct
+import time
 
-from COT.disks.disk import DiskRepresentation
-from COT.helpers import helpers, helper_select
+from COT import __version__
+from COT.disks.disk import DiskRepresentation, NativeUnsupportedError
+from COT.helpers import helpers
 
 logger = logging.getLogger(__name__)
 
@@ -27,9 +41,26 @@ class RAW(DiskRepresentation):
 
     disk_format = "raw"
 
+    @classmethod
+    def read_header(cls, path_or_obj):
+        """Get the capacity of a raw image, which is simply its size.
+
+        A raw image has no header. For the parameters, see
+        :meth:`DiskRepresentation.read_header`.
+        """
+        with cls._opened(path_or_obj) as fileobj:
+            return (None, cls._file_size(fileobj))
+
     @property
     def files(self):
-        """List of files on the FAT32 file system of this disk."""
+        """List of files on the FAT file system of this disk."""
+        if self._files is None and self.path and os.path.exists(self.path):
+            try:
+                self._files = list(self.iter_files())
+                self._save_metadata()
+            except (IOError, ValueError, struct.error) as exc:
+                logger.debug("Unable to read FAT file system of %s natively "
+                             "(%s); trying fatdisk instead", self.path, exc)
         if self._files is None and self.path and os.path.exists(self.path):
             output = helpers['fatdisk'].call([self.path, "ls"])
             # Output looks like:
@@ -53,6 +84,7 @@ class RAW(DiskRepresentation):
                     continue
                 result.append(fields[5])
             self._files = result
+            self._save_metadata()
         return self._files
 
     @classmethod
@@ -81,10 +113,25 @@ class RAW(DiskRepresentation):
                 confidence = 10
         return confidence
 
+    def iter_files(self, contents=False):
+        """Iterate over the files and directories on this disk.
+
+        The FAT file system is read natively by :class:`FATReader`.
+
+        For the parameters, see :meth:`DiskRepresentation.iter_files`.
+        """
+        with open(self.path, 'rb') as fileobj:
+            for item in FATReader(fileobj).walk(contents):
+                yield item
+
     @classmethod
     def _create_file(cls, path, files=None, capacity=None, **kwargs):
         """Create a raw disk image file.
 
+        If ``files`` are given, the FAT file system containing them is built
+        natively by :class:`FATWriter` where possible, falling back to
+        ``fatdisk`` for contents it does not support.
+
         Args:
           path (str): Location to create RAW file.
           files (list): List of files to include in a FAT32 filesystem.
@@ -96,6 +143,13 @@ class RAW(DiskRepresentation):
             super(RAW, cls)._create_file(path, capacity=capacity, **kwargs)
             return
 
+        try:
+            FATWriter.create(path, files, capacity=capacity)
+            return
+        except NativeUnsupportedError as exc:
+            logger.verbose("Unable to build FAT file system natively (%s); "
+                           "using fatdisk instead", exc)
+
         if not capacity:
             # What size disk do we need to contain the requested file(s)?
             capacity_val = 0
@@ -119,6 +173,17 @@ class RAW(DiskRepresentation):
                                      os.path.basename(content_file)])
         logger.info("All requested files successfully added to %s", path)
 
+    @classmethod
+    def converter(cls, input_image, output_subformat=None):
+        """Identify the programs :meth:`from_other_image` would use.
+
+        For the parameters, see :meth:`DiskRepresentation.converter`.
+        """
+        if (input_image.disk_format == 'vmdk' and
+                input_image.disk_subformat == 'streamOptimized'):
+            return "COT {0}".format(__version__)
+        return super(RAW, cls).converter(input_image, output_subformat)
+
     @classmethod
     def from_other_image(cls, input_image, output_dir, output_subformat=None):
         """Convert the other disk image into an image of this type.
@@ -136,16 +201,971 @@ class RAW(DiskRepresentation):
         output_path = os.path.join(output_dir, file_prefix + ".img")
         if (input_image.disk_format == 'vmdk' and
                 input_image.disk_subformat == 'streamOptimized'):
-            helper = helper_select([('qemu-img', '1.2.0'), 'vmdktool'])
-            # Special case: qemu-img < 1.2.0 can't read streamOptimized VMDKs
-            if helper.name == 'vmdktool':
-                # Note that vmdktool takes its arguments in unusual order -
-                # output file comes before input file
-                helper.call(['-s', output_path, input_image.path])
-                return cls(output_path)
+            # qemu-img < 1.2.0 can't read streamOptimized VMDKs, and any
+            # version decompresses them on a single core, so do it natively
+            from COT.disks.vmdk import StreamOptimizedReader
+            logger.verbose("Extracting %s to a sparse raw image",
+                           input_image.path)
+            StreamOptimizedReader.convert(input_image.path, output_path)
+            return cls(output_path)
 
         helpers['qemu-img'].call(['convert',
                                   '-O', 'raw',
                                   input_image.path,
                                   output_path])
         return cls(output_path)
+
+
+def _capacity_bytes(capacity):
+    """Convert a disk capacity such as "16M" to a number of bytes.
+
+    Args:
+      capacity (str): Number, optionally followed by a binary multiplier
+        suffix (K, M, G, or T) as accepted by ``qemu-img``.
+
+    Returns:
+      int: Capacity in bytes.
+
+    Raises:
+      NativeUnsupportedError: if the capacity is not understood.
+    """
+    match = re.match(r"^\s*(\d+)\s*([KMGT]?)B?\s*$", str(capacity),
+                     re.IGNORECASE)
+    if not match:
+        raise NativeUnsupportedError("Unrecognized capacity '{0}'"
+                                     .format(capacity))
+    shift = 10 * " KMGT".index(match.group(2).upper() or " ")
+    return int(match.group(1)) << shift
+
+
+def _text(name):
+    """Get a file name as text, decoding it if necessary."""
+    if isinstance(name, bytes):
+        return name.decode('utf-8')
+    return name
+
+
+class FATReader(object):
+    """Reader of FAT12, FAT16, or FAT32 file systems.
+
+    Only the boot sector, the directories, and the allocation table sectors
+    needed to follow their cluster chains are read, so listing a volume is
+    cheap regardless of its size. Entries are reported by their long (VFAT)
+    names where present, and each directory's entries are listed before
+    the contents of its subdirectories.
+
+    Examples:
+      ::
+
+        >>> import io, shutil, tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> path = os.path.join(directory, "config.txt")
+        >>> with open(path, 'w') as fileobj:
+        ...     _ = fileobj.write("hostname foo")
+        >>> image = io.BytesIO()
+        >>> _ = FATWriter([path]).write(image)
+        >>> reader = FATReader(image)
+        >>> reader.fat_type
+        'FAT16'
+        >>> [str(path) for path in reader.walk()]
+        ['config.txt']
+        >>> [data.decode() for (_, data) in reader.walk(contents=True)]
+        ['hostname foo']
+        >>> shutil.rmtree(directory)
+    """
+
+    BOOT_SECTOR = struct.Struct("<HBHBHHBHHHII")
+    """BIOS parameter block at offset 11: bytes per sector, sectors per
+    cluster, reserved sectors, number of FATs, root directory entries,
+    16-bit sector count, media type, 16-bit FAT size, sectors per track,
+    heads, hidden sectors, and 32-bit sector count.
+    """
+
+    def __init__(self, fileobj):
+        """Read the boot sector of a FAT file system.
+
+        Args:
+          fileobj (file): Image opened for binary reading.
+
+        Raises:
+          ValueError: if the file is not a FAT file system.
+        """
+        self.fileobj = fileobj
+        fileobj.seek(0)
+        boot = fileobj.read(512)
+        if len(boot) < 512 or boot[510:512] != b"\x55\xaa":
+            raise ValueError("No FAT boot sector found")
+        (self.sector_size, self.sectors_per_cluster, reserved, fats,
+         root_entries, sectors, _, fat_sectors, _, _, _,
+         large_sectors) = self.BOOT_SECTOR.unpack_from(boot, 11)
+        if (self.sector_size not in (512, 1024, 2048, 4096) or
+                self.sectors_per_cluster not in (1, 2, 4, 8, 16, 32, 64,
+                                                 128) or
+                not reserved or not fats):
+            raise ValueError("Invalid FAT boot sector")
+        if not fat_sectors:
+            (fat_sectors,) = struct.unpack_from("<I", boot, 36)
+        sectors = sectors or large_sectors
+        self.fat_offset = reserved * self.sector_size
+        root_sectors = -(-root_entries * 32 // self.sector_size)
+        self.root_offset = (reserved + fats * fat_sectors) * self.sector_size
+        self.root_size = root_entries * 32
+        first_data_sector = reserved + fats * fat_sectors + root_sectors
+        if not fat_sectors or sectors <= first_data_sector:
+            raise ValueError("Invalid FAT boot sector")
+        self.data_offset = first_data_sector * self.sector_size
+        self.cluster_size = self.sectors_per_cluster * self.sector_size
+        self.cluster_count = ((sectors - first_data_sector) //
+                              self.sectors_per_cluster)
+        # Per Microsoft's FAT specification, the FAT type is determined
+        # solely by the number of clusters
+        if self.cluster_count < 4085:
+            self.fat_bits = 12
+        elif self.cluster_count < 65525:
+            self.fat_bits = 16
+        else:
+            self.fat_bits = 32
+            (self.root_cluster,) = struct.unpack_from("<I", boot, 44)
+        self._fat_cache = {}
+
+    @property
+    def fat_type(self):
+        """One of 'FAT12', 'FAT16', or 'FAT32'."""
+        return "FAT{0}".format(self.fat_bits)
+
+    def _read(self, offset, length):
+        """Read exactly the requested bytes from the image.
+
+        Args:
+          offset (int): Byte offset into the image.
+          length (int): Number of bytes to read.
+
+        Returns:
+          bytes: Data read.
+
+        Raises:
+          ValueError: if the image is truncated.
+        """
+        self.fileobj.seek(offset)
+        data = self.fileobj.read(length)
+        if len(data) < length:
+            raise ValueError("FAT image is truncated")
+        return data
+
+    def _next_cluster(self, cluster):
+        """Look up the allocation table entry for a cluster.
+
+        Args:
+          cluster (int): Cluster number.
+
+        Returns:
+          int: Next cluster in the chain, or None at the end of the chain.
+
+        Raises:
+          ValueError: if the chain is broken.
+        """
+        offset = cluster * self.fat_bits // 8
+        sector = offset // self.sector_size
+        if sector not in self._fat_cache:
+            # Read two sectors, as a FAT12 entry may straddle them
+            self._fat_cache[sector] = bytearray(self._read(
+                self.fat_offset + sector * self.sector_size,
+                2 * self.sector_size))
+        table = self._fat_cache[sector]
+        offset -= sector * self.sector_size
+        if self.fat_bits == 12:
+            value = table[offset] | table[offset + 1] << 8
+            value = value >> 4 if cluster & 1 else value & 0xfff
+            end = 0xff8
+        elif self.fat_bits == 16:
+            (value,) = struct.unpack_from("<H", table, offset)
+            end = 0xfff8
+        else:
+            (value,) = struct.unpack_from("<I", table, offset)
+            value &= 0x0fffffff
+            end = 0x0ffffff8
+        if value >= end:
+            return None
+        if value < 2 or value >= self.cluster_count + 2:
+            raise ValueError("Broken FAT cluster chain at cluster {0}"
+                             .format(cluster))
+        return value
+
+    def _runs(self, cluster, size=None):
+        """Get the byte ranges occupied by a cluster chain.
+
+        Args:
+          cluster (int): First cluster of the chain.
+          size (int): Number of bytes wanted, or None for the whole chain.
+
+        Returns:
+          list: (offset, length) tuples, merging contiguous clusters.
+
+        Raises:
+          ValueError: if the chain is broken or loops.
+        """
+        runs = []
+        remaining = size
+        for _ in range(self.cluster_count):
+            if cluster is None or remaining == 0:
+                return runs
+            if cluster < 2 or cluster >= self.cluster_count + 2:
+                raise ValueError("Invalid FAT cluster {0}".format(cluster))
+            offset = self.data_offset + (cluster - 2) * self.cluster_size
+            length = self.cluster_size
+            if remaining is not None:
+                length = min(length, remaining)
+                remaining -= length
+            if runs and runs[-1][0] + runs[-1][1] == offset:
+                runs[-1] = (runs[-1][0], runs[-1][1] + length)
+            else:
+                runs.append((offset, length))
+            cluster = self._next_cluster(cluster)
+        raise ValueError("FAT cluster chain contains a loop")
+
+    def _read_runs(self, runs):
+        """Read the data in the given byte ranges.
+
+        Args:
+          runs (list): (offset, length) tuples.
+
+        Returns:
+          bytes: Concatenated data.
+        """
+        return b"".join(self._read(offset, length)
+                        for (offset, length) in runs)
+
+    @staticmethod
+    def _short_name(entry):
+        """Decode the 8.3 name of a directory entry.
+
+        Args:
+          entry (bytearray): 32-byte directory entry.
+
+        Returns:
+          str: Name, in lower case where flagged as such by Windows NT.
+        """
+        base = bytes(entry[0:8]).rstrip(b" ")
+        ext = bytes(entry[8:11]).rstrip(b" ")
+        if base[:1] == b"\x05":
+            base = b"\xe5" + base[1:]
+        base = base.decode('latin-1')
+        ext = ext.decode('latin-1')
+        if entry[12] & 0x08:
+            base = base.lower()
+        if entry[12] & 0x10:
+            ext = ext.lower()
+        return base + ("." + ext if ext else "")
+
+    def _entries(self, data):
+        """Iterate over the files and directories in a directory.
+
+        Args:
+          data (bytes): Contents of the directory.
+
+        Yields:
+          tuple: (name, is_dir, cluster, size) for each entry other than
+          '.', '..', and the volume label.
+        """
+        long_name = []
+        checksum = None
+        for offset in range(0, len(data) - 31, 32):
+            entry = bytearray(data[offset:offset + 32])
+            if entry[0] == 0x00:
+                return
+            if entry[0] == 0xe5:
+                long_name = []
+                continue
+            attributes = entry[11]
+            if attributes & 0x3f == FATWriter.ATTR_LONG_NAME:
+                if entry[0] & 0x40:
+                    long_name = []
+                    checksum = entry[13]
+                long_name.insert(0, bytes(entry[1:11] + entry[14:26] +
+                                          entry[28:32]))
+                continue
+            if attributes & 0x08 or entry[0:2] in (b". ", b".."):
+                long_name = []
+                continue
+            name = self._short_name(entry)
+            if long_name and checksum == FATWriter.short_name_checksum(
+                    bytes(entry[0:11])):
+                name = b"".join(long_name).decode('utf-16-le', 'replace')
+                name = name.split(u"\0")[0]
+            long_name = []
+            cluster = entry[26] | entry[27] << 8
+            if self.fat_bits == 32:
+                cluster |= (entry[20] | entry[21] << 8) << 16
+            (size,) = struct.unpack_from("<I", entry, 28)
+            yield (name, bool(attributes & FATWriter.ATTR_DIRECTORY),
+                   cluster, size)
+
+    def walk(self, contents=False):
+        """Iterate over all files and directories in the file system.
+
+        Args:
+          contents (bool): Whether to also read the contents of each file.
+
+        Yields:
+          str: Path of each file or directory, relative to the root, or if
+          ``contents`` is set, a tuple (path, data) where data is the file
+          contents as bytes, or None for a directory.
+
+        Raises:
+          ValueError: if the file system is malformed.
+        """
+        visited = set()
+        if self.fat_bits == 32:
+            pending = [("", self.root_cluster)]
+        else:
+            pending = [("", None)]
+        while pending:
+            (prefix, cluster) = pending.pop(0)
+            if cluster is None:
+                data = self._read(self.root_offset, self.root_size)
+            elif cluster in visited:
+                raise ValueError("FAT directory tree contains a loop")
+            else:
+                visited.add(cluster)
+                data = self._read_runs(self._runs(cluster))
+            subdirectories = []
+            for (name, is_dir, first, size) in self._entries(data):
+                path = prefix + name
+                if is_dir:
+                    subdirectories.append((path + "/", first))
+                if not contents:
+                    yield path
+                elif is_dir:
+                    yield (path, None)
+                elif not size:
+                    yield (path, b"")
+                else:
+                    member = self._read_runs(self._runs(first, size))
+                    if len(member) < size:
+                        raise ValueError("File '{0}' is truncated"
+                                         .format(path))
+                    yield (path, member)
+            pending[0:0] = subdirectories
+
+
+class _FATEntry(object):
+    """A file or directory to be recorded in a FAT file system."""
+
+    def __init__(self, name, parent=None, path=None):
+        """Create an entry.
+
+        Args:
+          name (str): Long name of this entry.
+          parent (_FATEntry): Containing directory, or None for the root.
+          path (str): Source file path, or None for a directory.
+        """
+        self.name = _text(name)
+        self.parent = parent
+        self.path = path
+        self.children = {} if path is None else None
+        self.entries = []
+        """Children, sorted by name."""
+        self.short_name = None
+        self.long_name = False
+        self.size = 0
+        self.mtime = 0
+        self.cluster = 0
+        self.clusters = 0
+
+    @property
+    def is_dir(self):
+        """Whether this entry is a directory."""
+        return self.children is not None
+
+    @property
+    def slots(self):
+        """Total number of 32-byte directory entries needed for this entry."""
+        if not self.long_name:
+            return 1
+        return 1 + -(-len(self.name.encode('utf-16-le')) // 26)
+
+
+class FATWriter(object):
+    """Writer of FAT16 or FAT32 file system images.
+
+    As with ``mkfs.fat``, FAT16 is used for volumes of up to 512 MiB and
+    FAT32 for larger ones. All file system structures are computed up front
+    and each file is copied into a contiguous run of clusters in a single
+    pass, leaving free space as holes in a sparse output file, so creation
+    time depends only on the size of the files, not the capacity.
+
+    As with :class:`~COT.disks.iso.ISO9660Writer`, each listed file is
+    placed at the root of the file system and the contents of each listed
+    directory are merged into the root, and all timestamps come from the
+    input files (or ``$SOURCE_DATE_EPOCH``), so the same inputs always
+    produce an identical image.
+
+    Raises :exc:`~COT.disks.disk.NativeUnsupportedError` for inputs that
+    this writer does not handle, such as special files, or capacities
+    requiring FAT12.
+
+    Examples:
+      ::
+
+        >>> import shutil, tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> path = os.path.join(directory, "config.txt")
+        >>> with open(path, 'w') as fileobj:
+        ...     _ = fileobj.write("hostname foo")
+        >>> writer = FATWriter([path], timestamp=0)
+        >>> (writer.fat_type, writer.capacity)
+        ('FAT16', 8388608)
+        >>> writer.create(os.path.join(directory, "disk.img"), [path])
+        8388608
+        >>> shutil.rmtree(directory)
+    """
+
+    SECTOR_SIZE = 512
+
+    CAPACITY_STEP = 8 << 20
+    """Default capacities are the smallest sufficient multiple of this."""
+
+    MIN_SECTORS = 8400
+    """Smaller volumes require FAT12, which is not supported."""
+
+    MAX_FAT16_SECTORS = 1048576
+    """Volumes larger than this (512 MiB) use FAT32."""
+
+    MAX_SECTORS = 0xffffffff
+    """Largest volume that can be described by a FAT boot sector."""
+
+    MAX_FILE_SIZE = 0xffffffff
+    """Largest file that FAT can record."""
+
+    FAT16_CLUSTER_SIZES = ((32680, 2), (262144, 4), (524288, 8),
+                           (MAX_FAT16_SECTORS, 16))
+    """Volume size limits and corresponding sectors per cluster for FAT16.
+
+    Per Microsoft's FAT specification, like ``mkfs.fat``.
+    """
+
+    FAT32_CLUSTER_SIZES = ((16777216, 8), (33554432, 16), (67108864, 32),
+                           (MAX_SECTORS, 64))
+    """Volume size limits and corresponding sectors per cluster for FAT32."""
+
+    MIN_FAT16_CLUSTERS = 4085
+    """Volumes with fewer clusters than this are FAT12."""
+
+    MIN_FAT32_CLUSTERS = 65525
+    """Volumes with at least this many clusters are FAT32."""
+
+    ROOT_ENTRIES = 512
+    """Minimum number of entries in a FAT16 root directory."""
+
+    ATTR_DIRECTORY = 0x10
+    ATTR_ARCHIVE = 0x20
+    ATTR_LONG_NAME = 0x0f
+
+    INVALID_SHORT_NAME_CHARS = re.compile(r"[^A-Z0-9!#$%&'()@^_`{}~-]")
+    """Characters to replace when generating an 8.3 name."""
+
+    DIR_ENTRY = struct.Struct("<11sBBBHHHHHHHI")
+    """Directory entry: name, attributes, reserved, creation time tenths,
+    creation time and date, access date, high cluster word, write time and
+    date, low cluster word, and file size.
+    """
+
+    LFN_ENTRY = struct.Struct("<B10sBBB12sH4s")
+    """Long file name entry: ordinal, characters 1-5, attributes, type,
+    short name checksum, characters 6-11, zero, and characters 12-13.
+    """
+
+    def __init__(self, files, capacity=None, timestamp=None):
+        """Prepare to write a file system containing the given files.
+
+        Args:
+          files (list): Paths of files and/or directories to include.
+          capacity (str): Volume capacity, in bytes or with a suffix such
+            as "64M". If unset, the smallest sufficient multiple of
+            :attr:`CAPACITY_STEP` is used.
+          timestamp (int): Time (seconds since the epoch) to record for
+            directories; defaults to ``$SOURCE_DATE_EPOCH`` if set, else
+            the newest file time.
+
+        Raises:
+          NativeUnsupportedError: if the files cannot be recorded natively.
+          ValueError: if two files would have the same name, or the files
+            do not fit in the requested capacity.
+        """
+        self.root = _FATEntry("")
+        for path in files:
+            if os.path.isdir(path):
+                self._add_directory(self.root, path)
+            else:
+                self._add_file(self.root, os.path.basename(path), path)
+        if timestamp is None:
+            if os.environ.get('SOURCE_DATE_EPOCH'):
+                timestamp = int(os.environ['SOURCE_DATE_EPOCH'])
+            else:
+                timestamp = max([0] + [entry.mtime for entry in
+                                       self._walk(self.root)])
+        self.timestamp = timestamp
+
+        self._directories = [self.root]
+        for directory in self._directories:
+            directory.mtime = timestamp
+            self._assign_short_names(directory)
+            self._directories.extend(entry for entry in directory.entries
+                                     if entry.is_dir)
+        self._files = [entry for directory in self._directories
+                       for entry in directory.entries if not entry.is_dir]
+
+        if capacity:
+            sectors = _capacity_bytes(capacity) // self.SECTOR_SIZE
+            if not self._layout(sectors):
+                raise ValueError("Files do not fit in a FAT file system of "
+                                 "capacity {0}".format(capacity))
+        else:
+            step = self.CAPACITY_STEP
+            content = sum(entry.size for entry in self._files)
+            sectors = (content // step + 1) * step // self.SECTOR_SIZE
+            while not self._layout(sectors):
+                sectors += step // self.SECTOR_SIZE
+
+    @classmethod
+    def create(cls, path, files, **kwargs):
+        """Create a raw disk image file containing the given files.
+
+        Args:
+          path (str): Path of the image file to create.
+          files (list): Paths of files and/or directories to include.
+          **kwargs: Passed through to the class constructor.
+
+        Returns:
+          int: Capacity of the created image, in bytes.
+        """
+        writer = cls(files, **kwargs)
+        try:
+            with open(path, 'wb') as fileobj:
+                return writer.write(fileobj)
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+    @property
+    def capacity(self):
+        """Capacity of the file system, in bytes."""
+        return self.total_sectors * self.SECTOR_SIZE
+
+    @property
+    def fat_type(self):
+        """Either 'FAT16' or 'FAT32'."""
+        return 'FAT32' if self.fat32 else 'FAT16'
+
+    def _walk(self, directory):
+        """Iterate over all files and directories within a directory.
+
+        Args:
+          directory (_FATEntry): Directory to walk.
+
+        Yields:
+          _FATEntry: Each entry, depth-first.
+        """
+        for entry in directory.children.values():
+            yield entry
+            if entry.is_dir:
+                for child in self._walk(entry):
+                    yield child
+
+    @staticmethod
+    def _check_name(directory, name):
+        """Make sure the given name is not yet in use in a directory.
+
+        Args:
+          directory (_FATEntry): Directory to check.
+          name (str): Long file name, compared case-insensitively.
+
+        Raises:
+          NativeUnsupportedError: if the name is too long for FAT.
+          ValueError: if the name is already in use.
+        """
+        if len(_text(name).encode('utf-16-le')) > 2 * 255:
+            raise NativeUnsupportedError("File name '{0}' is too long for FAT"
+                                         .format(name))
+        if _text(name).upper() in (child.name.upper()
+                                   for child in directory.children.values()):
+            raise ValueError("Multiple files named '{0}' in the same FAT "
+                             "directory".format(name))
+
+    def _add_file(self, directory, name, path):
+        """Add a file to the given directory.
+
+        Args:
+          directory (_FATEntry): Directory to add to.
+          name (str): Name of the file within the file system.
+          path (str): Path of the source file.
+
+        Raises:
+          NativeUnsupportedError: if not a regular file or too large.
+        """
+        self._check_name(directory, name)
+        info = os.stat(path)
+        if not stat.S_ISREG(info.st_mode):
+            raise NativeUnsupportedError("'{0}' is not a regular file"
+                                         .format(path))
+        if info.st_size > self.MAX_FILE_SIZE:
+            raise NativeUnsupportedError("'{0}' is too large for FAT"
+                                         .format(path))
+        entry = _FATEntry(name, directory, path)
+        entry.size = info.st_size
+        entry.mtime = int(info.st_mtime)
+        directory.children[entry.name] = entry
+
+    def _add_directory(self, directory, path):
+        """Merge the contents of a directory into the given directory.
+
+        Args:
+          directory (_FATEntry): Directory to add to.
+          path (str): Path of the source directory.
+
+        Raises:
+          ValueError: if a name is already in use.
+        """
+        for name in sorted(os.listdir(path)):
+            child_path = os.path.join(path, name)
+            if not os.path.isdir(child_path):
+                self._add_file(directory, name, child_path)
+                continue
+            child = directory.children.get(_text(name))
+            if child is None:
+                self._check_name(directory, name)
+                child = _FATEntry(name, directory)
+                directory.children[child.name] = child
+            elif not child.is_dir:
+                raise ValueError("Multiple files named '{0}' in the same "
+                                 "FAT directory".format(name))
+            self._add_directory(child, child_path)
+
+    def _assign_short_names(self, directory):
+        """Choose unique 8.3 names for a directory's children.
+
+        Names that are not already valid upper-case 8.3 names are also
+        recorded as long file names.
+
+        Args:
+          directory (_FATEntry): Directory whose children to name.
+        """
+        used = set()
+        directory.entries = [directory.children[name]
+                             for name in sorted(directory.children)]
+        for entry in directory.entries:
+            (base, dot, ext) = entry.name.upper().rpartition(".")
+            if not dot:
+                (base, ext) = (ext, "")
+            clean_base = self.INVALID_SHORT_NAME_CHARS.sub(
+                "_", base.replace(" ", "").replace(".", ""))
+            clean_ext = self.INVALID_SHORT_NAME_CHARS.sub(
+                "_", ext.replace(" ", ""))[:3]
+            short = (clean_base, clean_ext)
+            if (clean_base != base or clean_ext != ext or not base or
+                    len(base) > 8 or short in used):
+                counter = 1
+                while True:
+                    tail = "~{0}".format(counter)
+                    short = ((clean_base or "_")[:8 - len(tail)] + tail,
+                             clean_ext)
+                    if short not in used:
+                        break
+                    counter += 1
+            used.add(short)
+            entry.short_name = (short[0].ljust(8) +
+                                short[1].ljust(3)).encode('ascii')
+            display = short[0] + ("." + short[1] if short[1] else "")
+            entry.long_name = (display != entry.name)
+
+    def _layout(self, sectors):
+        """Compute the file system geometry and allocate clusters.
+
+        Args:
+          sectors (int): Size of the volume, in sectors.
+
+        Returns:
+          bool: False if the files do not fit in a volume of this size.
+
+        Raises:
+          NativeUnsupportedError: if the volume size, or the resulting
+            number of clusters, is not supported.
+        """
+        if sectors < self.MIN_SECTORS or sectors > self.MAX_SECTORS:
+            raise NativeUnsupportedError("Unsupported FAT volume size of {0} "
+                                         "sectors".format(sectors))
+        self.total_sectors = sectors
+        self.fat32 = sectors > self.MAX_FAT16_SECTORS
+        entry_size = self.DIR_ENTRY.size
+        if self.fat32:
+            table = self.FAT32_CLUSTER_SIZES
+            self.reserved_sectors = 32
+            self.root_entries = 0
+        else:
+            table = self.FAT16_CLUSTER_SIZES
+            self.reserved_sectors = 1
+            slots = sum(entry.slots for entry in self.root.entries)
+            self.root_entries = max(self.ROOT_ENTRIES, -(-slots // 16) * 16)
+        self.sectors_per_cluster = next(size for (limit, size) in table
+                                        if sectors <= limit)
+        root_sectors = self.root_entries * entry_size // self.SECTOR_SIZE
+        # Per Microsoft's FAT specification; may slightly overestimate
+        divisor = 256 * self.sectors_per_cluster + 2
+        if self.fat32:
+            divisor //= 2
+        self.fat_sectors = -(-(sectors - self.reserved_sectors -
+                               root_sectors) // divisor)
+        self.root_dir_sector = self.reserved_sectors + 2 * self.fat_sectors
+        self.first_data_sector = self.root_dir_sector + root_sectors
+        self.cluster_count = ((sectors - self.first_data_sector) //
+                              self.sectors_per_cluster)
+        # Readers infer the FAT type from the cluster count alone
+        if (self.cluster_count < self.MIN_FAT16_CLUSTERS or
+                (self.cluster_count >= self.MIN_FAT32_CLUSTERS) !=
+                self.fat32):
+            raise NativeUnsupportedError(
+                "{0} clusters would not be recognized as {1}"
+                .format(self.cluster_count, self.fat_type))
+
+        cluster_bytes = self.sectors_per_cluster * self.SECTOR_SIZE
+        next_cluster = 2
+        self._chains = []
+        for entry in self._directories + self._files:
+            if entry.is_dir:
+                if entry is self.root and not self.fat32:
+                    continue
+                slots = sum(child.slots for child in entry.entries)
+                if entry is not self.root:
+                    slots += 2
+                entry.clusters = max(1, -(-slots * entry_size //
+                                          cluster_bytes))
+            else:
+                entry.clusters = -(-entry.size // cluster_bytes)
+            if entry.clusters:
+                entry.cluster = next_cluster
+                next_cluster += entry.clusters
+                self._chains.append(entry)
+            else:
+                entry.cluster = 0
+        self._next_cluster = next_cluster
+        return next_cluster - 2 <= self.cluster_count
+
+    @staticmethod
+    def _fat_datetime(timestamp):
+        """Encode a FAT date and time.
+
+        Args:
+          timestamp (int): Seconds since the epoch.
+
+        Returns:
+          tuple: (date, time) in FAT format, in UTC.
+        """
+        when = time.gmtime(timestamp)
+        if when.tm_year < 1980:
+            return (0x21, 0)
+        date = ((min(when.tm_year, 2107) - 1980) << 9 |
+                when.tm_mon << 5 | when.tm_mday)
+        return (date, when.tm_hour << 11 | when.tm_min << 5 |
+                when.tm_sec // 2)
+
+    def _dir_entry(self, short_name, attributes, cluster, size, mtime):
+        """Encode a directory entry.
+
+        Args:
+          short_name (bytes): 11-character 8.3 name.
+          attributes (int): Attribute bits.
+          cluster (int): First cluster, or 0 if none.
+          size (int): File size, or 0 for directories.
+          mtime (int): Modification time, in seconds since the epoch.
+
+        Returns:
+          bytes: Encoded 32-byte entry.
+        """
+        (date, clock) = self._fat_datetime(mtime)
+        return self.DIR_ENTRY.pack(short_name, attributes, 0, 0, clock, date,
+                                   date, cluster >> 16, clock, date,
+                                   cluster & 0xffff, size)
+
+    @staticmethod
+    def short_name_checksum(short_name):
+        """Compute the checksum linking long name entries to an 8.3 name.
+
+        Args:
+          short_name (bytes): 11-character 8.3 name.
+
+        Returns:
+          int: Checksum byte.
+        """
+        checksum = 0
+        for char in bytearray(short_name):
+            checksum = (((checksum & 1) << 7) + (checksum >> 1) + char) & 0xff
+        return checksum
+
+    def _long_name_entries(self, entry):
+        """Encode the long file name entries preceding an entry, if any.
+
+        Args:
+          entry (_FATEntry): File or directory.
+
+        Returns:
+          bytes: Encoded entries, last part of the name first.
+        """
+        if not entry.long_name:
+            return b""
+        checksum = self.short_name_checksum(entry.short_name)
+        chars = entry.name.encode('utf-16-le')
+        if len(chars) % 26:
+            chars += b"\0\0"
+            chars += b"\xff" * (-len(chars) % 26)
+        count = len(chars) // 26
+        data = b""
+        for index in range(count, 0, -1):
+            part = chars[(index - 1) * 26:index * 26]
+            data += self.LFN_ENTRY.pack(
+                index | (0x40 if index == count else 0), part[:10],
+                self.ATTR_LONG_NAME, 0, checksum, part[10:22], 0, part[22:])
+        return data
+
+    def _directory_bytes(self, directory):
+        """Encode the contents of a directory.
+
+        Args:
+          directory (_FATEntry): Directory to encode.
+
+        Returns:
+          bytes: All entries of the directory, padded with zeros to the
+          size allocated to it.
+        """
+        data = b""
+        if directory is not self.root:
+            parent = directory.parent
+            data += self._dir_entry(b".          ", self.ATTR_DIRECTORY,
+                                    directory.cluster, 0, directory.mtime)
+            data += self._dir_entry(b"..         ", self.ATTR_DIRECTORY,
+                                    0 if parent is self.root
+                                    else parent.cluster, 0, parent.mtime)
+        for entry in directory.entries:
+            data += self._long_name_entries(entry)
+            if entry.is_dir:
+                data += self._dir_entry(entry.short_name, self.ATTR_DIRECTORY,
+                                        entry.cluster, 0, entry.mtime)
+            else:
+                data += self._dir_entry(entry.short_name, self.ATTR_ARCHIVE,
+                                        entry.cluster, entry.size,
+                                        entry.mtime)
+        if directory is self.root and not self.fat32:
+            size = self.root_entries * self.DIR_ENTRY.size
+        else:
+            size = (directory.clusters * self.sectors_per_cluster *
+                    self.SECTOR_SIZE)
+        return data + b"\0" * (size - len(data))
+
+    def _boot_sectors(self):
+        """Encode the boot sector, and for FAT32 the FSInfo sector.
+
+        Returns:
+          tuple: (boot sector, FSInfo sector or None)
+        """
+        sectors = self.total_sectors
+        bpb = struct.pack(
+            "<3s8sHBHBHHBHHHII",
+            b"\xeb\x58\x90" if self.fat32 else b"\xeb\x3c\x90", b"MSWIN4.1",
+            self.SECTOR_SIZE, self.sectors_per_cluster,
+            self.reserved_sectors, 2, self.root_entries,
+            sectors if sectors < 0x10000 else 0, 0xf8,
+            0 if self.fat32 else self.fat_sectors, 32, 64, 0,
+            sectors if sectors >= 0x10000 else 0)
+        volume_id = self.timestamp & 0xffffffff
+        if self.fat32:
+            bpb += struct.pack("<IHHIHH12xBBBI11s8s", self.fat_sectors, 0,
+                               0, self.root.cluster, 1, 6, 0x80, 0, 0x29,
+                               volume_id, b"NO NAME    ", b"FAT32   ")
+        else:
+            bpb += struct.pack("<BBBI11s8s", 0x80, 0, 0x29, volume_id,
+                               b"NO NAME    ", b"FAT16   ")
+        boot = bpb + b"\0" * (510 - len(bpb)) + b"\x55\xaa"
+        if not self.fat32:
+            return (boot, None)
+        info = bytearray(self.SECTOR_SIZE)
+        struct.pack_into("<I", info, 0, 0x41615252)
+        struct.pack_into("<III", info, 484, 0x61417272,
+                         self.cluster_count - (self._next_cluster - 2),
+                         self._next_cluster)
+        struct.pack_into("<I", info, 508, 0xaa550000)
+        return (boot, bytes(info))
+
+    def _fat_bytes(self):
+        """Encode the in-use portion of the file allocation table.
+
+        Returns:
+          bytes: Entries for all clusters up to the last allocated one.
+        """
+        if self.fat32:
+            (code, end) = ("I", 0x0fffffff)
+        else:
+            (code, end) = ("H", 0xffff)
+        entries = [end & 0xfffffff8, end]
+        for entry in self._chains:
+            entries.extend(range(entry.cluster + 1,
+                                 entry.cluster + entry.clusters))
+            entries.append(end)
+        return struct.pack("<{0}{1}".format(len(entries), code), *entries)
+
+    def write(self, fileobj):
+        """Write the file system image to the given file.
+
+        Args:
+          fileobj (file): Empty, seekable, writable binary file. Regions
+            that are not written are expected to read back as zeros.
+
+        Returns:
+          int: Capacity of the image, in bytes.
+
+        Raises:
+          IOError: if a file shrinks while it is being added.
+        """
+        sector = self.SECTOR_SIZE
+        (boot, info) = self._boot_sectors()
+        fileobj.seek(0)
+        fileobj.write(boot)
+        if info is not None:
+            fileobj.write(info)
+            # Backup boot sector and FSInfo
+            fileobj.seek(6 * sector)
+            fileobj.write(boot)
+            fileobj.write(info)
+        fat = self._fat_bytes()
+        for index in range(2):
+            fileobj.seek((self.reserved_sectors + index * self.fat_sectors) *
+                         sector)
+            fileobj.write(fat)
+
+        cluster_bytes = self.sectors_per_cluster * sector
+        for entry in self._directories + self._files:
+            if entry.is_dir and entry is self.root and not self.fat32:
+                fileobj.seek(self.root_dir_sector * sector)
+            elif entry.clusters:
+                fileobj.seek(self.first_data_sector * sector +
+                             (entry.cluster - 2) * cluster_bytes)
+            else:
+                continue
+            if entry.is_dir:
+                fileobj.write(self._directory_bytes(entry))
+                continue
+            logger.spam("Adding %s to FAT at cluster %d", entry.path,
+                        entry.cluster)
+            remaining = entry.size
+            with open(entry.path, 'rb') as source:
+                while remaining:
+                    data = source.read(min(remaining, 1 << 20))
+                    if not data:
+                        raise IOError("File '{0}' changed while being "
+                                      "added to FAT file system"
+                                      .format(entry.path))
+                    fileobj.write(data)
+                    remaining -= len(data)
+        fileobj.truncate(self.capacity)
+        logger.debug("Wrote %s file system of %d bytes with %d files",
+                     self.fat_type, self.capacity, len(self._files))
+        return self.capacity
@@ -0,0 +1,408 @@
+# scheduler.py - Concurrent scheduling of disk image conversions
+# Copyright (c) 2026 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Concurrent scheduling of disk image conversions.
+
+Converting a disk image, whether by a helper program such as ``qemu-img``
+or natively, spends most of its time waiting on a subprocess or on I/O,
+so when a VM has several disks to convert, converting them alongside one
+another takes about as long as converting the largest of them alone.
+
+The number of conversions run at once is limited to
+``$COT_CONVERSION_JOBS`` if set, else the number of CPUs, and their total
+estimated memory use to ``$COT_CONVERSION_MEMORY`` bytes if set, else
+:attr:`ConversionScheduler.DEFAULT_MEMORY_BUDGET`. A conversion that uses
+threads of its own, such as for compression, asks :func:`conversion_threads`
+how many it may use, so that the conversions running together use about
+one thread per CPU between them, and may :func:`report_progress` as it goes.
+
+**Classes**
+
+.. autosummary::
+  :nosignatures:
+
+  ConversionJob
+  ConversionScheduler
+
+**Attributes**
+
+.. autosummary::
+  :nosignatures:
+
+  conversion_scheduler
+
+**Functions**
+
+.. autosummary::
+  :nosignatures:
+
+  conversion_threads
+  report_progress
+"""
+
+import logging
+import os
+import threading
+import time
+
+from multiprocessing import cpu_count
+
+from COT.utilities import pretty_bytes
+
+logger = logging.getLogger(__name__)
+
+_current = threading.local()
+"""Per-thread record of the conversion being run by that thread, if any."""
+
+
+def _environ_int(name):
+    """Get the integer value of the given environment variable, if any.
+
+    Args:
+      name (str): Environment variable name.
+
+    Returns:
+      int: Value of the variable, or None if unset or invalid.
+    """
+    value = os.environ.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        logger.debug("Ignoring invalid %s %s", name, value)
+        return None
+
+
+class ConversionJob(object):
+    """A single conversion submitted to a :class:`ConversionScheduler`."""
+
+    def __init__(self, name, function, args=(), memory=0, threads=1):
+        """Describe a conversion to be run.
+
+        Args:
+          name (str): Name of the disk being converted, for progress
+              reporting.
+          function (function): Function performing the conversion.
+          args (tuple): Positional arguments to pass to ``function``.
+          memory (int): Estimated memory needed by the conversion, in bytes.
+          threads (int): Number of threads the conversion may use.
+        """
+        self.name = name
+        self.function = function
+        self.args = tuple(args)
+        self.memory = memory
+        self.threads = threads
+        self.state = 'queued'
+        """One of 'queued', 'running', 'done', or 'failed'."""
+        self.progress = None
+        """(bytes done, total bytes), if reported by the conversion."""
+        self.started = None
+        self.finished = None
+        self._result = None
+        self._exception = None
+        self._done = threading.Event()
+
+    def __repr__(self):
+        """Represent this job as a string."""
+        return "<ConversionJob {0} ({1})>".format(self.name, self.state)
+
+    @property
+    def done(self):
+        """Whether the conversion has finished, successfully or not."""
+        return self._done.is_set()
+
+    @property
+    def elapsed(self):
+        """Seconds spent on the conversion so far, or None if not started."""
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def status(self):
+        """Brief description of the progress of the conversion."""
+        if self.started is None:
+            return self.state
+        if self.progress is None:
+            return "{0:.0f} s".format(self.elapsed)
+        return "{0:.0f} s, {1} of {2}".format(self.elapsed,
+                                              pretty_bytes(self.progress[0]),
+                                              pretty_bytes(self.progress[1]))
+
+    def run(self):
+        """Run the conversion in the current thread.
+
+        The conversion is not :attr:`done` until :meth:`finish` is called.
+        """
+        self.state = 'running'
+        if self.started is None:
+            self.started = time.time()
+        _current.job = self
+        try:
+            self._result = self.function(*self.args)
+            self.state = 'done'
+        except Exception as exc:  # pylint: disable=broad-except
+            self._exception = exc
+            self.state = 'failed'
+        finally:
+            _current.job = None
+        self.finished = time.time()
+
+    def finish(self):
+        """Mark the conversion as finished, waking anyone waiting for it."""
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """Wait for the conversion to finish.
+
+        Args:
+          timeout (float): Maximum time to wait, in seconds, if any.
+
+        Returns:
+          bool: Whether the conversion has finished.
+        """
+        self._done.wait(timeout)
+        return self.done
+
+    def result(self):
+        """Wait for the conversion to finish and get its result.
+
+        Returns:
+          object: Whatever the conversion function returned.
+
+        Raises:
+          Exception: whatever the conversion function raised, if anything.
+        """
+        self.wait()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class ConversionScheduler(object):
+    """Runs independent disk conversions concurrently, within limits.
+
+    Each conversion runs in its own thread once fewer than
+    :attr:`max_jobs` conversions are running and its estimated memory
+    fits in what remains of :attr:`memory_budget`. Conversions start in
+    the order submitted, and a conversion estimated to need more than the
+    whole budget still runs, but only by itself. Threads suffice, as
+    helper programs run as subprocesses while native converters spend
+    their time in I/O and in :mod:`zlib`, neither of which holds the GIL.
+
+    Each conversion is also allotted a number of threads of its own (see
+    :func:`conversion_threads`), by default an equal share of the CPUs
+    among :attr:`max_jobs` conversions, or as given when it is submitted
+    (see :meth:`threads_per_job`).
+
+    Examples:
+      ::
+
+        >>> scheduler = ConversionScheduler(max_jobs=2)
+        >>> jobs = [scheduler.submit(str(n), pow, (n, 2)) for n in range(4)]
+        >>> scheduler.wait(jobs)
+        [0, 1, 4, 9]
+    """
+
+    DEFAULT_JOB_MEMORY = 256 << 20
+    """Memory assumed to be needed by a conversion, absent an estimate."""
+
+    DEFAULT_MEMORY_BUDGET = 1 << 30
+    """Default limit on the total memory of concurrent conversions."""
+
+    PROGRESS_INTERVAL = 10
+    """Seconds between progress reports while waiting for conversions."""
+
+    def __init__(self, max_jobs=None, memory_budget=None):
+        """Create a scheduler with the given limits.
+
+        Args:
+          max_jobs (int): Maximum number of concurrent conversions; if unset,
+              defaults to ``$COT_CONVERSION_JOBS`` or the number of CPUs.
+          memory_budget (int): Maximum total estimated memory of concurrent
+              conversions, in bytes; if unset, defaults to
+              ``$COT_CONVERSION_MEMORY`` or :attr:`DEFAULT_MEMORY_BUDGET`.
+        """
+        self._max_jobs = max_jobs
+        self._memory_budget = memory_budget
+        self._lock = threading.Lock()
+        self._queued = []
+        self._running = []
+
+    @property
+    def max_jobs(self):
+        """Maximum number of conversions to run at once."""
+        if self._max_jobs is not None:
+            return max(1, self._max_jobs)
+        return max(1, _environ_int('COT_CONVERSION_JOBS') or cpu_count())
+
+    @property
+    def memory_budget(self):
+        """Maximum total estimated memory of concurrent conversions."""
+        if self._memory_budget is not None:
+            return self._memory_budget
+        value = _environ_int('COT_CONVERSION_MEMORY')
+        if value is not None:
+            return value
+        return self.DEFAULT_MEMORY_BUDGET
+
+    def threads_per_job(self, count):
+        """Get how many threads each of several conversions may use.
+
+        Args:
+          count (int): Number of conversions to be run together.
+
+        Returns:
+          int: Threads per conversion such that, with at most
+          :attr:`max_jobs` of them running at once, they use about one
+          thread per CPU between them.
+        """
+        return max(1, cpu_count() // max(1, min(count, self.max_jobs)))
+
+    def available_threads(self):
+        """Get the number of CPUs not allotted to submitted conversions.
+
+        Returns:
+          int: Number of threads, at least 1.
+        """
+        with self._lock:
+            allotted = sum(job.threads for job in self._running + self._queued)
+        return max(1, cpu_count() - allotted)
+
+    def submit(self, name, function, args=(), memory=None, threads=None):
+        """Schedule a conversion to run as soon as limits allow.
+
+        Args:
+          name (str): Name of the disk being converted, for progress
+              reporting.
+          function (function): Function performing the conversion.
+          args (tuple): Positional arguments to pass to ``function``.
+          memory (int): Estimated memory needed by the conversion, in bytes;
+              defaults to :attr:`DEFAULT_JOB_MEMORY`.
+          threads (int): Number of threads the conversion may use; defaults
+              to ``threads_per_job(max_jobs)``.
+
+        Returns:
+          ConversionJob: The scheduled conversion.
+        """
+        if memory is None:
+            memory = self.DEFAULT_JOB_MEMORY
+        if threads is None:
+            threads = self.threads_per_job(self.max_jobs)
+        job = ConversionJob(name, function, args, memory, threads)
+        with self._lock:
+            self._queued.append(job)
+            self._dispatch()
+        return job
+
+    def _dispatch(self):
+        """Start as many queued conversions as limits allow.
+
+        Must be called with :attr:`_lock` held.
+        """
+        memory = sum(job.memory for job in self._running)
+        while self._queued and len(self._running) < self.max_jobs:
+            job = self._queued[0]
+            if self._running and memory + job.memory > self.memory_budget:
+                break
+            self._queued.pop(0)
+            self._running.append(job)
+            memory += job.memory
+            job.state = 'running'
+            job.started = time.time()
+            logger.verbose("Converting %s (%d running, %d queued)",
+                           job.name, len(self._running), len(self._queued))
+            thread = threading.Thread(target=self._run, args=(job,),
+                                      name="convert-" + job.name)
+            thread.daemon = True
+            thread.start()
+
+    def _run(self, job):
+        """Run the given conversion, then start any others now permitted.
+
+        The conversion is only marked as finished once it no longer counts
+        against the limits, so that anyone waiting for it sees its threads
+        and memory as free again.
+
+        Args:
+          job (ConversionJob): Conversion to run.
+        """
+        job.run()
+        if job.state == 'done':
+            logger.verbose("Converted %s in %.1f seconds",
+                           job.name, job.elapsed)
+        else:
+            logger.debug("Conversion of %s failed after %.1f seconds",
+                         job.name, job.elapsed)
+        with self._lock:
+            self._running.remove(job)
+            self._dispatch()
+        job.finish()
+
+    def wait(self, jobs):
+        """Wait for all of the given conversions to finish.
+
+        Progress of any unfinished conversions is logged periodically.
+        Even if one conversion fails, the others are left to finish, so
+        that none is still writing files once this returns.
+
+        Args:
+          jobs (list): :class:`ConversionJob` instances to wait for.
+
+        Returns:
+          list: Result of each conversion, in the same order as ``jobs``.
+
+        Raises:
+          Exception: whatever the first failed conversion (in the order
+              given) raised, if any.
+        """
+        jobs = list(jobs)
+        while True:
+            pending = [job for job in jobs if not job.done]
+            if not pending:
+                break
+            if pending[0].wait(self.PROGRESS_INTERVAL):
+                continue
+            logger.info("Waiting for disk conversions: %s", ", ".join(
+                "{0} ({1})".format(job.name, job.status) for job in pending))
+        return [job.result() for job in jobs]
+
+
+conversion_scheduler = ConversionScheduler()
+"""Scheduler shared by all disk conversions in COT."""
+
+
+def conversion_threads():
+    """Get the number of threads the current conversion may use.
+
+    Returns:
+      int: Threads allotted to the conversion being run by the current
+      thread, if any, else those not allotted to any conversion submitted
+      to :attr:`conversion_scheduler`.
+    """
+    job = getattr(_current, 'job', None)
+    if job is not None:
+        return job.threads
+    return conversion_scheduler.available_threads()
+
+
+def report_progress(done, total):
+    """Record the progress of the current conversion, if any.
+
+    Args:
+      done (int): Bytes converted so far.
+      total (int): Total bytes to convert.
+    """
+    job = getattr(_current, 'job', None)
+    if job is not None:
+        job.progress = (done, total)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+#
+# test_cache.py - Unit test cases for the disk metadata cache.
+#
+# Copyright (c) 2026 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Unit test cases for COT.disks.cache module."""
+
+import json
+import logging
+import os
+import shutil
+
+import mock
+
+from COT.tests import COTTestCase
+from COT.disks import DiskRepresentation, ISO, RAW, VMDK
+from COT.disks.cache import (
+    ConfigDiskCache, ConversionCache, DiskMetadataCache, config_disk_cache,
+    conversion_cache, disk_metadata_cache, file_digest,
+)
+from COT.helpers import helpers
+
+logger = logging.getLogger(__name__)
+
+# pylint: disable=missing-type-doc,missing-param-doc
+
+
+class TestDiskMetadataCache(COTTestCase):
+    """Test cases for DiskMetadataCache class."""
+
+    def test_persistence_and_invalidation(self):
+        """Entries persist across instances until the file is modified."""
+        path = os.path.join(self.temp_dir, "foo.img")
+        with open(path, 'w') as fileobj:
+            fileobj.write("Hello world")
+        cache = DiskMetadataCache(os.path.join(self.temp_dir, "cache"))
+        self.assertEqual(cache.get(path), {})
+
+        cache.update(path, {'format': 'raw'})
+        cache.update(path, {'raw': {'capacity': '11'}})
+        self.assertEqual(cache.get(path),
+                         {'format': 'raw', 'raw': {'capacity': '11'}})
+        # Updates are only saved in batches
+        self.assertFalse(os.path.exists(cache.path))
+        cache.flush()
+        cache2 = DiskMetadataCache(cache.directory)
+        self.assertEqual(cache2.get(path),
+                         {'format': 'raw', 'raw': {'capacity': '11'}})
+
+        with open(path, 'a') as fileobj:
+            fileobj.write("!")
+        self.assertEqual(cache.get(path), {})
+        self.assertEqual(cache2.get(path), {})
+
+        cache.clear()
+        self.assertEqual(DiskMetadataCache(cache.directory).get(path), {})
+
+    def test_batching_and_pruning(self):
+        """Updates are saved in batches, forgetting files since deleted."""
+        paths = [os.path.join(self.temp_dir, name)
+                 for name in ("foo.img", "bar.img", "baz.img")]
+        for path in paths:
+            with open(path, 'w') as fileobj:
+                fileobj.write("Hello world")
+        cache = DiskMetadataCache(os.path.join(self.temp_dir, "cache"))
+        with mock.patch.object(DiskMetadataCache, 'BATCH_SIZE', 2):
+            cache.update(paths[0], {'format': 'raw'})
+            self.assertFalse(os.path.exists(cache.path))
+            cache.update(paths[1], {'format': 'raw'})
+            self.assertTrue(os.path.exists(cache.path))
+            self.assertEqual(DiskMetadataCache(cache.directory)
+                             .get(paths[1]), {'format': 'raw'})
+
+            os.remove(paths[0])
+            cache.update(paths[2], {'format': 'raw'})
+            cache.flush()
+        with open(cache.path, 'r') as fileobj:
+            entries = json.load(fileobj)['entries']
+        self.assertEqual(sorted(entries),
+                         sorted(os.path.realpath(path)
+                                for path in paths[1:]))
+
+    def test_corrupt_or_disabled(self):
+        """A corrupt or disabled cache behaves as if empty."""
+        cache = DiskMetadataCache(os.path.join(self.temp_dir, "cache"))
+        os.makedirs(cache.directory)
+        with open(cache.path, 'w') as fileobj:
+            fileobj.write("{ not JSON")
+        self.assertEqual(cache.get(self.input_iso), {})
+        cache.update(self.input_iso, {'format': 'iso'})
+        cache.flush()
+        self.assertEqual(DiskMetadataCache(cache.directory)
+                         .get(self.input_iso), {'format': 'iso'})
+
+        with mock.patch.dict(os.environ, {'COT_CACHE_DIR': ''}):
+            cache = DiskMetadataCache()
+            self.assertEqual(cache.path, None)
+            cache.update(self.input_iso, {'format': 'iso'})
+            self.assertEqual(cache.get(self.input_iso), {})
+
+    def test_from_file_reuses_format(self):
+        """from_file() only probes an unmodified file once."""
+        path = os.path.join(self.temp_dir, "foo.img")
+        with open(path, 'w') as fileobj:
+            fileobj.write("Hello world")
+        with mock.patch.object(helpers['qemu-img'], 'call',
+                               return_value="file format: raw") as mock_call:
+            self.assertEqual(DiskRepresentation.from_file(path).disk_format,
+                             "raw")
+            self.assertEqual(mock_call.call_count, 1)
+            self.assertEqual(DiskRepresentation.from_file(path).disk_format,
+                             "raw")
+            self.assertEqual(mock_call.call_count, 1)
+
+            with open(path, 'a') as fileobj:
+                fileobj.write("!")
+            self.assertEqual(DiskRepresentation.from_file(path).disk_format,
+                             "raw")
+            self.assertEqual(mock_call.call_count, 2)
+
+    def test_properties_are_shared(self):
+        """Later instances for the same file reuse cached properties."""
+        iso_path = os.path.join(self.temp_dir, "input.iso")
+        shutil.copy(self.input_iso, iso_path)
+        with mock.patch.object(ISO, 'iter_files',
+                               return_value=["sample_cfg.txt"]) as mock_iter:
+            self.assertEqual(ISO(iso_path).files, ["sample_cfg.txt"])
+            self.assertEqual(mock_iter.call_count, 1)
+            iso = ISO(iso_path)
+            self.assertEqual(iso.files, ["sample_cfg.txt"])
+            self.assertEqual(iso.disk_subformat, "")
+            self.assertEqual(mock_iter.call_count, 1)
+
+        # Entries are per format, as a file may be treated as several
+        raw = RAW(iso_path)
+        self.assertEqual(raw.capacity, str(os.path.getsize(iso_path)))
+        entry = disk_metadata_cache.get(iso_path)
+        self.assertEqual(entry['iso']['files'], ["sample_cfg.txt"])
+        self.assertEqual(entry['raw'], {'capacity': raw.capacity})
+
+
+class TestConversionCache(COTTestCase):
+    """Test cases for ConversionCache class."""
+
+    def setUp(self):
+        """Test case setup function called automatically before each test."""
+        super(TestConversionCache, self).setUp()
+        self.source = os.path.join(self.temp_dir, "foo.img")
+        with open(self.source, 'wb') as fileobj:
+            fileobj.seek(1048576)
+            fileobj.write(b"Hello world")
+        for name in ("out1", "out2", "out3"):
+            os.makedirs(os.path.join(self.temp_dir, name))
+
+    def convert(self, directory):
+        """Convert the source image to VMDK in the given subdirectory."""
+        return conversion_cache.convert(
+            RAW(self.source), 'vmdk', os.path.join(self.temp_dir, directory),
+            'streamOptimized')
+
+    def test_reuse(self):
+        """A conversion is reused until the source image changes."""
+        first = self.convert("out1")
+        self.assertEqual(first.path,
+                         os.path.join(self.temp_dir, "out1", "foo.vmdk"))
+        with mock.patch.object(VMDK, 'from_other_image') as mock_convert:
+            second = self.convert("out2")
+            mock_convert.assert_not_called()
+        self.assertEqual(second.path,
+                         os.path.join(self.temp_dir, "out2", "foo.vmdk"))
+        self.assertEqual(second.disk_subformat, "streamOptimized")
+        with open(first.path, 'rb') as file1, open(second.path, 'rb') as file2:
+            self.assertEqual(file1.read(), file2.read())
+
+        # The source digest is remembered with its other metadata
+        self.assertEqual(disk_metadata_cache.get(self.source)['sha256'],
+                         file_digest(self.source))
+
+        with open(self.source, 'ab') as fileobj:
+            fileobj.write(b"!")
+        with mock.patch.object(VMDK, 'from_other_image',
+                               return_value=second) as mock_convert:
+            self.convert("out3")
+            self.assertEqual(mock_convert.call_count, 1)
+
+    def test_key(self):
+        """Keys depend on source contents, target format, and converter."""
+        copy = os.path.join(self.temp_dir, "bar.img")
+        shutil.copy(self.source, copy)
+        key = ConversionCache.key(self.source, 'vmdk', 'streamOptimized',
+                                  "COT 1.0")
+        self.assertEqual(key, ConversionCache.key(
+            copy, 'vmdk', 'streamOptimized', "COT 1.0"))
+        self.assertNotEqual(key, ConversionCache.key(
+            copy, 'vmdk', 'monolithicSparse', "COT 1.0"))
+        self.assertNotEqual(key, ConversionCache.key(
+            copy, 'vmdk', 'streamOptimized', "COT 1.1"))
+
+    def test_eviction(self):
+        """The least recently used images are evicted beyond the limit."""
+        cache = ConversionCache(os.path.join(self.temp_dir, "cache"),
+                                max_size=250)
+        for (index, key) in enumerate(("a", "b", "c")):
+            path = os.path.join(self.temp_dir, key + ".img")
+            with open(path, 'wb') as fileobj:
+                fileobj.write(b"x" * 100)
+            cache.store(key, path)
+            os.utime(os.path.join(cache.directory, key), (index, index))
+            if key == "b":
+                # Use "a" so that "b" becomes the least recently used
+                self.assertTrue(cache.fetch(
+                    "a", os.path.join(self.temp_dir, "a-copy.img")))
+        self.assertEqual(sorted(os.listdir(cache.directory)), ["a", "c"])
+        self.assertFalse(cache.fetch(
+            "b", os.path.join(self.temp_dir, "b-copy.img")))
+        self.assertIsNone(cache.lookup("b"))
+
+        cache.clear()
+        self.assertFalse(os.path.exists(cache.directory))
+
+    def test_disabled(self):
+        """No images are cached if the size limit is 0."""
+        with mock.patch.dict(os.environ, {'COT_CONVERSION_CACHE_SIZE': '0'}):
+            self.assertFalse(conversion_cache.enabled)
+            self.convert("out1")
+            with mock.patch.object(VMDK, 'from_other_image') as mock_convert:
+                self.convert("out2")
+                self.assertEqual(mock_convert.call_count, 1)
+        self.assertFalse(os.path.exists(conversion_cache.directory))
+
+    def test_unwritable_directory(self):
+        """Failure to cache an image doesn't prevent its creation."""
+        blocker = os.path.join(self.temp_dir, "blocker")
+        with open(blocker, 'w') as fileobj:
+            fileobj.write("not a directory")
+        conversion_cache.directory = os.path.join(blocker, "conversions")
+        config_disk_cache.directory = os.path.join(blocker, "config_disks")
+
+        disk = self.convert("out1")
+        self.assertEqual(disk.path,
+                         os.path.join(self.temp_dir, "out1", "foo.vmdk"))
+        self.assertIsNone(conversion_cache.lookup(
+            ConversionCache.key(self.source, 'vmdk', 'streamOptimized',
+                                "COT 1.0")))
+        conversion_cache.evict()
+
+        disk = config_disk_cache.create(
+            os.path.join(self.temp_dir, "config.iso"), 'iso',
+            [self.sample_cfg])
+        self.assertTrue(os.path.exists(disk.path))
+
+
+class TestConfigDiskCache(COTTestCase):
+    """Test cases for ConfigDiskCache class."""
+
+    def test_contents_key(self):
+        """Keys depend on the name and contents of every file."""
+        config_dir = os.path.join(self.temp_dir, "configs")
+        os.makedirs(os.path.join(config_dir, "sub"))
+        config = os.path.join(config_dir, "sub", "config.txt")
+        with open(config, 'w') as fileobj:
+            fileobj.write("hostname foo")
+        files = [self.input_ovf, config_dir]
+        key = ConfigDiskCache.contents_key('iso', files, "COT 1.0")
+        self.assertNotEqual(key, ConfigDiskCache.contents_key(
+            'raw', files, "COT 1.0"))
+        self.assertNotEqual(key, ConfigDiskCache.contents_key(
+            'iso', [self.minimal_ovf, config_dir], "COT 1.0"))
+
+        os.rename(config, os.path.join(config_dir, "sub", "config2.txt"))
+        key2 = ConfigDiskCache.contents_key('iso', files, "COT 1.0")
+        self.assertNotEqual(key, key2)
+        with open(os.path.join(config_dir, "sub", "config2.txt"),
+                  'a') as fileobj:
+            fileobj.write("!")
+        self.assertNotEqual(key2, ConfigDiskCache.contents_key(
+            'iso', files, "COT 1.0"))
+
+    def test_create(self):
+        """A disk with the same contents is reused along with its digests."""
+        first = config_disk_cache.create(
+            os.path.join(self.temp_dir, "first.iso"), 'iso', [self.sample_cfg])
+        with mock.patch.object(ISO, 'create_file') as mock_create:
+            second = config_disk_cache.create(
+                os.path.join(self.temp_dir, "second.iso"), 'iso',
+                [self.sample_cfg])
+            mock_create.assert_not_called()
+        self.assertEqual(second.disk_format, 'iso')
+        self.assertEqual(disk_metadata_cache.get(second.path)['sha1'],
+                         file_digest(first.path, 'sha1'))
+        with open(first.path, 'rb') as file1, open(second.path, 'rb') as file2:
+            self.assertEqual(file1.read(), file2.read())
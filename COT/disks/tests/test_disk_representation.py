@@ -18,6 +18,7 @@
 
 import logging
 import os
+import tarfile
 import mock
 
 from COT.tests import COTTestCase
@@ -86,15 +87,67 @@ class TestDiskRepresentation(COTTestCase):
                           None)
         with mock.patch('COT.helpers.helper.check_output') as mock_co:
             mock_co.return_value = "qemu-img info: unsupported command"
+            # VMDKs are recognized without qemu-img, so use a file with no
+            # magic number, which must be probed with qemu-img
             self.assertRaises(RuntimeError,
                               DiskRepresentation.from_file,
-                              self.input_vmdk)
+                              self.input_ovf)
         # We support QCOW2 but not QCOW at present
         temp_path = os.path.join(self.temp_dir, "foo.qcow")
         helpers['qemu-img'].call(['create', '-f', 'qcow', temp_path, '8M'])
         self.assertRaises(NotImplementedError,
                           DiskRepresentation.from_file, temp_path)
 
+    @mock.patch('COT.helpers.helper.check_output')
+    def test_from_file_magic(self, mock_check_output):
+        """Formats with a magic number are identified without helpers."""
+        self.assertEqual("vmdk",
+                         DiskRepresentation.format_from_magic(self.blank_vmdk))
+        self.assertEqual("iso",
+                         DiskRepresentation.format_from_magic(self.input_iso))
+        self.assertEqual(None,
+                         DiskRepresentation.format_from_magic(self.input_ovf))
+        self.assertEqual("vmdk",
+                         DiskRepresentation.from_file(self.input_vmdk)
+                         .disk_format)
+        self.assertEqual("iso",
+                         DiskRepresentation.from_file(self.input_iso)
+                         .disk_format)
+        temp_path = os.path.join(self.temp_dir, "foo.vdi")
+        with open(temp_path, 'wb') as fileobj:
+            fileobj.write(b"<<< Oracle VM VirtualBox Disk Image >>>\n")
+            fileobj.write(b"\x00" * (0x40 - fileobj.tell()))
+            fileobj.write(b"\x7f\x10\xda\xbe")
+        self.assertRaises(NotImplementedError,
+                          DiskRepresentation.from_file, temp_path)
+        mock_check_output.assert_not_called()
+
+    def test_identify(self):
+        """Identify disks within a TAR archive without extracting them."""
+        raw_path = os.path.join(self.temp_dir, "foo.img")
+        with open(raw_path, 'wb') as fileobj:
+            fileobj.write(b"Hello world")
+        tar_path = os.path.join(self.temp_dir, "disks.tar")
+        with tarfile.open(tar_path, 'w') as tarf:
+            for path in [self.input_vmdk, self.input_iso, raw_path]:
+                tarf.add(path, os.path.basename(path))
+        with mock.patch.object(helpers['qemu-img'], 'call') as mock_call:
+            with tarfile.open(tar_path, 'r') as tarf:
+                self.assertEqual(
+                    DiskRepresentation.identify(
+                        tarf.extractfile("input.vmdk")),
+                    ("vmdk", "streamOptimized", 1073741824))
+                self.assertEqual(
+                    DiskRepresentation.identify(
+                        tarf.extractfile("input.iso")),
+                    ("iso", "", self.FILE_SIZE['input.iso']))
+                self.assertEqual(
+                    DiskRepresentation.identify(tarf.extractfile("foo.img")),
+                    ("raw", None, 11))
+            self.assertEqual(DiskRepresentation.identify(self.blank_vmdk),
+                             ("vmdk", "streamOptimized", 536870912))
+            mock_call.assert_not_called()
+
     @mock.patch('COT.helpers.helper.check_output')
     def test_capacity_qemu_error(self, mock_check_output):
         """Test error handline if qemu-img reports an error."""
@@ -16,12 +16,16 @@
 
 """Unit test cases for ISO subclass of DiskRepresentation."""
 
+import io
 import logging
 import os
+import shutil
+import struct
 import mock
 
 from COT.tests import COTTestCase
-from COT.disks import ISO
+from COT.disks import ISO, NativeUnsupportedError
+from COT.disks.iso import ISO9660Reader, ISO9660Writer
 from COT.helpers import (
     helpers, HelperError, HelperNotFoundError,
 )
@@ -60,6 +64,17 @@ class TestISO(COTTestCase):
                              ['iosxr_config.txt', 'iosxr_config_admin.txt'])
         self.assertEqual(iso.predicted_drive_type, 'cdrom')
 
+    def test_header_parsing(self):
+        """Format and subformat are read from the ISO without isoinfo."""
+        with mock.patch.object(helpers['isoinfo'], 'call') as mock_call:
+            self.assertEqual(100, ISO.file_is_this_type(self.input_iso))
+            self.assertEqual(0, ISO.file_is_this_type(self.blank_vmdk))
+            iso = ISO(self.input_iso)
+            self.assertEqual(iso.disk_subformat, "")
+            self.assertEqual(iso.capacity, str(self.FILE_SIZE['input.iso']))
+            mock_call.assert_not_called()
+        self.assertIsNone(ISO.read_header(self.blank_vmdk))
+
     def test_create_with_files(self):
         """Creation of a ISO with specific file contents."""
         disk_path = os.path.join(self.temp_dir, "out.iso")
@@ -115,8 +130,117 @@ Setting input-charset to 'UTF-8' from locale.
                           path=os.path.join(self.temp_dir, "out.iso"),
                           capacity="100")
 
+    @mock.patch("COT.disks.iso.helper_select")
+    def test_create_native(self, mock_select):
+        """Creation of an ISO without any helper program."""
+        extra_dir = os.path.join(self.temp_dir, "configs")
+        os.makedirs(os.path.join(extra_dir, "subdirectory"))
+        shutil.copy(self.minimal_ovf, extra_dir)
+        shutil.copy(self.invalid_ovf, os.path.join(extra_dir, "subdirectory"))
+        files = [self.input_ovf, extra_dir]
+
+        ISO.create_file(path=self.foo_iso, files=files)
+        self.assertEqual(ISO.read_header(self.foo_iso),
+                         ("rockridge", os.path.getsize(self.foo_iso)))
+        if helpers['isoinfo']:
+            self.assertEqual(ISO(self.foo_iso).files,
+                             ['input.ovf', 'minimal.ovf', 'subdirectory',
+                              'subdirectory/invalid.ovf'])
+
+        # Output is deterministic
+        bar_iso = os.path.join(self.temp_dir, "bar.iso")
+        ISO.create_file(path=bar_iso, files=files)
+        with open(self.foo_iso, 'rb') as foo, open(bar_iso, 'rb') as bar:
+            self.assertEqual(foo.read(), bar.read())
+
+        baz_iso = os.path.join(self.temp_dir, "baz.iso")
+        ISO.create_file(path=baz_iso, files=files, disk_subformat="")
+        self.assertEqual(ISO.read_header(baz_iso),
+                         ("", os.path.getsize(baz_iso)))
+        mock_select.assert_not_called()
+
+        # Duplicate file names are rejected
+        self.assertRaises(ValueError, ISO9660Writer,
+                          [self.minimal_ovf, extra_dir])
+
+    def test_files_native(self):
+        """File lists and contents are read without isoinfo."""
+        extra_dir = os.path.join(self.temp_dir, "configs")
+        os.makedirs(os.path.join(extra_dir, "subdirectory"))
+        shutil.copy(self.invalid_ovf, os.path.join(extra_dir, "subdirectory"))
+        for subformat in ("rockridge", ""):
+            path = os.path.join(self.temp_dir, "out{0}.iso".format(subformat))
+            ISO.create_file(path=path, files=[self.input_ovf, extra_dir],
+                            disk_subformat=subformat)
+            with mock.patch.object(helpers['isoinfo'], 'call') as mock_call:
+                iso = ISO(path)
+                self.assertEqual(iso.files,
+                                 ['input.ovf', 'subdirectory',
+                                  'subdirectory/invalid.ovf'])
+                contents = dict(iso.iter_files(contents=True))
+                mock_call.assert_not_called()
+            self.assertIsNone(contents['subdirectory'])
+            with open(self.invalid_ovf, 'rb') as fileobj:
+                self.assertEqual(contents['subdirectory/invalid.ovf'],
+                                 fileobj.read())
+
+        with mock.patch.object(helpers['isoinfo'], 'call') as mock_call:
+            self.assertEqual(list(ISO(self.input_iso).iter_files()),
+                             ['iosxr_config.txt', 'iosxr_config_admin.txt'])
+            mock_call.assert_not_called()
+
+    def test_rock_ridge_info(self):
+        """Rock Ridge names and directory relocations are understood."""
+        image = io.BytesIO()
+        ISO9660Writer([self.input_ovf]).write(image)
+        reader = ISO9660Reader(image)
+
+        def record(system_use):
+            """Make a directory record with identifier 'A'."""
+            return bytearray(struct.pack("32xB", 1) + b"A" + system_use)
+
+        self.assertEqual(reader._rock_ridge_info(record(b"")),
+                         (None, False, None))
+        # Name split across two NM entries, the first flagged CONTINUE
+        name = b"NM\x08\x01\x01foo" + b"NM\x08\x01\x00bar"
+        self.assertEqual(reader._rock_ridge_info(record(name)),
+                         (u"foobar", False, None))
+        # Placeholder for a directory relocated to block 42
+        child = (b"NM\x08\x01\x00baz" + b"CL\x0c\x01" +
+                 struct.pack("<I", 42) + struct.pack(">I", 42))
+        self.assertEqual(reader._rock_ridge_info(record(child)),
+                         (u"baz", False, 42))
+        # The relocated directory itself
+        self.assertEqual(reader._rock_ridge_info(record(b"RE\x04\x01")),
+                         (None, True, None))
+
+    @mock.patch("COT.helpers.mkisofs.MkISOFS.call")
+    def test_create_native_fallback(self, mock_call):
+        """Contents that ISO 9660 can't represent natively use a helper."""
+        helpers['mkisofs']._installed = True
+        extra_dir = os.path.join(self.temp_dir, "configs")
+        os.makedirs(os.path.join(extra_dir, *("d{0}".format(i)
+                                              for i in range(8))))
+        ISO.create_file(path=self.foo_iso, files=[extra_dir])
+        mock_call.assert_called_with(
+            ['-output', self.foo_iso, '-full-iso9660-filenames',
+             '-iso-level', '2', '-allow-lowercase', '-r', extra_dir])
+        self.assertFalse(os.path.exists(self.foo_iso))
+
+    @mock.patch.object(ISO9660Writer, "create",
+                       side_effect=NotImplementedError("bug"))
+    @mock.patch("COT.helpers.mkisofs.MkISOFS.call")
+    def test_create_native_error(self, mock_call, _):
+        """Other errors in building an ISO natively don't use a helper."""
+        helpers['mkisofs']._installed = True
+        self.assertRaises(NotImplementedError, ISO.create_file,
+                          path=self.foo_iso, files=[self.input_ovf])
+        mock_call.assert_not_called()
+
+    @mock.patch.object(ISO9660Writer, "create",
+                       side_effect=NativeUnsupportedError("forced fallback"))
     @mock.patch("COT.helpers.mkisofs.MkISOFS.call")
-    def test_create_with_mkisofs(self, mock_call):
+    def test_create_with_mkisofs(self, mock_call, _):
         """Creation of an ISO with mkisofs (default)."""
         helpers['mkisofs']._installed = True
         ISO.create_file(path=self.foo_iso, files=[self.input_ovf])
@@ -124,8 +248,10 @@ Setting input-charset to 'UTF-8' from locale.
             ['-output', self.foo_iso, '-full-iso9660-filenames',
              '-iso-level', '2', '-allow-lowercase', '-r', self.input_ovf])
 
+    @mock.patch.object(ISO9660Writer, "create",
+                       side_effect=NativeUnsupportedError("forced fallback"))
     @mock.patch("COT.helpers.mkisofs.GenISOImage.call")
-    def test_create_with_genisoimage(self, mock_call):
+    def test_create_with_genisoimage(self, mock_call, _):
         """Creation of an ISO with genisoimage if mkisofs is unavailable."""
         helpers['mkisofs']._installed = False
         helpers['genisoimage']._installed = True
@@ -134,8 +260,10 @@ Setting input-charset to 'UTF-8' from locale.
             ['-output', self.foo_iso, '-full-iso9660-filenames',
              '-iso-level', '2', '-allow-lowercase', '-r', self.input_ovf])
 
+    @mock.patch.object(ISO9660Writer, "create",
+                       side_effect=NativeUnsupportedError("forced fallback"))
     @mock.patch("COT.helpers.mkisofs.XorrISO.call")
-    def test_create_with_xorriso(self, mock_call):
+    def test_create_with_xorriso(self, mock_call, _):
         """Creation of an ISO with xorriso as last resort."""
         helpers['mkisofs']._installed = False
         helpers['genisoimage']._installed = False
@@ -146,7 +274,9 @@ Setting input-charset to 'UTF-8' from locale.
              '-full-iso9660-filenames', '-iso-level', '2', '-allow-lowercase',
              '-r', self.input_ovf])
 
-    def test_create_no_helpers_available(self):
+    @mock.patch.object(ISO9660Writer, "create",
+                       side_effect=NativeUnsupportedError("forced fallback"))
+    def test_create_no_helpers_available(self, _):
         """Creation of ISO should fail if no helpers are install[ed|able]."""
         helpers['mkisofs']._installed = False
         helpers['genisoimage']._installed = False
@@ -160,8 +290,10 @@ Setting input-charset to 'UTF-8' from locale.
                           path=self.foo_iso,
                           files=[self.input_ovf])
 
+    @mock.patch.object(ISO9660Writer, "create",
+                       side_effect=NativeUnsupportedError("forced fallback"))
     @mock.patch("COT.helpers.mkisofs.MkISOFS.call")
-    def test_create_with_mkisofs_non_rockridge(self, mock_call):
+    def test_create_with_mkisofs_non_rockridge(self, mock_call, _):
         """Creation of a non-Rock-Ridge ISO with mkisofs (default)."""
         helpers['mkisofs']._installed = True
         ISO.create_file(path=self.foo_iso, files=[self.input_ovf],
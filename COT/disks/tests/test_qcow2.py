@@ -40,6 +40,21 @@ class TestQCOW2(COTTestCase):
         self.temp_disk = os.path.join(self.temp_dir, "blank.img")
         helpers['qemu-img'].call(['create', '-f', 'raw', self.temp_disk, "8M"])
 
+    def test_header_parsing(self):
+        """Capacity and format are read from the QCOW2 header."""
+        qcow2_path = os.path.join(self.temp_dir, "foo.qcow2")
+        helpers['qemu-img'].call(['create', '-f', 'qcow2', qcow2_path, "24M"])
+        qcow_path = os.path.join(self.temp_dir, "foo.qcow")
+        helpers['qemu-img'].call(['create', '-f', 'qcow', qcow_path, "8M"])
+        with mock.patch.object(helpers['qemu-img'], 'call') as mock_call:
+            self.assertEqual(100, QCOW2.file_is_this_type(qcow2_path))
+            self.assertEqual(0, QCOW2.file_is_this_type(qcow_path))
+            self.assertEqual(0, QCOW2.file_is_this_type(self.temp_disk))
+            qcow2 = QCOW2(qcow2_path)
+            self.assertEqual(qcow2.capacity, str(24 * 1024 * 1024))
+            self.assertEqual(qcow2.disk_subformat, None)
+            mock_call.assert_not_called()
+
     def test_init_with_files_unsupported(self):
         """Creation of a QCOW2 with specific file contents is not supported."""
         self.assertRaises(NotImplementedError,
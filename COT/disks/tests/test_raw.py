@@ -19,11 +19,11 @@
 import logging
 import os
 
-from distutils.version import StrictVersion
 import mock
 
 from COT.tests import COTTestCase
-from COT.disks import RAW, VMDK, DiskRepresentation
+from COT.disks import RAW, VMDK, DiskRepresentation, NativeUnsupportedError
+from COT.disks.raw import FATWriter
 from COT.helpers import HelperError
 
 logger = logging.getLogger(__name__)
@@ -49,34 +49,32 @@ class TestRAW(COTTestCase):
         self.assertEqual(raw.disk_subformat, None)
         self.assertEqual(raw.predicted_drive_type, 'harddisk')
 
-    @mock.patch('COT.helpers.qemu_img.QEMUImg.version',
-                new_callable=mock.PropertyMock,
-                return_value=StrictVersion("1.0.0"))
-    @mock.patch('os.path.exists', return_value=True)
     @mock.patch('COT.helpers.qemu_img.QEMUImg.call')
     @mock.patch('COT.helpers.vmdktool.VMDKTool.call')
-    def test_convert_from_vmdk_old_qemu(self, mock_vmdktool, mock_qemuimg, *_):
-        """Test conversion from streamOptimized VMDK with old QEMU."""
-        RAW.from_other_image(VMDK(self.blank_vmdk), self.temp_dir)
+    def test_convert_from_vmdk_native(self, mock_vmdktool, mock_qemuimg):
+        """Conversion from streamOptimized VMDK needs no helpers."""
+        raw = RAW.from_other_image(VMDK(self.blank_vmdk), self.temp_dir)
 
-        mock_vmdktool.assert_called_with([
-            '-s', os.path.join(self.temp_dir, "blank.img"), self.blank_vmdk])
+        self.assertEqual(raw.path, os.path.join(self.temp_dir, "blank.img"))
+        self.assertEqual(os.path.getsize(raw.path), 536870912)
+        mock_vmdktool.assert_not_called()
         mock_qemuimg.assert_not_called()
 
-    @mock.patch('COT.helpers.qemu_img.QEMUImg.version',
-                new_callable=mock.PropertyMock,
-                return_value=StrictVersion("1.2.0"))
-    @mock.patch('os.path.exists', return_value=True)
-    @mock.patch('COT.helpers.qemu_img.QEMUImg.call')
-    @mock.patch('COT.helpers.vmdktool.VMDKTool.call')
-    def test_convert_from_vmdk_new_qemu(self, mock_vmdktool, mock_qemuimg, *_):
-        """Test conversion from streamOptimized VMDK with new QEMU."""
-        RAW.from_other_image(VMDK(self.blank_vmdk), self.temp_dir)
-
-        mock_vmdktool.assert_not_called()
-        mock_qemuimg.assert_called_with([
-            'convert', '-O', 'raw', self.blank_vmdk,
-            os.path.join(self.temp_dir, "blank.img")])
+    def test_convert_from_vmdk_contents(self):
+        """Contents survive a round trip through streamOptimized VMDK."""
+        data = os.urandom(100000)
+        input_path = os.path.join(self.temp_dir, "input.img")
+        with open(input_path, 'wb') as fileobj:
+            fileobj.seek(65536 * 700)
+            fileobj.write(data)
+        os.makedirs(os.path.join(self.temp_dir, "out"))
+        vmdk = VMDK.from_other_image(RAW(input_path), self.temp_dir)
+        raw = RAW.from_other_image(vmdk, os.path.join(self.temp_dir, "out"))
+        with open(raw.path, 'rb') as fileobj:
+            self.assertEqual(fileobj.read(65536 * 700),
+                             b"\0" * (65536 * 700))
+            self.assertEqual(fileobj.read(len(data)), data)
+        self.assertEqual(raw.capacity, vmdk.capacity)
 
     def test_create_with_capacity(self):
         """Creation of a raw image of a particular size."""
@@ -103,3 +101,99 @@ class TestRAW(COTTestCase):
         self.assertEqual(raw.files,
                          [os.path.basename(self.input_ovf)])
         self.assertEqual(raw.capacity, "67108864")
+
+    @mock.patch('COT.helpers.fatdisk.FatDisk.call')
+    def test_create_native(self, mock_fatdisk):
+        """FAT file systems are built without calling fatdisk."""
+        os.makedirs(os.path.join(self.temp_dir, "configs", "sub"))
+        with open(os.path.join(self.temp_dir, "configs", "sub",
+                               "A long file name.txt"), 'w') as fileobj:
+            fileobj.write("hello")
+        files = [self.input_ovf, os.path.join(self.temp_dir, "configs")]
+        disk_path = os.path.join(self.temp_dir, "out.img")
+        RAW.create_file(disk_path, files=files)
+        mock_fatdisk.assert_not_called()
+        self.assertEqual(os.path.getsize(disk_path), 8388608)
+        with open(disk_path, 'rb') as fileobj:
+            data = fileobj.read()
+        self.assertEqual(data[54:62], b"FAT16   ")
+        self.assertEqual(data[510:512], b"\x55\xaa")
+        with open(self.input_ovf, 'rb') as fileobj:
+            self.assertTrue(fileobj.read() in data)
+        self.assertTrue("A long file name.txt".encode('utf-16-le')[:10]
+                        in data)
+        # Free space is left sparse
+        if hasattr(os.stat(disk_path), 'st_blocks'):
+            self.assertLess(os.stat(disk_path).st_blocks * 512, 8388608)
+
+        # Identical inputs produce an identical image
+        again_path = os.path.join(self.temp_dir, "again.img")
+        RAW.create_file(again_path, files=files)
+        with open(again_path, 'rb') as fileobj:
+            self.assertEqual(fileobj.read(), data)
+
+        # Larger volumes use FAT32
+        writer = FATWriter(files, capacity="1G")
+        self.assertEqual(writer.fat_type, 'FAT32')
+        self.assertEqual(writer.capacity, 1 << 30)
+
+        # FAT names are case-insensitive
+        upper_path = os.path.join(self.temp_dir, "INPUT.OVF")
+        with open(upper_path, 'w') as fileobj:
+            fileobj.write("hello")
+        with self.assertRaises(ValueError):
+            FATWriter([self.input_ovf, upper_path])
+
+    @mock.patch('COT.helpers.fatdisk.FatDisk.call')
+    def test_create_native_fallback(self, mock_fatdisk):
+        """Volumes unsuitable for FAT16 are created by fatdisk instead."""
+        disk_path = os.path.join(self.temp_dir, "out.img")
+        RAW.create_file(disk_path, files=[self.input_ovf], capacity="1M")
+        mock_fatdisk.assert_any_call([disk_path, 'format', 'size', '1M',
+                                      'fat32'])
+        mock_fatdisk.assert_any_call([disk_path, 'fileadd', self.input_ovf,
+                                      os.path.basename(self.input_ovf)])
+
+        # As are volumes whose root directory leaves too few clusters
+        mock_fatdisk.reset_mock()
+        with mock.patch.object(FATWriter, 'ROOT_ENTRIES', 4096):
+            self.assertRaises(NativeUnsupportedError, FATWriter,
+                              [self.input_ovf], capacity=str(8400 * 512))
+            RAW.create_file(disk_path, files=[self.input_ovf],
+                            capacity=str(8400 * 512))
+        mock_fatdisk.assert_any_call([disk_path, 'format', 'size',
+                                      str(8400 * 512), 'fat32'])
+
+    @mock.patch.object(FATWriter, 'create',
+                       side_effect=NotImplementedError("bug"))
+    @mock.patch('COT.helpers.fatdisk.FatDisk.call')
+    def test_create_native_error(self, mock_fatdisk, _):
+        """Other errors in building FAT natively don't fall back to fatdisk."""
+        disk_path = os.path.join(self.temp_dir, "out.img")
+        self.assertRaises(NotImplementedError, RAW.create_file, disk_path,
+                          files=[self.input_ovf], capacity="16M")
+        mock_fatdisk.assert_not_called()
+
+    @mock.patch('COT.helpers.fatdisk.FatDisk.call')
+    def test_files_native(self, mock_fatdisk):
+        """File lists and contents are read without calling fatdisk."""
+        extra_dir = os.path.join(self.temp_dir, "configs")
+        os.makedirs(os.path.join(extra_dir, "Sub Directory"))
+        with open(os.path.join(extra_dir, "Sub Directory",
+                               "config.txt"), 'w') as fileobj:
+            fileobj.write("hello")
+        for capacity in (None, "1G"):
+            disk_path = os.path.join(self.temp_dir,
+                                     "out{0}.img".format(capacity))
+            RAW.create_file(disk_path, files=[self.input_ovf, extra_dir],
+                            capacity=capacity)
+            raw = RAW(disk_path)
+            self.assertEqual(raw.files,
+                             ['Sub Directory', 'input.ovf',
+                              'Sub Directory/config.txt'])
+            contents = dict(raw.iter_files(contents=True))
+            self.assertIsNone(contents['Sub Directory'])
+            self.assertEqual(contents['Sub Directory/config.txt'], b"hello")
+            with open(self.input_ovf, 'rb') as fileobj:
+                self.assertEqual(contents['input.ovf'], fileobj.read())
+        mock_fatdisk.assert_not_called()
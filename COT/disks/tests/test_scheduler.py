@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# test_scheduler.py - Unit test cases for the disk conversion scheduler.
+#
+# Copyright (c) 2026 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Unit test cases for COT.disks.scheduler module."""
+
+import logging
+import os
+import threading
+
+import mock
+
+from COT.tests import COTTestCase
+from COT.disks.scheduler import (
+    ConversionScheduler, conversion_scheduler, conversion_threads,
+    report_progress,
+)
+
+logger = logging.getLogger(__name__)
+
+# pylint: disable=missing-type-doc,missing-param-doc
+
+
+class TestConversionScheduler(COTTestCase):
+    """Test cases for ConversionScheduler class."""
+
+    def setUp(self):
+        """Test case setup function called automatically before each test."""
+        super(TestConversionScheduler, self).setUp()
+        self.release = threading.Event()
+
+    def tearDown(self):
+        """Test case cleanup function called automatically after each test."""
+        # Never leave a conversion thread blocked
+        self.release.set()
+        super(TestConversionScheduler, self).tearDown()
+
+    def blocked(self, value):
+        """Conversion function that waits until released."""
+        self.assertTrue(self.release.wait(10))
+        return value
+
+    def test_max_jobs(self):
+        """No more than max_jobs conversions run at once."""
+        scheduler = ConversionScheduler(max_jobs=2)
+        jobs = [scheduler.submit(name, self.blocked, (name,))
+                for name in ("boot", "data", "config")]
+        self.assertEqual([job.state for job in jobs],
+                         ['running', 'running', 'queued'])
+        self.assertIsNone(jobs[2].elapsed)
+        self.release.set()
+        self.assertEqual(scheduler.wait(jobs), ["boot", "data", "config"])
+        self.assertEqual([job.state for job in jobs], ['done'] * 3)
+        self.assertTrue(all(job.elapsed >= 0 for job in jobs))
+
+    def test_memory_budget(self):
+        """Conversions only run together if their memory fits the budget."""
+        scheduler = ConversionScheduler(max_jobs=4, memory_budget=100)
+        jobs = [scheduler.submit("a", self.blocked, ("a",), memory=60),
+                scheduler.submit("b", self.blocked, ("b",), memory=30),
+                scheduler.submit("c", self.blocked, ("c",), memory=30)]
+        self.assertEqual([job.state for job in jobs],
+                         ['running', 'running', 'queued'])
+        self.release.set()
+        self.assertEqual(scheduler.wait(jobs), ["a", "b", "c"])
+
+        # A conversion needing more than the whole budget runs alone
+        big = scheduler.submit("big", self.blocked, ("big",), memory=500)
+        self.assertEqual(scheduler.wait([big]), ["big"])
+
+    def test_defaults(self):
+        """Limits come from the environment unless given explicitly."""
+        with mock.patch.dict(os.environ, {'COT_CONVERSION_JOBS': '3',
+                                          'COT_CONVERSION_MEMORY': '1000'}):
+            self.assertEqual(ConversionScheduler().max_jobs, 3)
+            self.assertEqual(ConversionScheduler().memory_budget, 1000)
+            self.assertEqual(ConversionScheduler(max_jobs=1).max_jobs, 1)
+        with mock.patch.dict(os.environ, {'COT_CONVERSION_JOBS': 'x',
+                                          'COT_CONVERSION_MEMORY': ''}):
+            self.assertGreaterEqual(ConversionScheduler().max_jobs, 1)
+            self.assertEqual(ConversionScheduler().memory_budget,
+                             ConversionScheduler.DEFAULT_MEMORY_BUDGET)
+
+    def test_failure(self):
+        """A failed conversion is reported once all others have finished."""
+        def fail():
+            """Conversion function that fails."""
+            raise ValueError("oops")
+
+        scheduler = ConversionScheduler(max_jobs=2)
+        jobs = [scheduler.submit("bad", fail),
+                scheduler.submit("good", self.blocked, ("good",))]
+        self.assertTrue(jobs[0].wait(10))
+        self.assertEqual(jobs[0].state, 'failed')
+        self.release.set()
+        with self.assertRaises(ValueError):
+            scheduler.wait(jobs)
+        self.assertEqual(jobs[1].result(), "good")
+
+    @mock.patch('COT.disks.scheduler.cpu_count', return_value=8)
+    def test_threads(self, _):
+        """Conversions run together share the CPUs between them."""
+        scheduler = ConversionScheduler(max_jobs=2)
+        self.assertEqual(scheduler.threads_per_job(1), 8)
+        self.assertEqual(scheduler.threads_per_job(2), 4)
+        self.assertEqual(scheduler.threads_per_job(5), 4)
+        self.assertEqual(ConversionScheduler(max_jobs=16).threads_per_job(16),
+                         1)
+
+        # Each conversion sees its own allotment
+        jobs = [scheduler.submit("a", conversion_threads),
+                scheduler.submit("b", conversion_threads, threads=3)]
+        self.assertEqual(scheduler.wait(jobs), [4, 3])
+
+        # Outside any conversion, whatever isn't allotted is available
+        self.assertEqual(conversion_threads(), 8)
+        job = conversion_scheduler.submit("c", self.blocked, ("c",),
+                                          threads=3)
+        self.assertEqual(conversion_threads(), 5)
+        self.release.set()
+        self.assertEqual(conversion_scheduler.wait([job]), ["c"])
+        self.assertEqual(conversion_threads(), 8)
+
+    def test_progress(self):
+        """Conversions may report how many bytes they have converted."""
+        def convert():
+            """Conversion function that reports progress, then waits."""
+            report_progress(1024, 4096)
+            return self.blocked("a")
+
+        # Outside any conversion, this does nothing
+        report_progress(1, 2)
+
+        scheduler = ConversionScheduler(max_jobs=1)
+        jobs = [scheduler.submit("a", convert),
+                scheduler.submit("b", self.blocked, ("b",))]
+        for _ in range(1000):
+            if jobs[0].progress is not None:
+                break
+            jobs[0].wait(0.01)
+        self.assertEqual(jobs[0].progress, (1024, 4096))
+        self.assertTrue(jobs[0].status.endswith(" s, 1 KiB of 4 KiB"),
+                        jobs[0].status)
+        self.assertEqual(jobs[1].status, 'queued')
+        self.release.set()
+        self.assertEqual(scheduler.wait(jobs), ["a", "b"])
+        self.assertIsNone(jobs[1].progress)
@@ -16,14 +16,18 @@
 
 """Unit test cases for VMDK subclass of DiskRepresentation."""
 
+import io
 import logging
 import os
+import tarfile
 
 from distutils.version import StrictVersion
 import mock
 
 from COT.tests import COTTestCase
-from COT.disks import VMDK, DiskRepresentation
+from COT.disks import VMDK, RAW, DiskRepresentation
+from COT.disks.scheduler import ConversionScheduler
+from COT.disks.vmdk import StreamOptimizedReader, StreamOptimizedWriter
 from COT.helpers import helpers, HelperError
 
 logger = logging.getLogger(__name__)
@@ -49,6 +53,31 @@ class TestVMDK(COTTestCase):
         self.assertEqual(vmdk2.capacity, "1073741824")
         self.assertEqual(vmdk2.predicted_drive_type, 'harddisk')
 
+    def test_header_parsing(self):
+        """Capacity and subformat are read from the header, not qemu-img."""
+        descriptor = os.path.join(self.temp_dir, "flat.vmdk")
+        with open(descriptor, 'w') as fileobj:
+            fileobj.write('# Disk DescriptorFile\n'
+                          'version=1\n'
+                          'createType="monolithicFlat"\n'
+                          '\n'
+                          '# Extent description\n'
+                          'RW 2048 FLAT "flat-flat.vmdk" 0\n'
+                          'RW 1024 FLAT "flat-2-flat.vmdk" 0\n')
+        with mock.patch.object(helpers['qemu-img'], 'call') as mock_call:
+            self.assertEqual(100, VMDK.file_is_this_type(self.blank_vmdk))
+            self.assertEqual(100, VMDK.file_is_this_type(descriptor))
+            self.assertEqual(0, VMDK.file_is_this_type(self.input_iso))
+
+            vmdk1 = VMDK(self.blank_vmdk)
+            self.assertEqual(vmdk1.disk_subformat, "streamOptimized")
+            self.assertEqual(vmdk1.capacity, "536870912")
+
+            vmdk2 = VMDK(descriptor)
+            self.assertEqual(vmdk2.disk_subformat, "monolithicFlat")
+            self.assertEqual(vmdk2.capacity, str(3072 * 512))
+            mock_call.assert_not_called()
+
     def test_create_default(self):
         """Default creation logic."""
         disk_path = os.path.join(self.temp_dir, "foo.vmdk")
@@ -93,6 +122,27 @@ class TestVMDK(COTTestCase):
                           disk_subformat="monolithicSparse",
                           files=[self.input_iso])
 
+    def test_stream_optimized_writer_scheduled(self):
+        """A scheduled writer uses its threads and reports its progress."""
+        # Just over one grain table's worth of grains
+        capacity = (StreamOptimizedWriter.GTES_PER_GT + 1) * 65536
+
+        def convert():
+            """Write a VMDK, returning the number of workers used."""
+            writer = StreamOptimizedWriter(io.BytesIO(), capacity)
+            writer.write(io.BytesIO(b"hello world"))
+            return writer.workers
+
+        scheduler = ConversionScheduler(max_jobs=2)
+        job = scheduler.submit("data.vmdk", convert, threads=3,
+                               memory=StreamOptimizedWriter.memory_needed(3))
+        self.assertEqual(scheduler.wait([job]), [3])
+        self.assertEqual(job.progress, (capacity, capacity))
+        # Memory needed grows with the number of compression threads
+        self.assertEqual(StreamOptimizedWriter.memory_needed(3) -
+                         StreamOptimizedWriter.memory_needed(1),
+                         2 * (65536 + StreamOptimizedWriter.ZLIB_MEMORY))
+
 
 class TestVMDKConversion(COTTestCase):
     """Test cases for VMDK.from_other_image method."""
@@ -139,7 +189,7 @@ class TestVMDKConversion(COTTestCase):
         """Test disk conversion flows with old qemu-img version.
 
         This version doesn't support streamOptimized output at all,
-        so we'll use vmdktool instead.
+        so we convert to RAW if needed, then write the VMDK natively.
         """
         for disk_format in ["raw", "qcow2", "vmdk"]:
             self.other_format_to_vmdk_test(disk_format)
@@ -152,16 +202,15 @@ class TestVMDKConversion(COTTestCase):
             else:
                 mock_qemu_call.assert_not_called()
 
-            mock_vmdktool_call.assert_called_once()
+            mock_vmdktool_call.assert_not_called()
 
             mock_qemu_call.reset_mock()
-            mock_vmdktool_call.reset_mock()
 
     @mock.patch('COT.helpers.qemu_img.QEMUImg.version',
                 new_callable=mock.PropertyMock,
                 return_value=StrictVersion("1.2.0"))
     def test_disk_conversion_old_qemu_error(self, *_):
-        """Error recovery/cleanup during multi-step conversion with vmdktool.
+        """Error recovery/cleanup during multi-step conversion.
 
         https://github.com/glennmatthews/cot/issues/67
         """
@@ -173,9 +222,9 @@ class TestVMDKConversion(COTTestCase):
                               self.input_disks['qcow2'], self.temp_dir)
 
         # Error in conversion from raw to vmdk
-        with mock.patch('COT.helpers.vmdktool.VMDKTool.call',
-                        side_effect=HelperError):
-            self.assertRaises(HelperError,
+        with mock.patch('COT.disks.vmdk.StreamOptimizedWriter.write',
+                        side_effect=IOError):
+            self.assertRaises(IOError,
                               VMDK.from_other_image,
                               self.input_disks['qcow2'], self.temp_dir)
 
@@ -183,6 +232,10 @@ class TestVMDKConversion(COTTestCase):
         temp_image = os.path.join(self.temp_dir, 'foo.img')
         self.assertFalse(os.path.exists(temp_image),
                          "Temporary image {0} not deleted".format(temp_image))
+        # ...or a partially written VMDK
+        output = os.path.join(self.temp_dir, 'foo.vmdk')
+        self.assertFalse(os.path.exists(output),
+                         "Partial image {0} not deleted".format(output))
 
     @mock.patch('COT.helpers.qemu_img.QEMUImg.version',
                 new_callable=mock.PropertyMock,
@@ -197,26 +250,9 @@ class TestVMDKConversion(COTTestCase):
 
         This version produces streamOptimized VMDKs but they're version 1
         rather than version 3, which makes ESXi unhappy. Therefore,
-        we still prefer vmdktool, but fall back to qemu-img with a warning
-        if vmdktool is not available.
+        we only use it to convert to RAW, and write the VMDK natively,
+        with or without vmdktool available.
         """
-        # First, with vmdktool, same as test_disk_conversion_old_qemu
-        for disk_format in ["raw", "qcow2", "vmdk"]:
-            self.other_format_to_vmdk_test(disk_format)
-
-            if disk_format != "raw":
-                # use qemu-img to convert to raw
-                mock_qemu_call.assert_called_once_with(
-                    ['convert', '-O', 'raw',
-                     self.input_disks[disk_format].path, mock.ANY])
-            else:
-                mock_qemu_call.assert_not_called()
-            mock_vmdktool_call.assert_called_once()
-
-            mock_qemu_call.reset_mock()
-            mock_vmdktool_call.reset_mock()
-
-        # Now, disable vmdktool
         with mock.patch("COT.helpers.vmdktool.VMDKTool.installed",
                         new_callable=mock.PropertyMock, return_value=False),\
             mock.patch("COT.helpers.vmdktool.VMDKTool.installable",
@@ -224,14 +260,15 @@ class TestVMDKConversion(COTTestCase):
             for disk_format in ["raw", "qcow2", "vmdk"]:
                 self.other_format_to_vmdk_test(disk_format)
 
-                # Since we lack vmdktool, and we have a technically
-                # new enough version of qemu-img, we call it, under protest.
-                mock_qemu_call.assert_called_once()
-                self.assertLogged(**QEMU_VERSION_WARNING)
+                if disk_format != "raw":
+                    mock_qemu_call.assert_called_once_with(
+                        ['convert', '-O', 'raw',
+                         self.input_disks[disk_format].path, mock.ANY])
+                else:
+                    mock_qemu_call.assert_not_called()
                 mock_vmdktool_call.assert_not_called()
 
                 mock_qemu_call.reset_mock()
-                mock_vmdktool_call.reset_mock()
 
     @mock.patch('COT.helpers.qemu_img.QEMUImg.version',
                 new_callable=mock.PropertyMock,
@@ -244,17 +281,90 @@ class TestVMDKConversion(COTTestCase):
                                       mock_vmdktool_call, mock_qemu_call, _):
         """Test disk conversion flows with newer qemu-img version.
 
-        This version produces version 3 streamOptimized VMDKs,
-        so we don't need to use vmdktool.
+        This version produces version 3 streamOptimized VMDKs directly,
+        so we don't need an intermediate RAW image. RAW images are still
+        written natively.
         """
         for disk_format in ["raw", "qcow2", "vmdk"]:
             self.other_format_to_vmdk_test(disk_format)
 
-            mock_qemu_call.assert_called_once()
+            if disk_format != "raw":
+                mock_qemu_call.assert_called_once_with(
+                    ['convert', '-O', 'vmdk',
+                     '-o', 'subformat=streamOptimized',
+                     self.input_disks[disk_format].path, mock.ANY])
+            else:
+                mock_qemu_call.assert_not_called()
             mock_vmdktool_call.assert_not_called()
 
             mock_qemu_call.reset_mock()
 
+    def test_stream_optimized_writer(self):
+        """Natively written VMDKs are sparse, compressed, version 3."""
+        raw_path = os.path.join(self.temp_dir, "data.img")
+        with open(raw_path, 'wb') as fileobj:
+            fileobj.write(b"\0" * 65536 * 600)
+            fileobj.write(b"COT!" * 1000)
+        capacity = os.path.getsize(raw_path)
+        with mock.patch.object(helpers['qemu-img'], 'call') as mock_call:
+            vmdk = VMDK.from_other_image(RAW(raw_path), self.temp_dir)
+            mock_call.assert_not_called()
+        self.assertEqual(vmdk.disk_subformat, "streamOptimized")
+        self.assertEqual(vmdk.capacity, str(capacity + 96))
+        # One compressed grain, plus metadata, is much smaller than input
+        self.assertLess(os.path.getsize(vmdk.path), 100000)
+
+        with open(vmdk.path, 'rb') as fileobj:
+            header = VMDK.FULL_SPARSE_HEADER.unpack(fileobj.read(512))
+            self.assertEqual(header[1], StreamOptimizedWriter.VERSION)
+            self.assertEqual(header[9], StreamOptimizedWriter.GD_AT_END)
+            fileobj.seek(-1024, os.SEEK_END)
+            footer = VMDK.FULL_SPARSE_HEADER.unpack(fileobj.read(512))
+            self.assertEqual(footer[:9], header[:9])
+            self.assertNotEqual(footer[9], StreamOptimizedWriter.GD_AT_END)
+            # Stream ends with an end-of-stream marker
+            self.assertEqual(fileobj.read(), b"\0" * 512)
+
+        if helpers['qemu-img'].version >= StrictVersion("2.0.0"):
+            # Make sure an independent implementation agrees
+            helpers['qemu-img'].call(['compare', '-f', 'raw', '-F', 'vmdk',
+                                      raw_path, vmdk.path])
+
+    def test_stream_optimized_reader(self):
+        """Read a streamOptimized VMDK in place, even from within a TAR."""
+        raw_path = os.path.join(self.temp_dir, "data.img")
+        with open(raw_path, 'wb') as fileobj:
+            fileobj.write(b"\0" * 70000)
+            fileobj.write(b"hello world")
+        vmdk = VMDK.from_other_image(RAW(raw_path), self.temp_dir)
+        tar_path = os.path.join(self.temp_dir, "data.ova")
+        with tarfile.open(tar_path, 'w') as tarf:
+            tarf.add(vmdk.path, "data.vmdk")
+
+        with tarfile.open(tar_path, 'r') as tarf:
+            reader = StreamOptimizedReader(tarf.extractfile("data.vmdk"),
+                                           workers=2)
+            self.assertEqual(reader.capacity, int(vmdk.capacity))
+            reader.seek(69996)
+            self.assertEqual(reader.read(20), b"\0\0\0\0hello world\0\0\0\0\0")
+            self.assertEqual(reader.tell(), 70016)
+            self.assertEqual(reader.seek(-1, os.SEEK_END),
+                             reader.capacity - 1)
+            self.assertEqual(reader.read(), b"\0")
+            self.assertEqual(reader.read(), b"")
+            self.assertEqual([offset for (offset, _) in
+                              reader.allocated_grains()], [65536])
+
+        # Existing VMware-created image with no allocated grains
+        with open(self.blank_vmdk, 'rb') as fileobj:
+            reader = StreamOptimizedReader(fileobj)
+            self.assertEqual(reader.capacity, 536870912)
+            self.assertEqual(list(reader.allocated_grains()), [])
+            self.assertEqual(reader.read(10), b"\0" * 10)
+
+        with open(self.input_iso, 'rb') as fileobj:
+            self.assertRaises(ValueError, StreamOptimizedReader, fileobj)
+
     def test_disk_conversion_unsupported_subformat(self):
         """qemu-img will fail if subformat is invalid."""
         self.assertRaises(HelperError,
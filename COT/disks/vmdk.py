@@ -10,16 +10,38 @@
 # of COT, including this file, may be copied, modified, propagated, or
 # distributed except according to the terms contained in the LICENSE.txt file.
 
-"""Handling of VMDK files."""
+"""Handling of VMDK files.
 
+**Classes**
+
+.. autosummary::
+  :nosignatures:
+
+  VMDK
+  DeferredVMDK
+  StreamOptimizedReader
+  StreamOptimizedWriter
+"""
+
+import io
 import logging
 import os
+import random
 import re
+import shutil
+import struct
+import tempfile
+import zlib
+
+from multiprocessing.pool import ThreadPool
 
 from distutils.version import StrictVersion
 
+from COT import __version__
+from COT.disks.cache import conversion_cache
 from COT.disks.disk import DiskRepresentation
-from COT.helpers import helpers, helper_select
+from COT.disks.scheduler import conversion_threads, report_progress
+from COT.helpers import helpers, HelperError
 
 logger = logging.getLogger(__name__)
 
@@ -29,9 +51,107 @@ class VMDK(DiskRepresentation):
 
     disk_format = "vmdk"
 
+    SPARSE_MAGIC = b"KDMV"
+    """Magic number at the start of a hosted sparse extent."""
+
+    SPARSE_HEADER = struct.Struct("<4sIIQQQQ")
+    """Leading fields of a hosted sparse extent header.
+
+    These are magicNumber, version, flags, capacity, grainSize,
+    descriptorOffset, and descriptorSize; sizes and offsets are in sectors.
+    """
+
+    DESCRIPTOR_MAGIC = b"# Disk DescriptorFile"
+    """First line of a VMDK descriptor."""
+
+    MAX_DESCRIPTOR_SIZE = 65536
+    """Largest standalone descriptor file we are willing to read."""
+
+    SECTOR_SIZE = 512
+
+    FULL_SPARSE_HEADER = struct.Struct("<4sIIQQQQIQQQB4sH433x")
+    """Complete sector-sized hosted sparse extent header.
+
+    Extends :attr:`SPARSE_HEADER` with numGTEsPerGT, rgdOffset, gdOffset,
+    overHead, uncleanShutdown, the four newline detection characters,
+    and compressAlgorithm.
+    """
+
+    @classmethod
+    def read_header(cls, path_or_obj):
+        """Parse the header of a sparse extent or a standalone descriptor.
+
+        For the parameters, see :meth:`DiskRepresentation.read_header`.
+        """
+        with cls._opened(path_or_obj) as fileobj:
+            fileobj.seek(0)
+            header = fileobj.read(cls.SPARSE_HEADER.size)
+            if header.startswith(cls.SPARSE_MAGIC):
+                (_, _, _, capacity, _, desc_offset,
+                 desc_size) = cls.SPARSE_HEADER.unpack(header)
+                descriptor = b""
+                if desc_offset and desc_size:
+                    fileobj.seek(desc_offset * cls.SECTOR_SIZE)
+                    descriptor = fileobj.read(desc_size * cls.SECTOR_SIZE)
+                (create_type, _) = cls._parse_descriptor(descriptor)
+                return (create_type, capacity * cls.SECTOR_SIZE)
+            if header.startswith(cls.DESCRIPTOR_MAGIC[:len(header)]):
+                fileobj.seek(0)
+                descriptor = fileobj.read(cls.MAX_DESCRIPTOR_SIZE)
+                if not descriptor.startswith(cls.DESCRIPTOR_MAGIC):
+                    return None
+                (create_type, sectors) = cls._parse_descriptor(descriptor)
+                return (create_type,
+                        sectors * cls.SECTOR_SIZE if sectors else None)
+        return None
+
+    @staticmethod
+    def _parse_descriptor(descriptor):
+        """Get the createType and total extent size from a VMDK descriptor.
+
+        Args:
+          descriptor (bytes): Descriptor text, possibly NUL-padded.
+
+        Returns:
+          tuple: ``(create_type, sectors)``, where ``create_type`` may be
+          ``None`` if not found and ``sectors`` is the sum of the sizes of
+          all listed extents.
+        """
+        text = descriptor.decode('ascii', 'ignore')
+        match = re.search('createType="(.*)"', text)
+        create_type = match.group(1) if match else None
+        sectors = 0
+        for extent in re.finditer(r"^(?:RW|RDONLY|NOACCESS)\s+(\d+)\s",
+                                  text, re.MULTILINE):
+            sectors += int(extent.group(1))
+        return (create_type, sectors)
+
+    @classmethod
+    def file_is_this_type(cls, path):
+        """Check whether the given file is a VMDK, by its header if possible.
+
+        Hosted sparse extents and descriptor files are recognized directly;
+        only other variants (such as ESX ``COWD`` sparse files) require
+        ``qemu-img``.
+
+        For the parameters, see :meth:`DiskRepresentation.file_is_this_type`.
+        """
+        if not os.path.exists(path):
+            raise HelperError(2, "No such file or directory: '{0}'"
+                              .format(path))
+        if cls.read_header(path) is not None:
+            return 100
+        with open(path, 'rb') as fileobj:
+            magic = fileobj.read(4)
+        if magic == b"COWD":
+            return super(VMDK, cls).file_is_this_type(path)
+        return 0
+
     @property
     def disk_subformat(self):
         """Disk subformat, such as 'streamOptimized'."""
+        if self._disk_subformat is None:
+            self._read_header_info()
         if self._disk_subformat is None:
             # Look at the VMDK file header to determine the sub-format
             with open(self.path, 'rb') as fileobj:
@@ -48,6 +168,7 @@ class VMDK(DiskRepresentation):
             logger.debug("VMDK sub-format for %s is '%s'",
                          self.path, vmdk_format)
             self._disk_subformat = vmdk_format
+            self._save_metadata()
         return self._disk_subformat
 
     @classmethod
@@ -79,57 +200,37 @@ class VMDK(DiskRepresentation):
             ``"Not a supported disk format (sparse VMDK version too old)"``.
           - In QEMU 2.5.1 and later, ``qemu-img`` produces "version 3" VMDK
             images, which suffices to make ESXi happy.
-          - ``vmdktool`` (any released version) also makes "version 3" VMDKs,
-            but is less likely to be available on most user systems, and it
-            can only convert from RAW format images to streamOptimized VMDK.
 
-          So, when creating streamOptimized VMDKs, if we have QEMU 2.5.1+,
-          we're golden. Else, if we have ``vmdktool``, use it, after
-          converting the :attr:`input_image` to RAW format first if necessary.
-          Else, fail back to QEMU 2.1.0+ but warn the user that the resulting
-          image may not be usable with ESXi.
+          COT therefore writes streamOptimized VMDKs itself, using
+          :class:`StreamOptimizedWriter`, which produces "version 3" images
+          and compresses grains on all available CPUs. This requires a RAW
+          input image, so other input formats are converted directly by
+          QEMU 2.5.1+ if available, else converted to a temporary RAW image
+          first.
         """
         file_name = os.path.basename(input_image.path)
         (file_prefix, _) = os.path.splitext(file_name)
         output_path = os.path.join(output_dir, file_prefix + ".vmdk")
         if output_subformat == "streamOptimized":
-            helper = helper_select([
-                ('qemu-img', '2.5.1'),  # best option, all needed functionality
-                'vmdktool',  # supports VMDK v.3, but only converts from RAW
-                ('qemu-img', '2.1.0'),  # fallback - produces VMDK v.1
-            ])
-            if helper.name == 'vmdktool':
-                if input_image.disk_format != 'raw':
-                    # vmdktool needs a raw image as input
-                    from COT.disks import RAW
-                    temp_image = None
-                    try:
-                        temp_image = RAW.from_other_image(input_image,
-                                                          output_dir)
-                        return cls.from_other_image(temp_image,
-                                                    output_dir,
-                                                    output_subformat)
-                    finally:
-                        if temp_image is not None:
-                            os.remove(temp_image.path)
-                            temp_image = None
-
-                # Note that vmdktool takes its arguments in unusual order -
-                # output file comes before input file
-                helper.call(['-z9', '-v', output_path, input_image.path])
+            if input_image.disk_format == 'raw':
+                logger.verbose("Writing %s as a streamOptimized VMDK",
+                               input_image.path)
+                StreamOptimizedWriter.convert(input_image.path, output_path)
                 return cls(output_path)
 
-            # else, fall through to default (qemu-img), with one extra:
             if helpers['qemu-img'].version < StrictVersion("2.5.1"):
-                logger.warning(
-                    "QEMU version %s produces 'version 1' VMDK images, which"
-                    " newer versions of VMware ESXi will reject with the"
-                    " message '%s'.\nIn order to generate the preferred"
-                    " 'version 3' images, please upgrade to QEMU 2.5.1 or"
-                    " later, or install vmdktool.",
-                    str(helpers['qemu-img'].version),
-                    "Not a supported disk format"
-                    " (sparse VMDK version too old)")
+                from COT.disks import RAW
+                temp_image = None
+                try:
+                    temp_image = RAW.from_other_image(input_image,
+                                                      output_dir)
+                    return cls.from_other_image(temp_image,
+                                                output_dir,
+                                                output_subformat)
+                finally:
+                    if temp_image is not None:
+                        os.remove(temp_image.path)
+                        temp_image = None
 
         helpers['qemu-img'].call([
             'convert',
@@ -139,6 +240,17 @@ class VMDK(DiskRepresentation):
             output_path])
         return cls(output_path)
 
+    @classmethod
+    def converter(cls, input_image, output_subformat="streamOptimized"):
+        """Identify the programs :meth:`from_other_image` would use.
+
+        For the parameters, see :meth:`DiskRepresentation.converter`.
+        """
+        if (output_subformat == "streamOptimized" and
+                input_image.disk_format == 'raw'):
+            return "COT {0}".format(__version__)
+        return super(VMDK, cls).converter(input_image, output_subformat)
+
     @classmethod
     def _create_file(cls, path, disk_subformat="streamOptimized", **kwargs):
         """Worker function for create_file().
@@ -162,3 +274,776 @@ class VMDK(DiskRepresentation):
 
         super(VMDK, cls)._create_file(path, disk_subformat=disk_subformat,
                                       **kwargs)
+
+
+class StreamOptimizedWriter(object):
+    """Writer of streamOptimized (version 3) VMDK images from raw data.
+
+    Grains are deflated in parallel by a pool of worker threads (``zlib``
+    releases the interpreter lock while compressing), all-zero grains are
+    omitted entirely, and each grain table is written immediately after
+    the grains it describes, so the output is produced strictly in order
+    and may be written to a non-seekable stream.
+
+    Examples:
+      ::
+
+        >>> import io
+        >>> output = io.BytesIO()
+        >>> writer = StreamOptimizedWriter(output, 1048576)
+        >>> writer.write(io.BytesIO(b"hello world"))
+        71168
+        >>> output.getvalue()[:4] == b"KDMV"
+        True
+    """
+
+    VERSION = 3
+    """Sparse extent version written; ESXi rejects older versions."""
+
+    FLAGS = 0x1 | 0x10000 | 0x20000
+    """Valid newline test, compressed grains, and markers present."""
+
+    GRAIN_SECTORS = 128
+    """Size of each grain, in sectors (64 KiB)."""
+
+    GTES_PER_GT = 512
+    """Number of grain table entries in each grain table."""
+
+    GD_AT_END = 0xffffffffffffffff
+    """gdOffset value indicating that the grain directory is in the footer."""
+
+    GRAIN_MARKER = struct.Struct("<QI")
+    """Grain marker: virtual sector number and compressed data size."""
+
+    METADATA_MARKER = struct.Struct("<QII496x")
+    """Metadata marker: size in sectors, zero, and marker type."""
+
+    MARKER_EOS = 0
+    MARKER_GT = 1
+    MARKER_GD = 2
+    MARKER_FOOTER = 3
+
+    ZLIB_MEMORY = 384 << 10
+    """Memory used by each ``zlib`` compressor at the default settings."""
+
+    def __init__(self, fileobj, capacity, workers=None, compress_level=6,
+                 adapter_type="ide"):
+        """Prepare to write a streamOptimized VMDK to the given file.
+
+        Args:
+          fileobj (file): Writable binary file or stream.
+          capacity (int): Disk capacity in bytes; rounded up to a whole
+              number of sectors.
+          workers (int): Number of compression threads; defaults to
+              :func:`~COT.disks.scheduler.conversion_threads`.
+          compress_level (int): ``zlib`` compression level, 1 to 9.
+          adapter_type (str): Disk adapter type to declare.
+        """
+        self.fileobj = fileobj
+        sector_size = VMDK.SECTOR_SIZE
+        self.capacity = (capacity + sector_size - 1) // sector_size
+        self.workers = workers or conversion_threads()
+        self.compress_level = compress_level
+        self.adapter_type = adapter_type
+        self.bytes_written = 0
+        self._zero_grain = bytes(bytearray(self.grain_bytes))
+
+    @property
+    def grain_bytes(self):
+        """Size of each grain, in bytes."""
+        return self.GRAIN_SECTORS * VMDK.SECTOR_SIZE
+
+    @property
+    def grain_count(self):
+        """Total number of grains needed to cover the disk capacity."""
+        return ((self.capacity + self.GRAIN_SECTORS - 1) //
+                self.GRAIN_SECTORS)
+
+    @property
+    def grain_table_count(self):
+        """Total number of grain tables needed to cover the disk capacity."""
+        return ((self.grain_count + self.GTES_PER_GT - 1) //
+                self.GTES_PER_GT)
+
+    @classmethod
+    def max_size(cls, capacity):
+        """Get the largest possible size of a VMDK of the given capacity.
+
+        This is the size if no grain is all zeros and no grain compresses
+        at all; actual images are almost always much smaller.
+
+        Args:
+          capacity (int): Disk capacity in bytes.
+
+        Returns:
+          int: Upper bound on the output of :meth:`write`, in bytes.
+        """
+        sector = VMDK.SECTOR_SIZE
+        grain_bytes = cls.GRAIN_SECTORS * sector
+        grains = -(-capacity // grain_bytes)
+        tables = -(-grains // cls.GTES_PER_GT)
+        # Worst-case zlib output size, plus the grain marker
+        grain = grain_bytes + (grain_bytes >> 12) + (grain_bytes >> 14) + 31
+        grain = -(-grain // sector) * sector
+        # Overhead for a descriptor of any reasonable size
+        overhead = cls.GRAIN_SECTORS * sector
+        # Each grain table, the grain directory, footer, end-of-stream
+        metadata = tables * (sector + 4 * cls.GTES_PER_GT)
+        metadata += sector + -(-4 * tables // sector) * sector
+        metadata += 3 * sector
+        return overhead + grains * grain + metadata
+
+    @classmethod
+    def memory_needed(cls, workers):
+        """Estimate the memory used by :meth:`write` with this many workers.
+
+        Each grain table's worth of grains is held in memory both before
+        and after compression, while each worker needs its own compressor
+        and output buffer.
+
+        Args:
+          workers (int): Number of compression threads.
+
+        Returns:
+          int: Estimated memory needed, in bytes.
+        """
+        grain_bytes = cls.GRAIN_SECTORS * VMDK.SECTOR_SIZE
+        return (2 * cls.GTES_PER_GT * grain_bytes +
+                workers * (grain_bytes + cls.ZLIB_MEMORY))
+
+    @classmethod
+    def convert(cls, input_path, output_path, **kwargs):
+        """Convert the given RAW image file to a streamOptimized VMDK file.
+
+        Args:
+          input_path (str): Path to an existing RAW image.
+          output_path (str): Path of the VMDK file to create.
+          **kwargs: Passed through to the class constructor.
+
+        Returns:
+          int: Size of the created VMDK file, in bytes.
+        """
+        try:
+            with open(input_path, 'rb') as input_file:
+                with open(output_path, 'wb') as output_file:
+                    writer = cls(output_file,
+                                 os.path.getsize(input_path),
+                                 **kwargs)
+                    return writer.write(input_file,
+                                        os.path.basename(output_path))
+        except Exception:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+
+    def descriptor(self, filename):
+        """Construct the embedded descriptor text for this disk.
+
+        Args:
+          filename (str): Name of the VMDK file being written.
+
+        Returns:
+          bytes: ASCII descriptor text.
+        """
+        cylinders = min(self.capacity // (16 * 63), 16383)
+        text = "\n".join([
+            "# Disk DescriptorFile",
+            "version=1",
+            "CID={0:08x}".format(random.randint(0, 0xfffffffe)),
+            "parentCID=ffffffff",
+            'createType="streamOptimized"',
+            "",
+            "# Extent description",
+            'RW {0} SPARSE "{1}"'.format(self.capacity, filename),
+            "",
+            "# The Disk Data Base",
+            "#DDB",
+            "",
+            'ddb.virtualHWVersion = "4"',
+            'ddb.geometry.cylinders = "{0}"'.format(cylinders),
+            'ddb.geometry.heads = "16"',
+            'ddb.geometry.sectors = "63"',
+            'ddb.adapterType = "{0}"'.format(self.adapter_type),
+            "",
+        ])
+        return text.encode('ascii')
+
+    def _header(self, descriptor_sectors, overhead, gd_offset):
+        """Pack a sparse extent header or footer.
+
+        Args:
+          descriptor_sectors (int): Size of the embedded descriptor.
+          overhead (int): Sectors preceding the first grain.
+          gd_offset (int): Sector offset of the grain directory.
+
+        Returns:
+          bytes: Sector-sized header.
+        """
+        return VMDK.FULL_SPARSE_HEADER.pack(
+            VMDK.SPARSE_MAGIC, self.VERSION, self.FLAGS, self.capacity,
+            self.GRAIN_SECTORS, 1, descriptor_sectors, self.GTES_PER_GT,
+            0, gd_offset, overhead, 0, b"\n \r\n", 1)
+
+    def _emit(self, data):
+        """Write the given data, padded to a whole number of sectors.
+
+        Args:
+          data (bytes): Data to write.
+
+        Returns:
+          int: Sector offset at which the data was written.
+        """
+        sector = self.bytes_written // VMDK.SECTOR_SIZE
+        padding = -len(data) % VMDK.SECTOR_SIZE
+        self.fileobj.write(data)
+        if padding:
+            self.fileobj.write(b"\0" * padding)
+        self.bytes_written += len(data) + padding
+        return sector
+
+    def _emit_metadata(self, marker_type, data=b""):
+        """Write a metadata marker, followed by the data it describes.
+
+        Args:
+          marker_type (int): One of the ``MARKER_*`` constants.
+          data (bytes): Grain table, grain directory, or footer data.
+
+        Returns:
+          int: Sector offset at which the data was written.
+        """
+        sectors = (len(data) + VMDK.SECTOR_SIZE - 1) // VMDK.SECTOR_SIZE
+        self._emit(self.METADATA_MARKER.pack(sectors, 0, marker_type))
+        return self._emit(data)
+
+    def _compress(self, grain):
+        """Deflate a single grain, unless it is entirely zero.
+
+        Args:
+          grain (bytes): Full grain of raw data.
+
+        Returns:
+          bytes: Compressed grain, or ``None`` if it is all zeros.
+        """
+        if grain == self._zero_grain:
+            return None
+        return zlib.compress(grain, self.compress_level)
+
+    def _read_grains(self, input_file, count):
+        """Read up to ``count`` grains of raw data, zero-padding the last.
+
+        Args:
+          input_file (file): Binary file positioned at a grain boundary.
+          count (int): Maximum number of grains to read.
+
+        Returns:
+          list: Grains read, each exactly :attr:`grain_bytes` long.
+        """
+        grains = []
+        for _ in range(count):
+            grain = input_file.read(self.grain_bytes)
+            if not grain:
+                break
+            if len(grain) < self.grain_bytes:
+                grain += self._zero_grain[len(grain):]
+            grains.append(grain)
+        return grains
+
+    def write(self, input_file, filename="disk.vmdk"):
+        """Write the complete VMDK, reading raw disk data from input_file.
+
+        Args:
+          input_file (file): Binary file or stream of raw disk contents.
+              Any data beyond the disk capacity is ignored; if the input
+              is shorter than the capacity the remainder reads as zeros.
+          filename (str): File name to record in the descriptor.
+
+        Returns:
+          int: Total number of bytes written.
+        """
+        descriptor = self.descriptor(filename)
+        descriptor_sectors = -(-len(descriptor) // VMDK.SECTOR_SIZE)
+        overhead = -(-(1 + descriptor_sectors) // self.GRAIN_SECTORS)
+        overhead *= self.GRAIN_SECTORS
+        header = self._header(descriptor_sectors, overhead, self.GD_AT_END)
+        self._emit(header)
+        self._emit(descriptor)
+        self._emit(b"\0" * ((overhead - 1 - descriptor_sectors) *
+                            VMDK.SECTOR_SIZE))
+
+        pool = ThreadPool(self.workers) if self.workers > 1 else None
+        try:
+            directory = []
+            remaining = self.grain_count
+            for table_index in range(self.grain_table_count):
+                count = min(self.GTES_PER_GT, remaining)
+                remaining -= count
+                grains = self._read_grains(input_file, count)
+                if pool is not None:
+                    compressed = pool.map(self._compress, grains)
+                else:
+                    compressed = [self._compress(g) for g in grains]
+                table = [0] * self.GTES_PER_GT
+                first_grain = table_index * self.GTES_PER_GT
+                for (index, data) in enumerate(compressed):
+                    if data is None:
+                        continue
+                    lba = (first_grain + index) * self.GRAIN_SECTORS
+                    table[index] = self._emit(
+                        self.GRAIN_MARKER.pack(lba, len(data)) + data)
+                logger.spam("Wrote grain table %d of %d",
+                            table_index + 1, self.grain_table_count)
+                report_progress((self.grain_count - remaining) *
+                                self.grain_bytes,
+                                self.grain_count * self.grain_bytes)
+                directory.append(self._emit_metadata(
+                    self.MARKER_GT,
+                    struct.pack("<{0}I".format(self.GTES_PER_GT), *table)))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        gd_offset = self._emit_metadata(
+            self.MARKER_GD,
+            struct.pack("<{0}I".format(len(directory)), *directory))
+        self._emit_metadata(self.MARKER_FOOTER,
+                            self._header(descriptor_sectors, overhead,
+                                         gd_offset))
+        self._emit_metadata(self.MARKER_EOS)
+        return self.bytes_written
+
+
+class StreamOptimizedReader(io.RawIOBase):
+    r"""Read-only, seekable view of the raw contents of a sparse VMDK.
+
+    Understands hosted sparse extents (``KDMV``), whether compressed
+    (streamOptimized) or not (monolithicSparse). Unallocated grains read
+    as zeros. The underlying file object only needs to be seekable, so a
+    VMDK inside an OVA may be read in place via :meth:`tarfile.extractfile`.
+
+    Examples:
+      ::
+
+        >>> import io
+        >>> data = io.BytesIO()
+        >>> _ = StreamOptimizedWriter(data, 1048576).write(
+        ...     io.BytesIO(b"\0" * 70000 + b"hello world"))
+        >>> reader = StreamOptimizedReader(data)
+        >>> reader.capacity
+        1048576
+        >>> _ = reader.seek(70000)
+        >>> reader.read(11) == b"hello world"
+        True
+        >>> reader.read(5) == b"\0" * 5
+        True
+    """
+
+    def __init__(self, fileobj, workers=None):
+        """Parse the grain directory of the given sparse VMDK.
+
+        Args:
+          fileobj (file): Seekable binary file object positioned anywhere.
+          workers (int): Number of decompression threads used by
+              :meth:`allocated_grains`; defaults to
+              :func:`~COT.disks.scheduler.conversion_threads`.
+
+        Raises:
+          ValueError: if the file is not a hosted sparse VMDK extent.
+        """
+        super(StreamOptimizedReader, self).__init__()
+        self.fileobj = fileobj
+        self.workers = workers or conversion_threads()
+        header = self._header_at(0)
+        if header is None:
+            raise ValueError("Not a hosted sparse VMDK extent")
+        gd_offset = header[9]
+        if gd_offset == StreamOptimizedWriter.GD_AT_END:
+            footer = self._footer()
+            gd_offset = footer[9] if footer is not None else None
+        (_, _, flags, capacity, grain_sectors, _, _,
+         self.gtes_per_gt) = header[:8]
+        self.capacity = capacity * VMDK.SECTOR_SIZE
+        self.grain_bytes = grain_sectors * VMDK.SECTOR_SIZE
+        self.compressed = bool(flags & 0x10000)
+        if gd_offset:
+            self._grains = self._read_grain_directory(gd_offset)
+        else:
+            # No usable grain directory - walk the stream markers instead
+            self._grains = self._scan_markers(header[10])
+        self._position = 0
+        self._cached_grain = (None, None)
+
+    def _read_at(self, offset, size):
+        """Read data from the underlying file at the given byte offset.
+
+        Args:
+          offset (int): Byte offset into the underlying file.
+          size (int): Number of bytes to read.
+
+        Returns:
+          bytes: Data read, possibly shorter than ``size`` at end of file.
+        """
+        self.fileobj.seek(offset)
+        return self.fileobj.read(size)
+
+    def _header_at(self, offset):
+        """Unpack the sparse extent header at the given byte offset.
+
+        Args:
+          offset (int): Byte offset of the header or footer.
+
+        Returns:
+          tuple: Header fields, or ``None`` if no valid header is present.
+        """
+        data = self._read_at(offset, VMDK.FULL_SPARSE_HEADER.size)
+        if (len(data) < VMDK.FULL_SPARSE_HEADER.size or
+                not data.startswith(VMDK.SPARSE_MAGIC)):
+            return None
+        return VMDK.FULL_SPARSE_HEADER.unpack(data)
+
+    def _footer(self):
+        """Find the footer that streamOptimized images place at their end.
+
+        Returns:
+          tuple: Footer fields, or ``None`` if no footer was found.
+        """
+        sector = VMDK.SECTOR_SIZE
+        self.fileobj.seek(0, os.SEEK_END)
+        # footer marker, footer, end-of-stream marker
+        marker_offset = self.fileobj.tell() - 3 * sector
+        if marker_offset < 0:
+            return None
+        (_, _, marker_type) = StreamOptimizedWriter.METADATA_MARKER.unpack(
+            self._read_at(marker_offset, sector))
+        if marker_type != StreamOptimizedWriter.MARKER_FOOTER:
+            return None
+        return self._header_at(marker_offset + sector)
+
+    def _read_grain_directory(self, gd_offset):
+        """Read the grain directory and all grain tables.
+
+        Args:
+          gd_offset (int): Sector offset of the grain directory.
+
+        Returns:
+          dict: Grain index to sector offset of each allocated grain.
+        """
+        grain_count = -(-self.capacity // self.grain_bytes)
+        table_count = -(-grain_count // self.gtes_per_gt)
+        directory = struct.unpack(
+            "<{0}I".format(table_count),
+            self._read_at(gd_offset * VMDK.SECTOR_SIZE, 4 * table_count))
+        table_format = struct.Struct("<{0}I".format(self.gtes_per_gt))
+        grains = {}
+        for (table_index, table_offset) in enumerate(directory):
+            if not table_offset:
+                continue
+            table = table_format.unpack(self._read_at(
+                table_offset * VMDK.SECTOR_SIZE, table_format.size))
+            first_grain = table_index * self.gtes_per_gt
+            for (index, grain_offset) in enumerate(table):
+                # 0 is unallocated, 1 is an explicitly zeroed grain
+                if grain_offset > 1:
+                    grains[first_grain + index] = grain_offset
+        return grains
+
+    def _scan_markers(self, overhead):
+        """Locate grains by walking the markers of a streamOptimized image.
+
+        Args:
+          overhead (int): Sector offset of the first marker.
+
+        Returns:
+          dict: Grain index to sector offset of each allocated grain.
+        """
+        sector = VMDK.SECTOR_SIZE
+        grain_sectors = self.grain_bytes // sector
+        grains = {}
+        offset = overhead * sector
+        while True:
+            data = self._read_at(offset, 16)
+            if len(data) < 16:
+                break
+            (value, size) = StreamOptimizedWriter.GRAIN_MARKER.unpack(
+                data[:12])
+            if size:
+                grains[value // grain_sectors] = offset // sector
+                offset += -(-(12 + size) // sector) * sector
+                continue
+            (marker_type,) = struct.unpack("<I", data[12:])
+            if marker_type == StreamOptimizedWriter.MARKER_EOS:
+                break
+            offset += (1 + value) * sector
+        return grains
+
+    def _grain_data(self, grain_offset):
+        """Read and decompress (if needed) the grain at the given location.
+
+        Args:
+          grain_offset (int): Sector offset of the grain in the file.
+
+        Returns:
+          bytes: Uncompressed grain data.
+        """
+        return self._decompress(self._raw_grain(grain_offset))
+
+    def _raw_grain(self, grain_offset):
+        """Read the grain at the given location without decompressing it.
+
+        Args:
+          grain_offset (int): Sector offset of the grain in the file.
+
+        Returns:
+          bytes: Grain data as stored in the file.
+        """
+        offset = grain_offset * VMDK.SECTOR_SIZE
+        if not self.compressed:
+            return self._read_at(offset, self.grain_bytes)
+        (_, size) = StreamOptimizedWriter.GRAIN_MARKER.unpack(
+            self._read_at(offset, 12))
+        return self.fileobj.read(size)
+
+    def _decompress(self, data):
+        """Decompress a grain if this image uses compression.
+
+        Args:
+          data (bytes): Grain data as stored in the file.
+
+        Returns:
+          bytes: Grain data, padded to :attr:`grain_bytes` if short.
+        """
+        if self.compressed:
+            data = zlib.decompress(data)
+        if len(data) < self.grain_bytes:
+            data += b"\0" * (self.grain_bytes - len(data))
+        return data
+
+    def allocated_grains(self):
+        """Iterate over the allocated grains in order of virtual offset.
+
+        Grains are read sequentially but decompressed in parallel.
+
+        Yields:
+          tuple: ``(offset, data)``, the byte offset of the grain within
+          the virtual disk, and its uncompressed contents. The final grain
+          may extend past :attr:`capacity`.
+        """
+        indices = sorted(self._grains)
+        batch_size = self.workers * 16
+        pool = ThreadPool(self.workers) if self.workers > 1 else None
+        try:
+            for start in range(0, len(indices), batch_size):
+                batch = indices[start:start + batch_size]
+                data = [self._raw_grain(self._grains[index])
+                        for index in batch]
+                if pool is not None:
+                    data = pool.map(self._decompress, data)
+                else:
+                    data = [self._decompress(grain) for grain in data]
+                for (index, grain) in zip(batch, data):
+                    yield (index * self.grain_bytes, grain)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    @classmethod
+    def convert(cls, input_path, output_path, **kwargs):
+        """Convert the given sparse VMDK file to a sparse RAW image file.
+
+        Only allocated grains are written, leaving holes elsewhere, so no
+        more disk space is used than necessary on most filesystems.
+
+        Args:
+          input_path (str): Path to an existing sparse VMDK.
+          output_path (str): Path of the RAW file to create.
+          **kwargs: Passed through to the class constructor.
+
+        Returns:
+          int: Capacity of the created RAW image, in bytes.
+        """
+        try:
+            with open(input_path, 'rb') as input_file:
+                reader = cls(input_file, **kwargs)
+                with open(output_path, 'wb') as output_file:
+                    for (offset, data) in reader.allocated_grains():
+                        output_file.seek(offset)
+                        output_file.write(data[:reader.capacity - offset])
+                    output_file.truncate(reader.capacity)
+            return reader.capacity
+        except Exception:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+
+    def readable(self):
+        """Report that this stream is readable."""
+        return True
+
+    def seekable(self):
+        """Report that this stream supports random access."""
+        return True
+
+    def tell(self):
+        """Get the current position within the virtual disk."""
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Change the current position within the virtual disk.
+
+        Args:
+          offset (int): Offset relative to the position given by whence.
+          whence (int): ``os.SEEK_SET``, ``os.SEEK_CUR``, or
+              ``os.SEEK_END``.
+
+        Returns:
+          int: The new absolute position.
+        """
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.capacity
+        if offset < 0:
+            raise ValueError("Negative seek position {0}".format(offset))
+        self._position = offset
+        return self._position
+
+    def read(self, size=-1):
+        """Read raw disk contents from the current position.
+
+        Args:
+          size (int): Maximum number of bytes to read; if negative, read
+              through the end of the disk.
+
+        Returns:
+          bytes: Data read, which is empty at the end of the disk.
+        """
+        end = self.capacity
+        if size is not None and size >= 0:
+            end = min(end, self._position + size)
+        chunks = []
+        while self._position < end:
+            (index, within) = divmod(self._position, self.grain_bytes)
+            length = min(self.grain_bytes - within, end - self._position)
+            if index not in self._grains:
+                chunks.append(b"\0" * length)
+            else:
+                if self._cached_grain[0] != index:
+                    self._cached_grain = (
+                        index, self._grain_data(self._grains[index]))
+                chunks.append(self._cached_grain[1][within:within + length])
+            self._position += length
+        return b"".join(chunks)
+
+    def readinto(self, buf):
+        """Read raw disk contents into a pre-allocated buffer.
+
+        Args:
+          buf (bytearray): Buffer to fill.
+
+        Returns:
+          int: Number of bytes read.
+        """
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+
+class DeferredVMDK(VMDK):
+    """A streamOptimized VMDK that will be converted from another image later.
+
+    This lets a VM description refer to the converted disk (its name,
+    format, and capacity are all known in advance) while postponing the
+    conversion until the VM is written out, when all of its disks can be
+    converted concurrently (see :mod:`COT.disks.scheduler`). A RAW image is
+    converted natively, directly into its final destination - for example,
+    into the member of an OVA being written - rather than into a temporary
+    file. Any other image is converted by the appropriate helper program
+    into a temporary directory, then copied to its destination.
+    """
+
+    HELPER_MEMORY = 64 << 20
+    """Estimated memory used by a helper program to convert an image."""
+
+    def __init__(self, source, path):
+        """Describe the VMDK to be created from the given image.
+
+        Args:
+          source (DiskRepresentation): Existing image to convert.
+          path (str): Path of the VMDK, which need not (yet) exist.
+        """
+        # pylint: disable=super-init-not-called
+        # The file doesn't exist yet, so we can't call the parent __init__
+        self._path = path
+        self.source = source
+        self._disk_subformat = "streamOptimized"
+        if source.disk_format == 'raw':
+            sectors = -(-os.path.getsize(source.path) // self.SECTOR_SIZE)
+            self._capacity = str(sectors * self.SECTOR_SIZE)
+        else:
+            self._capacity = source.capacity
+        self._files = None
+        self._header_read = True
+        self._metadata = {}
+
+    @property
+    def max_size(self):
+        """Upper bound on the size of the VMDK once written, in bytes."""
+        return StreamOptimizedWriter.max_size(int(self.capacity))
+
+    def memory_needed(self, threads):
+        """Estimate the memory used by :meth:`write_to`.
+
+        Args:
+          threads (int): Number of threads the conversion may use.
+
+        Returns:
+          int: Estimated memory needed, in bytes.
+        """
+        if self.source.disk_format == 'raw':
+            return StreamOptimizedWriter.memory_needed(threads)
+        return self.HELPER_MEMORY
+
+    def write_to(self, fileobj):
+        """Write the VMDK to the given file object.
+
+        Args:
+          fileobj (file): Writable binary file or stream.
+
+        Returns:
+          int: Number of bytes written.
+        """
+        logger.verbose("Writing %s as streamOptimized VMDK %s",
+                       self.source.path, os.path.basename(self.path))
+        if self.source.disk_format != 'raw':
+            return self._convert_to(fileobj)
+        with open(self.source.path, 'rb') as input_file:
+            writer = StreamOptimizedWriter(fileobj,
+                                           os.path.getsize(self.source.path))
+            return writer.write(input_file, os.path.basename(self.path))
+
+    def _convert_to(self, fileobj):
+        """Convert the source image by helper, then copy it to a file object.
+
+        Helper method for :meth:`write_to`.
+
+        Args:
+          fileobj (file): Writable binary file or stream.
+
+        Returns:
+          int: Number of bytes written.
+        """
+        temp_dir = tempfile.mkdtemp(prefix="convert",
+                                    dir=os.path.dirname(self.path))
+        try:
+            # Rebuilding packages from the same source images is common,
+            # so reuse any earlier conversion of an identical image
+            converted = conversion_cache.convert(
+                self.source, new_format='vmdk', new_directory=temp_dir,
+                new_subformat='streamOptimized')
+            size = os.path.getsize(converted.path)
+            with open(converted.path, 'rb') as input_file:
+                shutil.copyfileobj(input_file, fileobj)
+            return size
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
@@ -24,16 +24,20 @@
   FileReference
   FileOnDisk
   FileInTAR
+  DeferredFile
 """
 
+import hashlib
 import logging
 import os
 import shutil
 import tarfile
+import time
 
 from contextlib import contextmanager, closing
 
 from COT.data_validation import file_checksum
+from COT.disks.cache import file_digest
 
 logger = logging.getLogger(__name__)
 
@@ -223,6 +227,16 @@ class FileOnDisk(FileReference):
             self._size = os.path.getsize(self.file_path)
         return self._size
 
+    @property
+    def checksum(self):
+        """Checksum of this file, remembered across COT invocations."""
+        if self.checksum_algorithm is None:
+            return None
+        if self._checksum is None or self.force_refresh:
+            self._checksum = file_digest(self.file_path,
+                                         self.checksum_algorithm)
+        return self._checksum
+
     @contextmanager
     def open(self, mode):
         """Open the file and return a reference to the file object.
@@ -350,3 +364,207 @@ class FileInTAR(FileReference):
             logger.debug("Copying %s directly from %s to TAR file",
                          self.filename, self.container_path)
             tarf.addfile(self.tarf.getmember(self.filename), obj)
+
+
+class _ChecksumWriter(object):
+    """Write-only file wrapper that tracks the size and checksum of data."""
+
+    def __init__(self, fileobj, checksum_algorithm):
+        """Wrap the given file object.
+
+        Args:
+          fileobj (file): Writable binary file object.
+          checksum_algorithm (str): 'sha1', 'sha256', etc., or None.
+        """
+        self.fileobj = fileobj
+        self.size = 0
+        self._hash = None
+        if checksum_algorithm is not None:
+            self._hash = hashlib.new(checksum_algorithm)
+
+    @property
+    def checksum(self):
+        """Hexadecimal checksum of all data written so far, if any."""
+        if self._hash is None:
+            return None
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        """Write the given data to the wrapped file object.
+
+        Args:
+          data (bytes): Data to write.
+        """
+        self.fileobj.write(data)
+        self.size += len(data)
+        if self._hash is not None:
+            self._hash.update(data)
+
+
+class DeferredFile(FileReference):
+    """Wrapper for a file whose contents are generated when written out.
+
+    The contents are generated directly into their final destination (a
+    directory or a TAR archive), computing the checksum along the way, so
+    that a natively converted disk image never needs to be written
+    anywhere else or read back afterwards. Until then, :attr:`size`
+    reports an upper bound on the eventual size and :attr:`checksum` is
+    ``None``.
+    """
+
+    def __init__(self, container_path, filename, source_path, generator,
+                 max_size, memory_needed=None, **kwargs):
+        """Create a reference to a file that will be generated on demand.
+
+        Args:
+          container_path (str): Directory in which to generate the file
+            if its contents are needed before it is written out.
+          filename (str): File name.
+          source_path (str): Path of the file the contents are derived
+            from, which must continue to exist until the file is written.
+          generator (function): Function taking a writable binary file
+            object, which writes the file contents into it.
+          max_size (int): Upper bound on the size of the file, in bytes.
+          memory_needed (function): Function taking a number of threads,
+            which estimates the memory in bytes that ``generator`` needs
+            when allowed to use that many, if known.
+          **kwargs: Passed through to :meth:`FileReference.__init__`.
+        """
+        self.source_path = source_path
+        self.generator = generator
+        self.max_size = max_size
+        self.memory_needed = memory_needed
+        self._generated = False
+        self._generated_path = None
+        super(DeferredFile, self).__init__(container_path, filename, **kwargs)
+
+    @property
+    def pending(self):
+        """Whether the file contents have not yet been generated."""
+        return not self._generated
+
+    @property
+    def checksum(self):
+        """Checksum of the file, or ``None`` if not yet generated."""
+        return self._checksum
+
+    @property
+    def exists(self):
+        """Return True if the source of this file's contents exists."""
+        if self._generated_path is not None:
+            return os.path.exists(self._generated_path)
+        return os.path.exists(self.source_path)
+
+    @property
+    def file_path(self):
+        """Path to the generated file, if it has been generated locally."""
+        return self._generated_path
+
+    @property
+    def size(self):
+        """Size of the file in bytes, or an upper bound if not yet known."""
+        if self._size is None:
+            return self.max_size
+        return self._size
+
+    def _generate(self, fileobj):
+        """Generate the file contents into the given file object.
+
+        Args:
+          fileobj (file): Writable binary file object.
+
+        Returns:
+          int: Number of bytes written.
+        """
+        writer = _ChecksumWriter(fileobj, self.checksum_algorithm)
+        self.generator(writer)
+        self._size = writer.size
+        self._checksum = writer.checksum
+        self._generated = True
+        return self._size
+
+    @contextmanager
+    def open(self, mode):
+        """Open the file, generating it locally first if necessary.
+
+        This falls back to writing the file contents into
+        :attr:`container_path`, so it is best avoided.
+
+        Args:
+          mode (str): Only 'r' and 'rb' modes are supported.
+        Yields:
+          file: File object
+        Raises:
+          ValueError: if ``mode`` is not valid.
+        """
+        if mode != 'r' and mode != 'rb':
+            raise ValueError("DeferredFile.open() only supports 'r'/'rb' mode")
+        if self._generated_path is None:
+            self.copy_to(self.container_path)
+        with open(self._generated_path, mode) as obj:
+            yield obj
+
+    def copy_to(self, dest_dir):
+        """Generate this file in the given destination directory.
+
+        Args:
+          dest_dir (str): Destination directory.
+        """
+        if self._generated_path is not None:
+            logger.debug("Copying %s to %s", self._generated_path, dest_dir)
+            shutil.copy(self._generated_path, dest_dir)
+            return
+        path = os.path.join(dest_dir, self.filename)
+        logger.debug("Generating %s", path)
+        # The file being replaced may be the very one it is generated from
+        temp_path = os.path.join(dest_dir, ".{0}.tmp".format(self.filename))
+        try:
+            with open(temp_path, 'wb') as obj:
+                self._generate(obj)
+            if os.path.exists(path):
+                # Windows will not rename over an existing file
+                os.remove(path)
+            os.rename(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._generated_path = path
+
+    def add_to_archive(self, tarf):
+        """Generate this file directly into the given tarfile object.
+
+        Since the size isn't known in advance, the TAR header is written
+        with a placeholder size, then rewritten in place once known. The
+        header uses the GNU format, whose length is independent of the file
+        size, regardless of the format of the rest of the archive.
+
+        Args:
+          tarf (tarfile.TarFile): Add this file to that archive, which must
+            be a seekable, uncompressed archive opened for writing.
+        """
+        if self._generated_path is not None:
+            tarf.add(self._generated_path, self.filename)
+            return
+        logger.debug("Generating %s directly into TAR file", self.filename)
+        info = tarfile.TarInfo(self.filename)
+        info.mtime = time.time()
+        fileobj = tarf.fileobj
+        header_offset = fileobj.tell()
+        header = info.tobuf(tarfile.GNU_FORMAT, tarf.encoding, tarf.errors)
+        fileobj.write(header)
+        info.size = self._generate(fileobj)
+        remainder = info.size % tarfile.BLOCKSIZE
+        if remainder:
+            fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+        end_offset = fileobj.tell()
+
+        final_header = info.tobuf(tarfile.GNU_FORMAT,
+                                  tarf.encoding, tarf.errors)
+        assert len(final_header) == len(header)
+        fileobj.seek(header_offset)
+        fileobj.write(final_header)
+        fileobj.seek(end_offset)
+        # Keep the TarFile object's bookkeeping consistent
+        tarf.offset = end_offset
+        tarf.members.append(info)
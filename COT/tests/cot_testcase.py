@@ -32,6 +32,9 @@ from logging import NullHandler
 
 from pkg_resources import resource_filename
 
+from COT.disks.cache import (
+    config_disk_cache, conversion_cache, disk_metadata_cache,
+)
 from COT.helpers import helpers, HelperError
 
 try:
@@ -339,6 +342,13 @@ class COTTestCase(unittest.TestCase):  # noqa: N801
         self.temp_dir = tempfile.mkdtemp(prefix="cot_ut")
         self.temp_file = os.path.join(self.temp_dir, "out.ovf")
         logger.debug("Created temp dir %s", self.temp_dir)
+        # Keep each test's disk metadata cache separate from the user's
+        self.cache_dir = tempfile.mkdtemp(prefix="cot_ut_cache")
+        disk_metadata_cache.directory = self.cache_dir
+        conversion_cache.directory = os.path.join(self.cache_dir,
+                                                  "conversions")
+        config_disk_cache.directory = os.path.join(self.cache_dir,
+                                                   "config_disks")
         # Monitor the global temp directory to make sure COT cleans up
         self.tmps = set(glob.glob(os.path.join(tempfile.gettempdir(), 'cot*')))
 
@@ -359,6 +369,11 @@ class COTTestCase(unittest.TestCase):  # noqa: N801
             shutil.rmtree(self.temp_dir)
         self.temp_dir = None
         self.temp_file = None
+        disk_metadata_cache.directory = None
+        conversion_cache.directory = None
+        config_disk_cache.directory = None
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        self.cache_dir = None
 
         tmps2 = set(glob.glob(os.path.join(tempfile.gettempdir(), 'cot*')))
         delta = tmps2 - self.tmps
@@ -16,13 +16,16 @@
 
 """Unit test cases for COT.file_reference classes."""
 
+import hashlib
 import os
 import tarfile
 
 from pkg_resources import resource_filename
 
 from COT.tests import COTTestCase
-from COT.file_reference import FileReference, FileOnDisk, FileInTAR
+from COT.file_reference import (
+    FileReference, FileOnDisk, FileInTAR, DeferredFile,
+)
 
 
 class TestFileReference(COTTestCase):
@@ -191,3 +194,80 @@ class TestFileInTAR(COTTestCase):
         self.check_diff("",
                         file1=resource_filename(__name__, 'sample_cfg.txt'),
                         file2=os.path.join(self.temp_dir, 'sample_cfg.txt'))
+
+
+class TestDeferredFile(COTTestCase):
+    """Test cases for DeferredFile class."""
+
+    DATA = b"Hello world! " * 1000
+
+    def setUp(self):
+        """Test case setup function called automatically prior to each test."""
+        super(TestDeferredFile, self).setUp()
+        self.generated = 0
+        self.ref = DeferredFile(self.temp_dir, "hello.txt",
+                                source_path=self.input_ovf,
+                                generator=self.generate,
+                                max_size=2 * len(self.DATA),
+                                checksum_algorithm="sha256")
+
+    def generate(self, fileobj):
+        """Write the contents of the DeferredFile under test."""
+        self.generated += 1
+        fileobj.write(self.DATA[:100])
+        fileobj.write(self.DATA[100:])
+
+    def test_pending(self):
+        """Size is an upper bound and checksum unknown until generated."""
+        self.assertTrue(self.ref.pending)
+        self.assertTrue(self.ref.exists)
+        self.assertEqual(self.ref.size, 2 * len(self.DATA))
+        self.assertEqual(self.ref.checksum, None)
+        self.assertEqual(self.generated, 0)
+
+    def test_open(self):
+        """Test the open() API, which generates the file locally."""
+        with self.assertRaises(ValueError):
+            with self.ref.open('w') as obj:
+                assert "Should never get here"
+        with self.ref.open('rb') as obj:
+            self.assertEqual(obj.read(), self.DATA)
+        with self.ref.open('rb') as obj:
+            self.assertEqual(obj.read(), self.DATA)
+        self.assertEqual(self.generated, 1)
+        self.assertEqual(self.ref.file_path,
+                         os.path.join(self.temp_dir, "hello.txt"))
+
+    def test_copy_to(self):
+        """Test the copy_to() API."""
+        out_dir = os.path.join(self.temp_dir, "out")
+        os.mkdir(out_dir)
+        self.ref.copy_to(out_dir)
+        self.assertFalse(self.ref.pending)
+        self.assertEqual(self.ref.size, len(self.DATA))
+        self.assertEqual(self.ref.checksum,
+                         hashlib.sha256(self.DATA).hexdigest())
+        with open(os.path.join(out_dir, "hello.txt"), 'rb') as obj:
+            self.assertEqual(obj.read(), self.DATA)
+
+    def test_add_to_archive(self):
+        """Test the add_to_archive() API."""
+        output_tarfile = os.path.join(self.temp_dir, 'test_output.tar')
+        with tarfile.open(output_tarfile, 'w') as tarf:
+            FileOnDisk(os.path.dirname(self.input_ovf),
+                       os.path.basename(self.input_ovf)).add_to_archive(tarf)
+            self.ref.add_to_archive(tarf)
+            FileOnDisk(os.path.dirname(self.input_ovf),
+                       os.path.basename(self.input_ovf)).add_to_archive(tarf)
+        self.assertEqual(self.generated, 1)
+        self.assertEqual(self.ref.size, len(self.DATA))
+        self.assertEqual(self.ref.checksum,
+                         hashlib.sha256(self.DATA).hexdigest())
+        with tarfile.open(output_tarfile, 'r') as tarf:
+            self.assertEqual(tarf.getnames(),
+                             ["input.ovf", "hello.txt", "input.ovf"])
+            self.assertEqual(tarf.getmember("hello.txt").size,
+                             len(self.DATA))
+            self.assertEqual(tarf.extractfile("hello.txt").read(), self.DATA)
+            tarf.extract('input.ovf', self.temp_dir)
+        self.check_diff("", file2=os.path.join(self.temp_dir, 'input.ovf'))
@@ -23,13 +23,15 @@
 
   OVFHardware
   OVFHardwareDataError
+  OVFInstanceIDPool
+  OVFItemMatrix
 """
 
-import copy
+from bisect import bisect_right
+from contextlib import contextmanager
 import logging
 
 from COT.data_validation import natural_sort
-from COT.xml_file import XML
 
 from .item import OVFItem, OVFItemDataError
 
@@ -40,6 +42,247 @@ class OVFHardwareDataError(Exception):
     """The input data used to construct an :class:`OVFHardware` is not sane."""
 
 
+class OVFInstanceIDPool(object):
+    """Tracker of which integer ``InstanceID`` values are in use.
+
+    Rather than probing each candidate value in turn, the free values are
+    tracked as a sorted list of disjoint ``[start, end)`` ranges lying below
+    a high-water mark, above which every value is free. Finding, claiming,
+    and releasing a value are therefore logarithmic in the number of gaps
+    in the ID space (which is usually zero or very small), rather than
+    linear in the number of IDs in use.
+
+    Examples:
+      ::
+
+        >>> pool = OVFInstanceIDPool()
+        >>> for number in [1, 2, 3, 5]:
+        ...     pool.claim(number)
+        >>> pool.first_free(1)
+        4
+        >>> pool.first_free(5)
+        6
+        >>> pool.release(2)
+        >>> pool.first_free(1)
+        2
+    """
+
+    def __init__(self):
+        """Create a pool in which all non-negative integers are free."""
+        self._high = 0
+        """All values greater than or equal to this are free."""
+        self._starts = []
+        """Sorted list of first value of each free range below _high."""
+        self._ends = []
+        """Sorted list of one past the last value of each such range."""
+
+    def _free_range_index(self, number):
+        """Find the index of the free range containing the given value.
+
+        Args:
+          number (int): Value to look up, which must be less than the
+              high-water mark.
+
+        Returns:
+          int: Index into the free range lists, or ``None`` if the value
+          is in use.
+        """
+        index = bisect_right(self._starts, number) - 1
+        if index >= 0 and number < self._ends[index]:
+            return index
+        return None
+
+    def first_free(self, start=0):
+        """Find the lowest free value greater than or equal to ``start``.
+
+        Args:
+          start (int): Lowest value to consider.
+
+        Returns:
+          int: Free value (not claimed by this call).
+        """
+        start = max(int(start), 0)
+        if start >= self._high:
+            return start
+        index = bisect_right(self._starts, start) - 1
+        if index >= 0 and start < self._ends[index]:
+            return start
+        if index + 1 < len(self._starts):
+            return self._starts[index + 1]
+        return self._high
+
+    def claim(self, number):
+        """Mark the given value as in use. No-op if already in use.
+
+        Args:
+          number (int): Value to claim.
+        """
+        if number < 0:
+            return
+        if number >= self._high:
+            if number > self._high:
+                self._starts.append(self._high)
+                self._ends.append(number)
+            self._high = number + 1
+            return
+        index = self._free_range_index(number)
+        if index is None:
+            return
+        start = self._starts[index]
+        end = self._ends[index]
+        new_starts = []
+        new_ends = []
+        if start < number:
+            new_starts.append(start)
+            new_ends.append(number)
+        if number + 1 < end:
+            new_starts.append(number + 1)
+            new_ends.append(end)
+        self._starts[index:index + 1] = new_starts
+        self._ends[index:index + 1] = new_ends
+
+    def release(self, number):
+        """Mark the given value as free. No-op if already free.
+
+        Args:
+          number (int): Value to release.
+        """
+        if number < 0 or number >= self._high:
+            return
+        index = bisect_right(self._starts, number) - 1
+        if index >= 0 and number < self._ends[index]:
+            return
+        # Merge with the adjacent free ranges, if any
+        start = number
+        end = number + 1
+        first = index + 1
+        last = index + 1
+        if index >= 0 and self._ends[index] == number:
+            start = self._starts[index]
+            first = index
+        if last < len(self._starts) and self._starts[last] == end:
+            end = self._ends[last]
+            last += 1
+        if end == self._high:
+            del self._starts[first:last]
+            del self._ends[first:last]
+            self._high = start
+        else:
+            self._starts[first:last] = [start]
+            self._ends[first:last] = [end]
+
+
+class OVFItemMatrix(object):
+    """Membership matrix of hardware items by profile and resource type.
+
+    The rows of the matrix are the items of an :class:`OVFHardware`, in
+    InstanceID order. Each column - one per ResourceType value and one per
+    profile bit (see :class:`~COT.vm_description.ovf.item.OVFProfileIndex`)
+    - is stored as a bitset over the rows, so that selecting the items of a
+    given type under a given set of profiles is a bitwise AND, and counting
+    them is a population count, rather than a series of
+    :meth:`~COT.vm_description.ovf.item.OVFItem.has_profile` calls.
+    Columns for individual property values (such as ``HostResource``) are
+    added on demand by :meth:`value_rows`.
+    """
+
+    def __init__(self, items, resource_type_tag):
+        """Build the matrix describing the given items.
+
+        Args:
+          items (list): OVFItems, in the order desired for query results.
+          resource_type_tag (str): ``ResourceType`` tag for the OVF version.
+        """
+        self.items = list(items)
+        """List of OVFItems, one per row."""
+        self.type_rows = {}
+        """Dict of ResourceType value to bitset of rows of that type."""
+        self.profile_rows = {}
+        """Dict of profile bit to bitset of rows in that profile."""
+        self._value_rows = {}
+        """Dict of property name to dict of value to bitset of rows."""
+        for (row, item) in enumerate(self.items):
+            row_bit = 1 << row
+            resource_type = item.get_value(resource_type_tag)
+            self.type_rows[resource_type] = (
+                self.type_rows.get(resource_type, 0) | row_bit)
+            mask = item.profile_mask()
+            while mask:
+                bit = mask & -mask
+                self.profile_rows[bit] = (
+                    self.profile_rows.get(bit, 0) | row_bit)
+                mask ^= bit
+
+    def rows(self, resource_type=None, profile_bits=None):
+        """Get the bitset of rows matching the given filters.
+
+        Args:
+          resource_type (str): ResourceType value to filter on, if any.
+          profile_bits (list): Profile bits to filter on, if any; rows must
+              be present in all of the given profiles.
+
+        Returns:
+          int: Bitset of matching rows.
+        """
+        if resource_type is None:
+            rows = (1 << len(self.items)) - 1
+        else:
+            rows = self.type_rows.get(resource_type, 0)
+        for bit in profile_bits or ():
+            rows &= self.profile_rows.get(bit, 0)
+        return rows
+
+    def value_rows(self, name, value):
+        """Get the bitset of rows whose given property has the given value.
+
+        The per-value index for each property is built on first use.
+
+        Args:
+          name (str): Property name, such as ``HostResource``.
+          value (str): Value to match, as returned by
+              :meth:`~COT.vm_description.ovf.item.OVFItem.get_value`.
+
+        Returns:
+          int: Bitset of matching rows.
+        """
+        index = self._value_rows.get(name)
+        if index is None:
+            index = {}
+            for (row, item) in enumerate(self.items):
+                item_value = item.get_value(name)
+                index[item_value] = index.get(item_value, 0) | (1 << row)
+            self._value_rows[name] = index
+        return index.get(value, 0)
+
+    def select(self, rows):
+        """Get the items corresponding to the given bitset of rows.
+
+        Args:
+          rows (int): Bitset of rows.
+
+        Returns:
+          list: OVFItems, in row order.
+        """
+        result = []
+        while rows:
+            row_bit = rows & -rows
+            result.append(self.items[row_bit.bit_length() - 1])
+            rows ^= row_bit
+        return result
+
+    @staticmethod
+    def count(rows):
+        """Get the number of rows in the given bitset.
+
+        Args:
+          rows (int): Bitset of rows.
+
+        Returns:
+          int: Number of rows.
+        """
+        return bin(rows).count("1")
+
+
 class OVFHardware(object):
     """Helper class for :class:`~COT.vm_description.ovf.ovf.OVF`.
 
@@ -62,6 +305,39 @@ class OVFHardware(object):
         """
         self.ovf = ovf
         self.item_dict = {}
+        self._instance_ids = OVFInstanceIDPool()
+        """Tracker of integer InstanceIDs in use or reserved."""
+        self._matrix = None
+        """Cached OVFItemMatrix, or None if it needs to be rebuilt."""
+        self._matrix_config_mask = None
+        """Value of ovf.config_profile_mask when _matrix was built."""
+        self._item_elements = {}
+        """Dict of InstanceID to the list of XML Items last written for it."""
+        self._batch_depth = 0
+        """Nesting depth of :meth:`batch_edit` blocks currently open."""
+        self._pending_validation = {}
+        """Dict of id() to OVFItem awaiting validation at end of batch."""
+        with self.batch_edit():
+            item_count = self._parse_items()
+        logger.debug(
+            "OVF contains %s hardware Item elements describing %s "
+            "unique devices", item_count, len(self.item_dict))
+        # Treat the current state as golden:
+        for ovfitem in self.item_dict.values():
+            ovfitem.modified = False
+
+    def _parse_items(self):
+        """Populate :attr:`item_dict` from the OVF's VirtualHardwareSection.
+
+        Helper for :meth:`__init__`.
+
+        Returns:
+          int: Number of XML Items parsed.
+
+        Raises:
+          OVFHardwareDataError: if any data errors are seen
+        """
+        ovf = self.ovf
         valid_profiles = set(ovf.config_profiles)
         item_count = 0
         for item in ovf.virtual_hw_section:
@@ -82,8 +358,9 @@ class OVFHardware(object):
                                            "Item instance {1}"
                                            .format(unknown_profiles, instance))
 
+            self._item_elements.setdefault(instance, []).append(item)
             if instance not in self.item_dict:
-                self.item_dict[instance] = OVFItem(self.ovf, item)
+                self._add_item(instance, OVFItem(self.ovf, item))
             else:
                 try:
                     self.item_dict[instance].add_item(item)
@@ -92,56 +369,186 @@ class OVFHardware(object):
                     # Mask away the nitty-gritty details from our caller
                     raise OVFHardwareDataError("Data conflict for instance {0}"
                                                .format(instance))
-        logger.debug(
-            "OVF contains %s hardware Item elements describing %s "
-            "unique devices", item_count, len(self.item_dict))
-        # Treat the current state as golden:
-        for ovfitem in self.item_dict.values():
-            ovfitem.modified = False
+        return item_count
+
+    @contextmanager
+    def batch_edit(self):
+        """Defer validation of modified items until the end of the block.
+
+        Each change to an OVFItem normally ends with a full
+        :meth:`~COT.vm_description.ovf.item.OVFItem.validate` of that item.
+        Within this block, each modified item is instead validated once,
+        when the outermost block exits without error. Blocks may be nested.
+
+        Yields:
+          OVFHardware: this object
+
+        Raises:
+          RuntimeError: if any modified item fails validation
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except Exception:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._pending_validation = {}
+            raise
+        self._batch_depth -= 1
+        if not self._batch_depth:
+            pending = self._pending_validation
+            self._pending_validation = {}
+            logger.spam("Validating %d items modified in batch",
+                        len(pending))
+            for ovfitem in pending.values():
+                if ovfitem.hardware is self:
+                    ovfitem.validate()
+
+    def defer_validation(self, ovfitem):
+        """Queue the given item for validation if a batch edit is open.
+
+        Args:
+          ovfitem (OVFItem): Item that needs validating.
+
+        Returns:
+          bool: True if validation was deferred, False if the caller
+          should validate the item immediately.
+        """
+        if not self._batch_depth:
+            return False
+        self._pending_validation[id(ovfitem)] = ovfitem
+        return True
 
     def update_xml(self):
-        """Regenerate all Items under the VirtualHardwareSection, if needed.
+        """Regenerate Items under the VirtualHardwareSection, if needed.
+
+        Only the XML Items belonging to new or modified
+        :class:`~COT.vm_description.ovf.item.OVFItem` instances are
+        regenerated; the existing Items of unmodified instances are kept as-is
+        and the Items of deleted instances are dropped. The resulting
+        children of the VirtualHardwareSection are then laid out in a
+        single ordered pass.
 
         Will do nothing if no Items have been changed.
         """
-        modified = False
-        if len(self.item_dict) != len(XML.find_all_children(
-                self.ovf.virtual_hw_section,
-                set([self.ovf.ITEM, self.ovf.STORAGE_ITEM,
-                     self.ovf.ETHERNET_PORT_ITEM]))):
-            modified = True
-        else:
-            for ovfitem in self.item_dict.values():
-                if ovfitem.modified:
-                    modified = True
-                    break
-        if not modified:
+        section = self.ovf.virtual_hw_section
+        stale = [instance for instance in self._item_elements
+                 if instance not in self.item_dict]
+        dirty = [instance for (instance, ovfitem) in self.item_dict.items()
+                 if ovfitem.modified or instance not in self._item_elements]
+        if not stale and not dirty:
             logger.verbose("No changes to hardware definition, "
                            "so no XML update is required")
             return
-        # Delete the existing Items:
-        delete_count = 0
-        for item in list(self.ovf.virtual_hw_section):
-            if (item.tag == self.ovf.ITEM or
-                    item.tag == self.ovf.STORAGE_ITEM or
-                    item.tag == self.ovf.ETHERNET_PORT_ITEM):
-                self.ovf.virtual_hw_section.remove(item)
-                delete_count += 1
-        logger.debug("Cleared %d existing items from VirtualHWSection",
-                     delete_count)
-        # Generate the new XML Items, in appropriately sorted order by Instance
-        ordering = [self.ovf.INFO, self.ovf.SYSTEM, self.ovf.ITEM]
-        for instance in natural_sort(self.item_dict):
+
+        for instance in stale:
+            logger.debug("Dropping Item(s) for deleted InstanceID %s",
+                         instance)
+            del self._item_elements[instance]
+        for instance in natural_sort(dirty):
             logger.debug("Writing Item(s) with InstanceID %s", instance)
-            ovfitem = self.item_dict[instance]
-            new_items = ovfitem.generate_items()
+            new_items = self.item_dict[instance].generate_items()
             logger.spam("Generated %d items", len(new_items))
-            for item in new_items:
-                XML.add_child(self.ovf.virtual_hw_section, item, ordering)
-        logger.verbose("Updated XML VirtualHardwareSection, now contains %d "
-                       "Items representing %d devices",
-                       len(self.ovf.virtual_hw_section.findall(self.ovf.ITEM)),
-                       len(self.item_dict))
+            self._item_elements[instance] = new_items
+
+        # Lay out the section children in the same order that
+        # XML.add_child() would produce with the ordering
+        # [INFO, SYSTEM, ITEM], without the repeated child scans:
+        # Items follow the leading Info/System children, ahead of any other
+        # (custom) children, while StorageItems and EthernetPortItems
+        # (OVF 2.x) are not in that ordering and so go at the very end.
+        item_tags = (self.ovf.ITEM, self.ovf.STORAGE_ITEM,
+                     self.ovf.ETHERNET_PORT_ITEM)
+        head = []
+        tail = []
+        for child in section:
+            if child.tag in item_tags:
+                continue
+            if not tail and child.tag in (self.ovf.INFO, self.ovf.SYSTEM):
+                head.append(child)
+            else:
+                tail.append(child)
+        items = []
+        other_items = []
+        for instance in natural_sort(self.item_dict):
+            for item in self._item_elements[instance]:
+                if item.tag == self.ovf.ITEM:
+                    items.append(item)
+                else:
+                    other_items.append(item)
+        section[:] = head + items + tail + other_items
+
+        logger.verbose("Updated XML VirtualHardwareSection (%d modified "
+                       "devices), now contains %d Items representing %d "
+                       "devices", len(dirty),
+                       len(items) + len(other_items), len(self.item_dict))
+
+    def _add_item(self, instance, ovfitem):
+        """Add the given OVFItem to :attr:`item_dict`.
+
+        Args:
+          instance (str): InstanceID of the item.
+          ovfitem (OVFItem): Item to add.
+        """
+        self.item_dict[instance] = ovfitem
+        ovfitem.hardware = self
+        self._claim_instance_id(instance)
+        self._matrix = None
+
+    def item_updated(self, ovfitem):  # pylint: disable=unused-argument
+        """Notify this OVFHardware that one of its items has been modified.
+
+        Called by :class:`~COT.vm_description.ovf.item.OVFItem` whenever
+        its properties change.
+
+        Args:
+          ovfitem (OVFItem): Item that was modified.
+        """
+        self._matrix = None
+
+    def _get_matrix(self):
+        """Get the item membership matrix, rebuilding it if needed.
+
+        Returns:
+          OVFItemMatrix: Matrix describing the current items.
+        """
+        config_mask = self.ovf.config_profile_mask
+        if self._matrix is None or self._matrix_config_mask != config_mask:
+            self._matrix = OVFItemMatrix(
+                [self.item_dict[instance] for instance in
+                 natural_sort(self.item_dict)],
+                self.ovf.RESOURCE_TYPE)
+            self._matrix_config_mask = config_mask
+        return self._matrix
+
+    @staticmethod
+    def _instance_number(instance):
+        """Get the integer value of the given InstanceID, if it has one.
+
+        Args:
+          instance (str): InstanceID string.
+
+        Returns:
+          int: Integer value, or ``None`` if the InstanceID is not the
+          canonical string representation of a non-negative integer.
+        """
+        try:
+            number = int(instance)
+        except (TypeError, ValueError):
+            return None
+        if number < 0 or str(number) != instance:
+            return None
+        return number
+
+    def _claim_instance_id(self, instance):
+        """Record that the given InstanceID is now in use.
+
+        Args:
+          instance (str): InstanceID string.
+        """
+        number = self._instance_number(instance)
+        if number is not None:
+            self._instance_ids.claim(number)
 
     def find_unused_instance_id(self, start=1):
         """Find the first available ``InstanceID`` number.
@@ -152,13 +559,34 @@ class OVFHardware(object):
         Returns:
           str: An instance ID that is not yet in use.
         """
-        instance = int(start)
-        while str(instance) in self.item_dict.keys():
-            instance += 1
+        instance = self._instance_ids.first_free(start)
         logger.debug("Found unused InstanceID %d", instance)
         return str(instance)
 
-    def new_item(self, resource_type, profile_list=None):
+    def reserve_instance_ids(self, count, start=1):
+        """Reserve the given number of currently unused ``InstanceID`` values.
+
+        Reserved values will not be returned by subsequent calls to
+        :meth:`find_unused_instance_id` or :meth:`reserve_instance_ids`,
+        and can be passed to :meth:`new_item`.
+
+        Args:
+          count (int): Number of InstanceIDs to reserve.
+          start (int): First InstanceID value to consider (disregarding all
+            lower InstanceIDs, even if available).
+        Returns:
+          list: Reserved instance ID strings, in ascending order.
+        """
+        result = []
+        instance = start
+        for _ in range(count):
+            instance = self._instance_ids.first_free(instance)
+            self._instance_ids.claim(instance)
+            result.append(str(instance))
+        logger.debug("Reserved InstanceIDs %s", result)
+        return result
+
+    def new_item(self, resource_type, profile_list=None, instance=None):
         """Create a new OVFItem of the given type.
 
         Args:
@@ -166,11 +594,15 @@ class OVFHardware(object):
             a key to
             :data:`~COT.vm_description.ovf.name_helper.OVFNameHelper1.RES_MAP`
           profile_list (list): Profiles the new item should belong to
+          instance (str): InstanceID to assign to the new item, such as one
+            returned by :meth:`reserve_instance_ids`. If unset, the first
+            unused InstanceID will be used.
 
         Returns:
           tuple: ``(instance_id, ovfitem)``
         """
-        instance = self.find_unused_instance_id()
+        if instance is None:
+            instance = self.reserve_instance_ids(1)[0]
         ovfitem = OVFItem(self.ovf)
         ovfitem.set_property(self.ovf.INSTANCE_ID, instance, profile_list)
         ovfitem.set_property(self.ovf.RESOURCE_TYPE,
@@ -180,7 +612,7 @@ class OVFHardware(object):
         # so provide a simple default value.
         ovfitem.set_property(self.ovf.ELEMENT_NAME, resource_type,
                              profile_list)
-        self.item_dict[instance] = ovfitem
+        self._add_item(instance, ovfitem)
         ovfitem.modified = True
         logger.info("Created new %s under profile(s) %s, InstanceID is %s",
                     resource_type, profile_list, instance)
@@ -195,6 +627,11 @@ class OVFHardware(object):
         instance = item.get_value(self.ovf.INSTANCE_ID)
         if self.item_dict[instance] == item:
             del self.item_dict[instance]
+            item.hardware = None
+            self._matrix = None
+            number = self._instance_number(instance)
+            if number is not None:
+                self._instance_ids.release(number)
         # TODO: error handling - currently a no-op if item not in item_dict
 
     def clone_item(self, parent_item, profile_list):
@@ -207,24 +644,46 @@ class OVFHardware(object):
         Returns:
           tuple: ``(instance_id, ovfitem)``
         """
-        instance = self.find_unused_instance_id(start=parent_item.instance_id)
-        logger.spam("Cloning existing Item %s with new instance ID %s",
-                    parent_item, instance)
-        ovfitem = copy.deepcopy(parent_item)
+        return self.clone_items(parent_item, profile_list, 1)[0]
+
+    def clone_items(self, parent_item, profile_list, count):
+        """Clone an OVFItem to create the given number of new instances.
+
+        The parent is only pruned down to the requested profiles once,
+        after which each new instance is a cheap :meth:`OVFItem.clone`
+        of the pruned copy.
+
+        Args:
+          parent_item (OVFItem): Instance to clone from
+          profile_list (list): List of profiles to clone into
+          count (int): Number of new instances to create
+
+        Returns:
+          list: List of ``(instance_id, ovfitem)`` tuples, in order of
+          creation.
+        """
+        template = parent_item.clone()
 
         # Delete any profiles from the parent that we don't need now,
         # otherwise we'll get an error when trying to set the instance ID
         # on our clone due to self-inconsistency (#64).
         for profile in self.ovf.config_profiles:
-            if ovfitem.has_profile(profile) and profile not in profile_list:
-                ovfitem.remove_profile(profile)
-
-        ovfitem.set_property(self.ovf.INSTANCE_ID, instance, profile_list)
-        ovfitem.modified = True
-        self.item_dict[instance] = ovfitem
-        logger.spam("Added clone of %s under %s, instance is %s",
-                    parent_item, profile_list, instance)
-        return (instance, ovfitem)
+            if template.has_profile(profile) and profile not in profile_list:
+                template.remove_profile(profile)
+
+        result = []
+        for instance in self.reserve_instance_ids(
+                count, start=parent_item.instance_id):
+            logger.spam("Cloning existing Item %s with new instance ID %s",
+                        parent_item, instance)
+            ovfitem = template.clone()
+            ovfitem.set_property(self.ovf.INSTANCE_ID, instance, profile_list)
+            ovfitem.modified = True
+            self._add_item(instance, ovfitem)
+            logger.spam("Added clone of %s under %s, instance is %s",
+                        parent_item, profile_list, instance)
+            result.append((instance, ovfitem))
+        return result
 
     def item_match(self, item, resource_type, properties, profile_list):
         """Check whether the given item matches the given filters.
@@ -262,14 +721,16 @@ class OVFHardware(object):
         Returns:
           list: Matching OVFItem instances
         """
-        items = [self.item_dict[instance] for instance in
-                 natural_sort(self.item_dict)]
-        filtered_items = []
         if properties is None:
             properties = {}
-        for item in items:
-            if self.item_match(item, resource_type, properties, profile_list):
-                filtered_items.append(item)
+        matrix = self._get_matrix()
+        rows = matrix.rows(
+            self.ovf.RES_MAP[resource_type] if resource_type else None,
+            [self.ovf.profile_index.bit(profile) for profile in
+             profile_list or ()])
+        for (prop, value) in properties.items():
+            rows &= matrix.value_rows(prop, value)
+        filtered_items = matrix.select(rows)
         logger.spam("Found %s Items of type %s with properties %s and"
                     " profiles %s", len(filtered_items), resource_type,
                     properties, profile_list)
@@ -333,12 +794,13 @@ class OVFHardware(object):
         if not profile_list:
             # Get the count under all profiles
             profile_list = self.ovf.config_profiles + [None]
+        matrix = self._get_matrix()
+        rows = matrix.rows(
+            self.ovf.RES_MAP[resource_type] if resource_type else None)
         for profile in profile_list:
-            count_dict[profile] = 0
-        for ovfitem in self.find_all_items(resource_type):
-            for profile in profile_list:
-                if ovfitem.has_profile(profile):
-                    count_dict[profile] += 1
+            count_dict[profile] = matrix.count(
+                rows & matrix.rows(profile_bits=[
+                    self.ovf.profile_index.bit(profile)]))
         for (profile, count) in count_dict.items():
             logger.spam("Profile '%s' has %s %s Item(s)",
                         profile, count, resource_type)
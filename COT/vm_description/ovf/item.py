@@ -33,16 +33,24 @@ hardware configuration profiles.
 
   OVFItem
   OVFItemDataError
+  OVFProfileIndex
 """
 
 import re
 import logging
 import xml.etree.ElementTree as ET    # noqa: N814
 
+try:
+    # Python 3.x
+    from sys import intern
+except ImportError:
+    # Python 2.x - intern() is a builtin
+    pass
+
 from COT.data_validation import natural_sort, ValueUnsupportedError
 from COT.xml_file import XML
 
-from .name_helper import name_helper
+from .name_helper import name_helper, OVFNameHelper1
 
 logger = logging.getLogger(__name__)
 
@@ -77,6 +85,97 @@ class OVFItemDataError(Exception):
     """Data to be added to an :class:`OVFItem` conflicts with existing data."""
 
 
+class OVFProfileIndex(object):
+    """Mapping of configuration profile names to bit positions.
+
+    :class:`OVFItem` represents the set of profiles associated with each
+    property value as an integer bitmask rather than as a set of strings,
+    so that membership tests, unions, and intersections are simple integer
+    operations no matter how many profiles an OVF defines.
+
+    Bit 0 (:attr:`WILDCARD`) is reserved for the "any profile" value
+    ``None``; each other profile name is assigned the next free bit the
+    first time it is seen. Bits are never reassigned, so a single index
+    can be shared by all items of an OVF even as profiles come and go.
+
+    Examples:
+      ::
+
+        >>> index = OVFProfileIndex(['foo', 'bar'])
+        >>> index.mask(['bar'])
+        4
+        >>> index.mask([None, 'foo'])
+        3
+        >>> sorted(index.profiles(6))
+        ['bar', 'foo']
+        >>> index.profiles(index.WILDCARD) == set([None])
+        True
+    """
+
+    WILDCARD = 1
+    """Bit representing the ``None`` (any/default profile) wildcard."""
+
+    def __init__(self, profiles=()):
+        """Create a new index, pre-populated with the given profile names.
+
+        Args:
+          profiles (list): Profile names to assign bits to, in order.
+        """
+        self._bits = {None: self.WILDCARD}
+        self._names = [None]
+        for profile in profiles:
+            self.bit(profile)
+
+    def bit(self, profile):
+        """Get the bit assigned to the given profile, assigning it if new.
+
+        Args:
+          profile (str): Profile name, or ``None``.
+
+        Returns:
+          int: Single-bit mask for this profile.
+        """
+        try:
+            return self._bits[profile]
+        except KeyError:
+            bit = 1 << len(self._names)
+            self._bits[profile] = bit
+            self._names.append(profile)
+            return bit
+
+    def mask(self, profiles):
+        """Get the bitmask representing the given profile names.
+
+        Args:
+          profiles (iterable): Profile names, possibly including ``None``.
+
+        Returns:
+          int: Bitmask with the bit for each given profile set.
+        """
+        result = 0
+        for profile in profiles:
+            result |= self.bit(profile)
+        return result
+
+    def profiles(self, mask):
+        """Get the set of profile names represented by the given bitmask.
+
+        Args:
+          mask (int): Profile bitmask.
+
+        Returns:
+          set: Profile names, possibly including ``None``.
+        """
+        result = set()
+        index = 0
+        while mask:
+            if mask & 1:
+                result.add(self._names[index])
+            mask >>= 1
+            index += 1
+        return result
+
+
 class OVFItem(object):
     """Helper class for :class:`OVF`.
 
@@ -86,13 +185,53 @@ class OVFItem(object):
     In essence, it is:
 
     * a dict of ``Item`` properties (indexed by element name)
-    * each of which is a dict of sets of profiles (indexed by element value)
+    * each of which is a dict of profile bitmasks (indexed by element value)
+
+    The profile bitmasks are interpreted by an :class:`OVFProfileIndex`,
+    shared with the owning OVF; all public methods accept and return
+    profile names, converting to and from bitmasks as needed.
+
+    As a descriptor may contain thousands of Items, this class uses
+    ``__slots__`` and interns property names so that the per-item overhead
+    is kept to a minimum.
+
+    The results of :meth:`get_value` are cached per (tag, profiles) and
+    the cache is discarded whenever :attr:`properties` are changed through
+    this class's API. :attr:`value_cache_hits` and
+    :attr:`value_cache_misses` count how effective this cache is.
     """
 
+    __slots__ = ('ovf', 'name_helper', 'profile_index',
+                 'properties', 'modified', 'namespace',
+                 '_value_cache', 'value_cache_hits', 'value_cache_misses',
+                 'hardware')
+
     # Magic strings
     ATTRIB_KEY_SUFFIX = " {Item attribute}"
     ELEMENT_KEY_SUFFIX = " {custom element}"
 
+    def __new__(cls, ovf=None, item=None):  # pylint: disable=unused-argument
+        """Create an OVFItem with the constants for the OVF's version bound.
+
+        Instances are actually of a cached subclass of OVFItem that carries
+        the name helper constants (``INSTANCE_ID``, ``ITEM_CHILDREN``, etc.)
+        for the relevant OVF version as class attributes, so that looking
+        them up doesn't need to go through :meth:`__getattr__`.
+
+        Args:
+          ovf (OVF): OVF instance that owns the Item (optional)
+          item (xml.etree.ElementTree.Element): 'Item' element (optional)
+
+        Returns:
+          OVFItem: New, uninitialized instance.
+        """
+        if cls is OVFItem:
+            if ovf is not None:
+                cls = _item_class(type(ovf.name_helper))
+            else:
+                cls = _item_class(OVFNameHelper1)
+        return super(OVFItem, cls).__new__(cls)
+
     def __init__(self, ovf, item=None):
         """Create a new OVFItem with contents based on the given Item element.
 
@@ -103,10 +242,20 @@ class OVFItem(object):
         self.ovf = ovf
         if ovf is not None:
             self.name_helper = ovf
+            self.profile_index = ovf.profile_index
         else:
             self.name_helper = name_helper(1.0)
+            self.profile_index = OVFProfileIndex()
         self.properties = {}
-        """Dict of dicts. properties[name][value] = (profile1, profile2)."""
+        """Dict of dicts. properties[name][value] = profile_bitmask."""
+        self._value_cache = {}
+        """Dict of (tag, profile_bitmask) to cached get_value() result."""
+        self.value_cache_hits = 0
+        """Number of get_value() calls answered from the cache."""
+        self.value_cache_misses = 0
+        """Number of get_value() calls that had to compute their result."""
+        self.hardware = None
+        """OVFHardware containing this item, to be notified of changes."""
         self.modified = False
         self.namespace = self.RASD   # default for most item types
         if item is not None:
@@ -136,12 +285,39 @@ class OVFItem(object):
               through but will raise an AttributeError as usual.
         """
         # Don't pass 'special' attributes through to the helper
-        if re.match(r"^__", name):
+        if name.startswith("__"):
             raise AttributeError("'OVFItem' object has no attribute '{0}'"
                                  .format(name))
         # Pass through to designated helper
         return getattr(self.name_helper, name)
 
+    def clone(self):
+        """Create a new OVFItem with the same contents as this one.
+
+        This is a structural copy, not a :func:`copy.deepcopy`: the property
+        values and profile bitmasks are immutable and so are shared with
+        this item, and only the per-property dicts mapping them are copied.
+        The clone refers to the same OVF and profile index as this item.
+
+        Returns:
+          OVFItem: New item, which can be modified without affecting this one.
+          It does not belong to any :class:`OVFHardware` until added to one.
+        """
+        new_item = type(self).__new__(type(self))
+        new_item.ovf = self.ovf
+        new_item.name_helper = self.name_helper
+        new_item.profile_index = self.profile_index
+        new_item.properties = dict((name, dict(value_dict)) for
+                                   (name, value_dict) in
+                                   self.properties.items())
+        new_item.modified = self.modified
+        new_item.namespace = self.namespace
+        new_item._value_cache = dict(self._value_cache)
+        new_item.value_cache_hits = 0
+        new_item.value_cache_misses = 0
+        new_item.hardware = None
+        return new_item
+
     @property
     def property_names(self):
         """List of names of all properties known to this OVFItem."""
@@ -187,7 +363,7 @@ class OVFItem(object):
         Returns:
           set: Profile strings associated with this name/value.
         """
-        return self.properties[name][value]
+        return self.profile_index.profiles(self.properties[name][value])
 
     def all_profiles(self, name, default=None):
         """Superset of all profiles for which this name has a value.
@@ -199,10 +375,25 @@ class OVFItem(object):
         Returns:
           Set of profile strings, or the given `default` if no matches.
         """
-        value_dict = self.properties.get(name, None)
-        if not value_dict:
+        mask = self._all_mask(name)
+        if not mask:
             return default
-        return set.union(*value_dict.values())
+        return self.profile_index.profiles(mask)
+
+    def _all_mask(self, name, default=0):
+        """Bitmask of all profiles for which this name has a value.
+
+        Args:
+          name (str): Property name.
+          default (int): Default value to return if there are no matches
+
+        Returns:
+          int: Profile bitmask, or the given `default` if no matches.
+        """
+        result = 0
+        for mask in self.properties.get(name, {}).values():
+            result |= mask
+        return result or default
 
     def add_item(self, item):
         """Add the given ``Item`` element to this OVFItem.
@@ -223,13 +414,13 @@ class OVFItem(object):
                                         item.tag,
                                         "Item, StorageItem, EthernetPortItem")
 
-        profiles = set(item.get(self.ITEM_CONFIG, "").split())
+        mask = self.profile_index.mask(item.get(self.ITEM_CONFIG, "").split())
         # Store any attributes of the Item itself:
         for (attrib, value) in item.attrib.items():
             if attrib == self.ITEM_CONFIG:
                 continue
             attrib_string = attrib + self.ATTRIB_KEY_SUFFIX
-            self.set_property(attrib_string, value, profiles, overwrite=False)
+            self._set_property(attrib_string, value, mask, overwrite=False)
 
         # Store any child elements of the Item.
         # We save the ElementName and Description elements for last because
@@ -260,24 +451,24 @@ class OVFItem(object):
                 # vmw:Config elements, each distinguished by its vmw:key attr.
                 # Rather than try to guess how these items do or do not match,
                 # we simply store the whole item
-                self.set_property((ET.tostring(child).decode().strip() +
-                                   self.ELEMENT_KEY_SUFFIX),
-                                  ET.tostring(child).decode(),
-                                  profiles, overwrite=False)
+                serialized = ET.tostring(child).decode()
+                self._set_property(
+                    serialized.strip() + self.ELEMENT_KEY_SUFFIX,
+                    serialized, mask, overwrite=False)
                 continue
             # Store the value of this element:
-            self.set_property(tag, child.text, profiles, overwrite=False)
+            self._set_property(tag, child.text, mask, overwrite=False)
             # Store any attributes of this element
             for (attrib, value) in child.attrib.items():
                 attrib_string = tag + "_attrib_" + attrib
-                self.set_property(attrib_string, value, profiles,
-                                  overwrite=False)
+                self._set_property(attrib_string, value, mask,
+                                   overwrite=False)
 
         self.modified = True
         logger.spam("Added %s - new status:\n%s", item.tag, str(self))
-        self.validate()
+        self._request_validation()
 
-    def value_add_wildcards(self, name, value, profiles):
+    def value_add_wildcards(self, name, value, mask):
         """Add wildcard placeholders to a string that may need updating.
 
         If the Description references the ElementName, or the
@@ -289,7 +480,8 @@ class OVFItem(object):
         Args:
           name (str): Property name
           value (str): Value to add wildcards to.
-          profiles (list): Profiles to which this (name, value) applies.
+          mask (int): Bitmask of the profiles to which this (name, value)
+              applies.
 
         Returns:
           str: The updated value string with wildcards added.
@@ -298,32 +490,33 @@ class OVFItem(object):
            :meth:`value_replace_wildcards`
         """
         if name == self.ITEM_DESCRIPTION:
-            en_val = self.get_value(self.ELEMENT_NAME, profiles)
+            en_val = self._get_final_value(self.ELEMENT_NAME, mask)
             if en_val is not None:
                 value = re.sub(en_val, "_EN_", value)
 
         if name == self.ELEMENT_NAME or name == self.ITEM_DESCRIPTION:
-            vq_val = self.get_value(self.VIRTUAL_QUANTITY, profiles)
+            vq_val = self._get_final_value(self.VIRTUAL_QUANTITY, mask)
             if vq_val is not None:
                 value = re.sub(vq_val, "_VQ_", value)
-            rst_val = self.get_value(self.RESOURCE_SUB_TYPE, profiles)
+            rst_val = self._get_final_value(self.RESOURCE_SUB_TYPE, mask)
             if rst_val is not None:
                 if isinstance(rst_val, tuple):
                     rst_val = "/".join(rst_val)
                 value = re.sub(rst_val, "_RST_", value)
-            conn_val = self.get_value(self.CONNECTION, profiles)
+            conn_val = self._get_final_value(self.CONNECTION, mask)
             if conn_val is not None:
                 value = re.sub(conn_val, "_CONN_", value)
 
         return value
 
-    def value_replace_wildcards(self, name, value, profiles):
+    def value_replace_wildcards(self, name, value, mask):
         """Replace wildcards with actual values.
 
         Args:
           name (str): Property name
           value (str): Value to replace wildcards from.
-          profiles (list): Profiles to which this (name, value) applies.
+          mask (int): Bitmask of the profiles to which this (name, value)
+              applies, or ``None``.
 
         Returns:
           str: The updated value string, with wildcards replaced.
@@ -334,16 +527,16 @@ class OVFItem(object):
         if not value:
             return value
         if name == self.ITEM_DESCRIPTION:
-            en_val = self._get_value(self.ELEMENT_NAME, profiles)
+            en_val = self._get_value(self.ELEMENT_NAME, mask)
             if en_val is not None:
                 value = re.sub("_EN_", str(en_val), str(value))
         if name == self.ELEMENT_NAME or name == self.ITEM_DESCRIPTION:
             # To regenerate text that depends on these values:
-            rst_val = self._get_value(self.RESOURCE_SUB_TYPE, profiles)
+            rst_val = self._get_value(self.RESOURCE_SUB_TYPE, mask)
             if isinstance(rst_val, tuple):
                 rst_val = "/".join(rst_val)
-            vq_val = self._get_value(self.VIRTUAL_QUANTITY, profiles)
-            conn_val = self._get_value(self.CONNECTION, profiles)
+            vq_val = self._get_value(self.VIRTUAL_QUANTITY, mask)
+            conn_val = self._get_value(self.CONNECTION, mask)
             if rst_val is not None:
                 value = re.sub("_RST_", str(rst_val), str(value))
             if vq_val is not None:
@@ -352,7 +545,7 @@ class OVFItem(object):
                 value = re.sub("_CONN_", str(conn_val), str(value))
         return value
 
-    def _set_new_property(self, name, value, profiles):
+    def _set_new_property(self, name, value, mask):
         """Create a new property entry.
 
         Helper for :meth:`set_property`.
@@ -360,18 +553,18 @@ class OVFItem(object):
         Args:
           name (str): Property name
           value (str): Value to store for this property.
-          profiles (list): Profiles to which this (name, value) applies.
+          mask (int): Bitmask of profiles to which this (name, value) applies.
         """
         if not value:
             return
 
-        if None in profiles:
-            self.properties[name] = {value: set([None])}
-        else:
-            self.properties[name] = {value: profiles}
+        if mask & OVFProfileIndex.WILDCARD:
+            mask = OVFProfileIndex.WILDCARD
+        self.properties[name] = {value: mask}
         self.modified = True
+        self._properties_changed()
 
-    def _set_existing_property(self, name, value, profiles, overwrite):
+    def _set_existing_property(self, name, value, mask, overwrite):
         """Update an existing property.
 
         Helper for :meth:`set_property`.
@@ -379,52 +572,60 @@ class OVFItem(object):
         Args:
           name (str): Property name
           value (str): Value to store for this property.
-          profiles (list): Profiles to which this (name, value) applies.
+          mask (int): Bitmask of profiles to which this (name, value) applies.
           overwrite (bool): Whether to permit overwriting existing values.
 
         Raises:
           OVFItemDataError: If ``overwrite`` is False and the value is
-              already set for one or more of the requested ``profiles``.
+              already set for one or more of the requested profiles.
         """
-        for (known_value, profile_set) in list(self.properties[name].items()):
-            if not overwrite and profile_set.intersection(profiles):
+        value_dict = self.properties[name]
+        for (known_value, known_mask) in list(value_dict.items()):
+            if not overwrite and known_mask & mask:
                 raise OVFItemDataError(
                     "Tried to set value:\n'{0}'\nfor property\n'{1}'\n"
                     "under profile(s) {2} but already had value:\n'{3}'\n"
                     "for this property under profile(s) {4}"
-                    .format(value, name, profiles,
+                    .format(value, name, self.profile_index.profiles(mask),
                             known_value,
-                            profile_set.intersection(profiles)))
-            new_set = profile_set.copy()
+                            self.profile_index.profiles(known_mask & mask)))
 
             if known_value != value:
                 # Our profiles should not use this old value
-                new_set -= profiles
-            elif None in profile_set:
+                new_mask = known_mask & ~mask
+            elif known_mask & OVFProfileIndex.WILDCARD:
                 # No need to add ourselves, we're already covered
                 # implicitly by the default
-                pass
+                new_mask = known_mask
             else:
-                new_set |= profiles
+                new_mask = known_mask | mask
+            if new_mask & OVFProfileIndex.WILDCARD:
+                # Any profiles listed alongside the default are redundant
+                new_mask = OVFProfileIndex.WILDCARD
 
-            if new_set != profile_set:
+            if new_mask != known_mask:
                 self.modified = True
-                if not new_set:
+                self._properties_changed()
+                if not new_mask:
                     logger.spam("No longer any profiles with value %s"
                                 " - deleting this value",
                                 known_value)
-                    del self.properties[name][known_value]
+                    del value_dict[known_value]
                 else:
-                    self.properties[name][known_value] = new_set
+                    value_dict[known_value] = new_mask
 
-        if value and value not in self.property_values(name):
-            self.properties[name][value] = profiles
+        if value and value not in value_dict:
+            if mask & OVFProfileIndex.WILDCARD:
+                mask = OVFProfileIndex.WILDCARD
+            value_dict[value] = mask
             self.modified = True
-        elif not self.properties[name]:
+            self._properties_changed()
+        elif not value_dict:
             logger.debug("No longer any values saved for property %s"
                          " - deleting this property", name)
             del self.properties[name]
             self.modified = True
+            self._properties_changed()
 
     def set_property(self, name, value, profiles=None, overwrite=True):
         """Store the value and profiles associated with it for the given name.
@@ -441,6 +642,26 @@ class OVFItem(object):
           OVFItemDataError: if a value is already defined and would be
               overwritten, unless :attr:`overwrite` is ``True``
         """
+        mask = self.profile_index.mask(profiles) if profiles else 0
+        self._set_property(name, value, mask, overwrite)
+
+    def _set_property(self, name, value, mask, overwrite=True):
+        """Store the value and profile bitmask associated with it.
+
+        Implementation of :meth:`set_property`.
+
+        Args:
+          name (str): Property name
+          value (str): Value associated with :attr:`name`
+          mask (int): If ``0``, set for all profiles currently known
+              to this item, else set only for the given profile bitmask.
+          overwrite (bool): Whether to permit overwriting of existing
+              value set in this item.
+        """
+        # Many items share the same small set of property names.
+        # (Under Python 2, only byte strings can be interned.)
+        if isinstance(name, str):
+            name = intern(name)
         # A ResourceSubType in the XML can be a single value or a
         # space-separated list of values. Internally, we'll store it as a
         # tuple, and re-join it later if needed.
@@ -461,25 +682,24 @@ class OVFItem(object):
         if name == self.RESOURCE_TYPE:
             self.namespace = self.namespace_for_resource_type(value)
 
-        if not profiles:
+        if not mask:
             # Profiles not specified.
             # 1) If this property was already defined for a specific set of
             #    profiles, then change the value for all of these profiles.
             # 2) If this property was not defined previously, then set the
-            #    value for all profiles (the magic set([None]))
-            profiles = self.all_profiles(name, set([None]))
-        profiles = set(profiles)
+            #    value for all profiles (the wildcard)
+            mask = self._all_mask(name, OVFProfileIndex.WILDCARD)
 
-        value = self.value_add_wildcards(name, value, profiles)
+        value = self.value_add_wildcards(name, value, mask)
         logger.spam("Setting %s to %s under profiles %s",
-                    name, value, profiles)
+                    name, value, self.profile_index.profiles(mask))
         if name not in self.properties:
-            self._set_new_property(name, value, profiles)
+            self._set_new_property(name, value, mask)
         else:
-            self._set_existing_property(name, value, profiles, overwrite)
+            self._set_existing_property(name, value, mask, overwrite)
 
         if self.modified:
-            self.validate()
+            self._request_validation()
 
     def add_profile(self, new_profile, from_item=None):
         """Add a new profile to this item.
@@ -507,17 +727,17 @@ class OVFItem(object):
                      self.properties.get(self.INSTANCE_ID,
                                          "<unknown instance>"),
                      from_item.properties[self.INSTANCE_ID])
-        p_set = set([new_profile])
+        bit = self.profile_index.bit(new_profile)
         for name in from_item.property_names:
             found = False
             if not from_item.properties[name]:
                 logger.spam("No values stored for name %s - not cloning it",
                             name)
                 continue
-            for (value, profiles) in from_item.properties[name].items():
-                if (None in profiles or
-                        len(from_item.property_values(name)) == 1):
-                    self.set_property(name, value, p_set)
+            for (value, mask) in from_item.properties[name].items():
+                if (mask & OVFProfileIndex.WILDCARD or
+                        len(from_item.properties[name]) == 1):
+                    self._set_property(name, value, bit)
                     found = True
                     break
             if not found:
@@ -525,7 +745,7 @@ class OVFItem(object):
                     "Not sure which value to clone for {0}: {1}"
                     .format(name, from_item.properties[name].items()))
         self.modified = True
-        self.validate()
+        self._request_validation()
 
     def remove_profile(self, profile, split_default=True):
         """Remove all trace of the given profile from this item.
@@ -544,30 +764,34 @@ class OVFItem(object):
             return
         logger.debug("Removing profile %s from item %s",
                      profile, self.properties[self.INSTANCE_ID])
-        p_set = set([profile])
+        bit = self.profile_index.bit(profile)
         for name in self.property_names:
-            for (value, profiles) in list(self.properties[name].items()):
-                profiles -= p_set
+            value_dict = self.properties[name]
+            for value in list(value_dict):
+                mask = value_dict[value] & ~bit
                 # Convert "any profile" to a list of all profiles minus
                 # this one and any profiles already set elsewhere
-                if None in profiles and split_default:
+                if mask & OVFProfileIndex.WILDCARD and split_default:
                     logger.debug("Profile contains 'any profile'; "
                                  "fixing it up")
-                    profiles.update(self.ovf.config_profiles)
-                    profiles.discard(None)
-                    profiles.discard(profile)
+                    mask |= self.ovf.config_profile_mask
+                    mask &= ~(OVFProfileIndex.WILDCARD | bit)
                     # Discard all profiles set elsewhere
-                    for (val, prof) in list(self.properties[name].items()):
+                    for (val, other_mask) in value_dict.items():
                         if val == value:
                             continue
-                        profiles -= prof
-                    logger.spam("Profiles are now: %s", profiles)
-                if not profiles:
+                        mask &= ~other_mask
+                    logger.spam("Profiles are now: %s",
+                                self.profile_index.profiles(mask))
+                if not mask:
                     logger.debug("No more profiles for value %s, %s",
                                  name, value)
-                    del self.properties[name][value]
+                    del value_dict[value]
+                else:
+                    value_dict[value] = mask
         self.modified = True
-        self.validate()
+        self._properties_changed()
+        self._request_validation()
 
     def get(self, tag):
         """Get the dict associated with the given XML tag, if any.
@@ -580,7 +804,7 @@ class OVFItem(object):
         """
         return self.properties.get(tag, None)
 
-    def _get_value(self, tag, profiles=None):
+    def _get_value(self, tag, mask=None):
         """Get internal value string for the given tag.
 
         Unlike :meth:`get_value`, this retains any internal modifications of
@@ -591,17 +815,15 @@ class OVFItem(object):
 
         Args:
           tag (str): Tag to retrieve value for
-          profiles (set): set of profile names, or None
+          mask (int): Profile bitmask, or None
 
         Returns:
           Value, default value, or ``None``, unsanitized.
         """
-        if profiles is not None:
-            profiles = set(profiles)
         val_dict = self.properties.get(tag, {})
-        if profiles is None:
+        if mask is None:
             if len(val_dict) == 1:
-                return list(val_dict.keys())[0]
+                return next(iter(val_dict))
             else:
                 return None
         # A case we need to handle:
@@ -612,14 +834,68 @@ class OVFItem(object):
         # We have to recognize that y and z are implicit in None but z is not.
         default_val = None
         for (val, prof) in val_dict.items():
-            if prof.issuperset(profiles):
+            if prof & mask == mask:
                 return val
-            if None in prof:
+            if prof & OVFProfileIndex.WILDCARD:
                 default_val = val
-            elif not prof.isdisjoint(profiles):
+            elif prof & mask:
                 return None
         return default_val
 
+    def _get_final_value(self, tag, mask=None):
+        """Get the value for the given tag under the given profile bitmask.
+
+        Implementation of :meth:`get_value`, caching the results of
+        :meth:`_resolve_value`.
+
+        Args:
+          tag (str): Tag to retrieve value for
+          mask (int): Profile bitmask, or None
+
+        Returns:
+          Value string or list, or ``None``
+        """
+        key = (tag, mask)
+        try:
+            val = self._value_cache[key]
+        except KeyError:
+            self.value_cache_misses += 1
+            val = self._resolve_value(tag, mask)
+            self._value_cache[key] = val
+            return val
+        self.value_cache_hits += 1
+        return val
+
+    def _resolve_value(self, tag, mask=None):
+        """Get the value for the given tag under the given profile bitmask.
+
+        Helper for :meth:`_get_final_value`.
+
+        Args:
+          tag (str): Tag to retrieve value for
+          mask (int): Profile bitmask, or None
+
+        Returns:
+          Value string or list, or ``None``
+
+        Raises:
+          OVFItemDataError: if :meth:`value_replace_wildcards` failed to
+              remove any wildcards from the internally stored value.
+        """
+        val = self._get_value(tag, mask)
+        val = self.value_replace_wildcards(tag, val, mask)
+        # Sanity check
+        if tag == self.ELEMENT_NAME or tag == self.ITEM_DESCRIPTION:
+            if val and re.search(r"_RST_|_VQ_|_CONN_|_EN_", val):
+                raise OVFItemDataError(
+                    "Unreplaced wildcard in value for {0} profiles {1}:"
+                    "\n{2}\n{3}"
+                    .format(tag,
+                            (None if mask is None else
+                             self.profile_index.profiles(mask)),
+                            val, self))
+        return val
+
     def get_value(self, tag, profiles=None):
         """Get the value for the given tag under the given profiles.
 
@@ -637,15 +913,9 @@ class OVFItem(object):
           OVFItemDataError: if :meth:`value_replace_wildcards` failed to
               remove any wildcards from the internally stored value.
         """
-        val = self._get_value(tag, profiles)
-        val = self.value_replace_wildcards(tag, val, profiles)
-        # Sanity check
-        if tag == self.ELEMENT_NAME or tag == self.ITEM_DESCRIPTION:
-            if val and re.search(r"_RST_|_VQ_|_CONN_|_EN_", val):
-                raise OVFItemDataError("Unreplaced wildcard in value "
-                                       "for {0} profiles {1}:\n{2}\n{3}"
-                                       .format(tag, profiles, val, self))
-        return val
+        if profiles is not None:
+            profiles = self.profile_index.mask(profiles)
+        return self._get_final_value(tag, profiles)
 
     def get_all_values(self, tag):
         """Get the list of all value strings for the given tag.
@@ -680,21 +950,54 @@ class OVFItem(object):
                                    .format(name,
                                            self.property_values(name)))
         for (name, value_dict) in self.properties.items():
-            set_so_far = set()
-            for profile_set in value_dict.values():
-                if None in profile_set and len(profile_set) > 1:
+            mask_so_far = 0
+            for (value, mask) in list(value_dict.items()):
+                if (mask & OVFProfileIndex.WILDCARD and
+                        mask != OVFProfileIndex.WILDCARD):
                     logger.debug("Profile set %s contains redundant info; "
-                                 "cleaning it up now...", profile_set)
+                                 "cleaning it up now...",
+                                 self.profile_index.profiles(mask))
                     # Clean up...
-                    profile_set.clear()
-                    profile_set.add(None)
+                    mask = OVFProfileIndex.WILDCARD
+                    value_dict[value] = mask
+                    self._properties_changed()
                 # Make sure the profile sets are mutually exclusive
-                inter = set_so_far.intersection(profile_set)
+                inter = mask_so_far & mask
                 if inter:
                     raise RuntimeError("OVFItem illegally contains duplicate "
                                        "profiles %s under %s: %s",
-                                       inter, name, value_dict)
-                set_so_far |= profile_set
+                                       self.profile_index.profiles(inter),
+                                       name, value_dict)
+                mask_so_far |= mask
+
+    def _request_validation(self):
+        """Validate this item now, or at the end of the current batch edit.
+
+        See :meth:`~COT.vm_description.ovf.hardware.OVFHardware.batch_edit`.
+        """
+        if self.hardware is None or not self.hardware.defer_validation(self):
+            self.validate()
+
+    def _properties_changed(self):
+        """Discard any cached data derived from :attr:`properties`."""
+        self._value_cache.clear()
+        if self.hardware is not None:
+            self.hardware.item_updated(self)
+
+    def profile_mask(self):
+        """Get the bitmask of all profiles this Item exists under.
+
+        If the Item exists under the "any profile" wildcard, the result
+        includes the wildcard bit as well as the bit of each profile
+        currently defined in the OVF.
+
+        Returns:
+          int: Profile bitmask, per :attr:`profile_index`.
+        """
+        mask = self._all_mask(self.INSTANCE_ID)
+        if mask & OVFProfileIndex.WILDCARD and self.ovf is not None:
+            mask |= self.ovf.config_profile_mask
+        return mask
 
     def has_profile(self, profile):
         """Check if this Item exists under the given profile.
@@ -705,14 +1008,7 @@ class OVFItem(object):
         Returns:
           bool: True if the item exists in this profile, False if not.
         """
-        profiles = self.all_profiles(self.INSTANCE_ID)
-        if profiles is None:
-            return False
-        if profile in profiles:
-            return True
-        elif None in profiles and profile in self.ovf.config_profiles:
-            return True
-        return False
+        return bool(self.profile_mask() & self.profile_index.bit(profile))
 
     def get_nonintersecting_set_list(self):
         """Identify the minimal non-intersecting set of profiles.
@@ -720,38 +1016,37 @@ class OVFItem(object):
         Returns:
           list: List of profile-set strings.
         """
-        set_list = []
-        for name in self.property_names:
-            for (_, new_set) in list(self.properties[name].items()):
-                new_set_list = []
-                for existing_set in set_list:
-                    # If the sets are identical or do not intersect, do nothing
-                    if (new_set == existing_set or
-                            not new_set.intersection(existing_set)):
-                        new_set_list.append(frozenset(existing_set))
-                        continue
-                    # Otherwise, need to re-partition!
-                    set_a = existing_set.difference(new_set)
-                    new_set_list.append(frozenset(set_a))
-
-                    set_b = existing_set.intersection(new_set)
-                    new_set_list.append(frozenset(set_b))
-
-                    new_set = new_set.difference(existing_set)
-
-                new_set_list.append(frozenset(new_set))
-                # Remove duplicate and empty entries
-                set_list = [x for x in set(new_set_list) if x]
-
-        logger.spam("Final set list is %s", set_list)
+        # Two profiles belong in the same partition if and only if every
+        # property has the same value under both of them. Rather than
+        # repeatedly splitting a list of candidate sets, compute for each
+        # profile a signature identifying the (property, value) entries
+        # it belongs to, then group profiles with identical signatures.
+        signatures = {}
+        entry = 0
+        for value_dict in self.properties.values():
+            for mask in value_dict.values():
+                entry += 1
+                while mask:
+                    bit = mask & -mask
+                    signatures.setdefault(bit, []).append(entry)
+                    mask ^= bit
+        partitions = {}
+        for (bit, signature) in signatures.items():
+            signature = tuple(signature)
+            partitions[signature] = partitions.get(signature, 0) | bit
+        set_list = list(partitions.values())
+
+        logger.spam("Final set list is %s",
+                    [self.profile_index.profiles(x) for x in set_list])
 
         # Construct a list of profile strings
         set_string_list = []
         for final_set in set_list:
-            if None in final_set:
+            if final_set & OVFProfileIndex.WILDCARD:
                 set_string_list.append("")
             else:
-                set_string_list.append(" ".join(natural_sort(final_set)))
+                set_string_list.append(" ".join(natural_sort(
+                    self.profile_index.profiles(final_set))))
         set_string_list = natural_sort(set_string_list)
 
         logger.spam("set string list: %s", set_string_list)
@@ -774,14 +1069,14 @@ class OVFItem(object):
             if not set_string:
                 # no config profile
                 item = ET.Element(item_tag)
-                final_set = set([None])
+                final_mask = OVFProfileIndex.WILDCARD
                 set_string = '<generic>'
             else:
                 item = ET.Element(item_tag, {self.ITEM_CONFIG: set_string})
-                final_set = set(set_string.split())
-            logger.spam("set string: %s; final_set: %s", set_string, final_set)
+                final_mask = self.profile_index.mask(set_string.split())
+            logger.spam("set string: %s", set_string)
             for name in sorted(self.property_names):
-                val = self.get_value(name, final_set)
+                val = self._get_final_value(name, final_mask)
                 if not val:
                     logger.debug("No value defined for attribute '%s' "
                                  "under profile set '%s' for instance %s",
@@ -823,6 +1118,30 @@ class OVFItem(object):
         return item_list
 
 
+_ITEM_CLASSES = {}
+"""Cache of name helper class to OVFItem subclass, see :func:`_item_class`."""
+
+
+def _item_class(helper_class):
+    """Get the OVFItem subclass binding the given name helper's constants.
+
+    Args:
+      helper_class (type): :class:`~.name_helper.OVFNameHelper1` or a
+          subclass thereof.
+
+    Returns:
+      type: Subclass of :class:`OVFItem`.
+    """
+    if helper_class not in _ITEM_CLASSES:
+        attrs = helper_class().constants()
+        attrs.update(__slots__=(),
+                     __doc__=OVFItem.__doc__,
+                     __module__=OVFItem.__module__)
+        _ITEM_CLASSES[helper_class] = type(OVFItem.__name__, (OVFItem,),
+                                           attrs)
+    return _ITEM_CLASSES[helper_class]
+
+
 if __name__ == "__main__":   # pragma: no cover
     import doctest
     doctest.testmod()
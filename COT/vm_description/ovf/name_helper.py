@@ -124,6 +124,12 @@ class OVFNameHelper1(object):
     elements and attributes.
 
     Version-specific subclasses below provide variant properties.
+
+    The constants are derived from the ``NSM``, ``_raw``, and
+    ``_item_children`` tables of each class, and are precomputed as plain
+    class attributes when this module is imported (see
+    :func:`_build_constants`), so looking them up involves no Python-level
+    logic. The full table is also available as :attr:`CONSTANTS`.
     """
 
     # For the standard namespace URIs in an OVF descriptor, let's define
@@ -173,9 +179,6 @@ class OVFNameHelper1(object):
     for more details.
     """     # noqa: E501
 
-    # Cached strings, built on the fly
-    _cache = {}
-
     # XML elements we care about in the OVF descriptor
     # TagPlusNamespace objects
     _raw = dict(
@@ -313,30 +316,21 @@ class OVFNameHelper1(object):
         WEIGHT='Weight',
     )
 
+    CONSTANTS = {}
+    """Dict of all constant names and values for this OVF version."""
+
     def __getattr__(self, name):
-        """Transparently pass attribute lookups to _raw and _cache.
+        """Report an attribute lookup that failed.
+
+        All known constants are precomputed as class attributes, so this
+        is only reached for names that are not defined by this helper.
 
         Args:
           name (str): Attribute name to look up.
-        Returns:
-          Value looked up from :attr:`_raw` and/or :attr:`_cache`.
         Raises:
-          AttributeError: if the given ``name`` is not found.
+          AttributeError: always, as the given ``name`` is not found.
         """
-        if name in self._item_children:
-            return self._item_children[name]
-        if name not in self._cache:
-            if name.lower() in self.NSM:
-                self._cache[name] = "{%s}" % self.NSM[name.lower()]
-            elif name == "EPASD" or name == "SASD":
-                self._cache[name] = self.RASD
-            elif name not in self._raw:
-                raise AttributeError("Unknown attribute '{0}'".format(name))
-            else:
-                namespace = getattr(self, self._raw[name].namespace_name)
-                tag = self._raw[name].tag
-                self._cache[name] = namespace + tag
-        return self._cache[name]
+        raise AttributeError("Unknown attribute '{0}'".format(name))
 
     def __init__(self):
         """Create a name helper for OVF version 1.x."""
@@ -382,6 +376,17 @@ class OVFNameHelper1(object):
         self.EULA_SECTION_ATTRIB = {}
         self.VIRTUAL_HW_SECTION_ATTRIB = {}
 
+    def constants(self):
+        """Get all constants defined by this helper instance.
+
+        Returns:
+          dict: :attr:`CONSTANTS` plus the version-specific instance
+          constants such as ``ITEM_CHILDREN``.
+        """
+        result = dict(self.CONSTANTS)
+        result.update(vars(self))
+        return result
+
     def namespace_for_item_tag(self, tag):
         """Get the XML namespace for the given item tag.
 
@@ -449,7 +454,6 @@ class OVFNameHelper0(OVFNameHelper1):
     )
     """Shorthand for XML namespace URIs usually seen in a version 0.x OVF."""
 
-    _cache = dict(OVFNameHelper1._cache)
     _raw = dict(
         OVFNameHelper1._raw,
         NETWORK_SECTION=_Tag('ovf', 'Section'),
@@ -542,7 +546,6 @@ class OVFNameHelper2(OVFNameHelper1):
     )
     """Shorthand for XML namespace URIs usually seen in a version 2.x OVF."""
 
-    _cache = dict(OVFNameHelper1._cache)
     _raw = dict(
         OVFNameHelper1._raw,
         STORAGE_ITEM=_Tag('ovf', 'StorageItem'),
@@ -552,3 +555,35 @@ class OVFNameHelper2(OVFNameHelper1):
     def __init__(self):
         """Create a name helper for OVF version 2.x."""
         super(OVFNameHelper2, self).__init__()
+
+
+def _build_constants(cls):
+    """Precompute the constants of the given name helper class.
+
+    Each constant is stored as a class attribute of ``cls`` and recorded in
+    ``cls.CONSTANTS``.
+
+    Args:
+      cls (type): :class:`OVFNameHelper1` or a subclass thereof.
+    """
+    namespaces = dict((prefix.upper(), "{%s}" % uri)
+                      for (prefix, uri) in cls.NSM.items())
+    # Prior to OVF 2.x, ethernet and storage items are plain RASD items
+    namespaces.setdefault("EPASD", namespaces["RASD"])
+    namespaces.setdefault("SASD", namespaces["RASD"])
+
+    table = dict((name, namespaces[raw.namespace_name] + raw.tag)
+                 for (name, raw) in cls._raw.items())
+    table.update(namespaces)
+    table.update(cls._item_children)
+    table["NSM"] = cls.NSM
+    table["RES_MAP"] = cls.RES_MAP
+
+    for (name, value) in table.items():
+        setattr(cls, name, value)
+    cls.CONSTANTS = table
+
+
+for _cls in (OVFNameHelper1, OVFNameHelper0, OVFNameHelper2):
+    _build_constants(_cls)
+del _cls
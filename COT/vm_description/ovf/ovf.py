@@ -24,6 +24,8 @@
   OVF
 """
 
+from contextlib import contextmanager
+import io
 import logging
 import os
 import os.path
@@ -38,15 +40,19 @@ from COT.data_validation import (
     match_or_die, check_for_conflict, file_checksum,
     ValueTooHighError, ValueUnsupportedError, canonicalize_nic_subtype,
 )
-from COT.file_reference import FileReference, FileOnDisk
+from COT.file_reference import (
+    FileReference, FileOnDisk, FileInTAR, DeferredFile,
+)
 from COT.platforms import Platform
 from COT.disks import DiskRepresentation
+from COT.disks.scheduler import conversion_scheduler
+from COT.disks.vmdk import DeferredVMDK
 from COT.utilities import pretty_bytes, tar_entry_size
 
 from ..vm_description import VMDescription, VMInitError
 from .name_helper import name_helper, CIM_URI
 from .hardware import OVFHardware, OVFHardwareDataError
-from .item import list_union
+from .item import list_union, OVFProfileIndex
 from .utilities import (
     int_bytes_to_programmatic_units, parse_manifest, programmatic_bytes_to_int,
 )
@@ -67,6 +73,7 @@ class OVF(VMDescription, XML):
       ovf_version
       product_class
       platform
+      hardware
       config_profiles
       default_config_profile
       environment_properties
@@ -195,6 +202,9 @@ class OVF(VMDescription, XML):
 
             self._ovf_version = None
             self.name_helper = name_helper(self.ovf_version)
+            # Bind the version-specific constants (self.ITEM, etc.)
+            # directly rather than looking each up through __getattr__
+            vars(self).update(self.name_helper.constants())
 
             for (prefix, uri) in self.NSM.items():
                 ET.register_namespace(prefix, uri)
@@ -246,15 +256,19 @@ class OVF(VMDescription, XML):
 
             # Initialize various caches
             self._configuration_profiles = None
+            self._config_profile_mask = None
+            self.profile_index = OVFProfileIndex()
+            """Profile name to bitmask mapping shared by all hardware items."""
             self._file_references = {}
+            self._file_index = None
+            """Dicts of File href and id to matching File elements."""
+            self._disk_index = None
+            """Dicts of Disk id and fileRef to matching Disk elements."""
             self._platform = None
-
-            try:
-                self.hardware = OVFHardware(self)
-            except OVFHardwareDataError as exc:
-                raise VMInitError(1,
-                                  "OVF descriptor is invalid: {0}".format(exc),
-                                  self.ovf_descriptor)
+            self._platform_changed = False
+            self._hardware = None
+            self._deferred_disks = {}
+            """Dict of path to DeferredVMDK not yet added with add_file."""
 
             assert self.platform
 
@@ -280,6 +294,8 @@ class OVF(VMDescription, XML):
         """
         if not manifest_file_list:
             return
+        descriptor_file_set = set(descriptor_file_list)
+        manifest_file_set = set(manifest_file_list)
 
         descriptor_in_manifest = False
         # DSP0243 2.1.0: "The manifest file shall contain SHA digests for all
@@ -290,12 +306,12 @@ class OVF(VMDescription, XML):
                 # Manifest should reference the descriptor, but of course the
                 # descriptor does not reference itself
                 descriptor_in_manifest = True
-            elif filename not in descriptor_file_list:
+            elif filename not in descriptor_file_set:
                 logger.error("The manifest lists file '%s' but the OVF"
                              " descriptor does not include it in its"
                              " References section", filename)
         for filename in descriptor_file_list:
-            if filename not in manifest_file_list:
+            if filename not in manifest_file_set:
                 logger.error("The OVF descriptor references file '%s' but"
                              " this file is not included in the manifest",
                              filename)
@@ -451,8 +467,28 @@ class OVF(VMDescription, XML):
 
         # Change platform as well!
         self._platform = None
+        self._platform_changed = True
         assert self.platform
 
+    @property
+    def hardware(self):
+        """OVFHardware describing the Items in the VirtualHardwareSection.
+
+        Parsed from the descriptor on first access, so that operations
+        that never look at the hardware do not pay for it.
+
+        Raises:
+          VMInitError: if the hardware Items in the descriptor are invalid
+        """
+        if self._hardware is None:
+            try:
+                self._hardware = OVFHardware(self)
+            except OVFHardwareDataError as exc:
+                raise VMInitError(1,
+                                  "OVF descriptor is invalid: {0}".format(exc),
+                                  self.ovf_descriptor)
+        return self._hardware
+
     @property
     def platform(self):
         """Get the platform type, as determined from the OVF descriptor.
@@ -499,6 +535,8 @@ class OVF(VMDescription, XML):
                 logger.warning(label + str(exc))
                 return False
 
+        nic_counts = self.hardware.get_item_count_per_profile('ethernet',
+                                                              profile_ids)
         for profile_id in profile_ids:
             profile_str = ""
             if profile_id:
@@ -520,9 +558,9 @@ class OVF(VMDescription, XML):
                                            plat.validate_memory_amount,
                                            int(megabytes))
 
-            nics = self.hardware.get_item_count('ethernet', profile_id)
             result &= _validate_helper(profile_str,
-                                       plat.validate_nic_count, nics)
+                                       plat.validate_nic_count,
+                                       nic_counts[profile_id])
 
             eth_subtypes = list_union(
                 *[eth.get_all_values(self.RESOURCE_SUB_TYPE) for
@@ -558,6 +596,17 @@ class OVF(VMDescription, XML):
             self._configuration_profiles = profile_ids
         return self._configuration_profiles
 
+    @property
+    def config_profile_mask(self):
+        """Bitmask of all :attr:`config_profiles`, per :attr:`profile_index`.
+
+        Does not include the :attr:`OVFProfileIndex.WILDCARD` bit.
+        """
+        if self._config_profile_mask is None:
+            self._config_profile_mask = self.profile_index.mask(
+                self.config_profiles)
+        return self._config_profile_mask
+
     @property
     def environment_properties(self):
         """Get the array of environment properties.
@@ -755,7 +804,7 @@ class OVF(VMDescription, XML):
               through but will raise an AttributeError as usual.
         """
         # Don't pass 'special' attributes through to the helper
-        if re.match(r"^__", name):
+        if name.startswith("__"):
             raise AttributeError("'OVF' object has no attribute '{0}'"
                                  .format(name))
         return getattr(self.name_helper, name)
@@ -817,11 +866,16 @@ class OVF(VMDescription, XML):
         prefix = os.path.splitext(self.output_file)[0]
         extension = self.output_extension
 
-        # Update the XML ElementTree to reflect any hardware changes
-        self.hardware.update_xml()
+        # If the hardware was never even parsed, it can't have changed,
+        # so there's nothing to update in the XML, nor (unless the platform
+        # it must suit has changed) anything new to validate.
+        if self._hardware is not None:
+            # Update the XML ElementTree to reflect any hardware changes
+            self.hardware.update_xml()
 
-        # Validate the hardware to be written
-        self.validate_hardware()
+        if self._hardware is not None or self._platform_changed:
+            # Validate the hardware to be written
+            self.validate_hardware()
 
         # Make sure file references are correct:
         self._refresh_file_references()
@@ -839,13 +893,27 @@ class OVF(VMDescription, XML):
             self.generate_manifest(ovf_file)
             self.tar(ovf_file, self.output_file)
         elif extension == '.ovf':
-            self.write_xml(self.output_file)
             # Copy all files from working directory to destination
             dest_dir = os.path.dirname(os.path.abspath(self.output_file))
 
+            # Generate any converted disks concurrently, copying the
+            # other files meanwhile
+            deferred = [file_ref for file_ref in self.file_references.values()
+                        if isinstance(file_ref, DeferredFile) and
+                        file_ref.pending]
+            threads = conversion_scheduler.threads_per_job(len(deferred))
+            jobs = []
             for file_ref in self.file_references.values():
-                file_ref.copy_to(dest_dir)
+                if file_ref in deferred:
+                    jobs.append(self._submit_deferred(file_ref, dest_dir,
+                                                      threads))
+                else:
+                    file_ref.copy_to(dest_dir)
+            conversion_scheduler.wait(jobs)
+            # Any generated files are only now of known size
+            self._refresh_file_sizes()
 
+            self.write_xml(self.output_file)
             # Generate manifest
             self.generate_manifest(self.output_file)
         else:
@@ -877,28 +945,20 @@ class OVF(VMDescription, XML):
                 # TODO this should probably have a confirm() check...
                 logger.notice("Removing reference to missing file %s", href)
                 self.references.remove(file_elem)
+                self._unindex_child(self._file_index, file_elem)
                 # TODO remove references to this file from Disk, Item?
 
-        for filename, file_ref in self.file_references.items():
-            file_elem = self.find_child(self.references, self.FILE,
-                                        {self.FILE_HREF: filename})
-            assert file_elem is not None
-            file_elem.set(self.FILE_SIZE, str(file_ref.size))
-
-            real_capacity = None
+        self._refresh_file_sizes()
 
+        for filename, file_ref in self.file_references.items():
+            file_elem = self._find_file(self.FILE_HREF, filename)
             disk_item = self.find_disk_from_file_id(
                 file_elem.get(self.FILE_ID))
+            if disk_item is None:
+                continue
 
-            if disk_item is not None:
-                # We can't check disk capacity inside a tar file.
-                # It seems wasteful to extract the disk file (could be
-                # quite large) from the TAR just to check, so we don't.
-                if file_ref.file_path is not None:
-                    diskrep = DiskRepresentation.from_file(file_ref.file_path)
-                    real_capacity = diskrep.capacity
-
-            if disk_item is not None and real_capacity is not None:
+            real_capacity = self._actual_capacity(file_ref)
+            if real_capacity is not None:
                 reported_capacity = str(self.get_capacity_from_disk(disk_item))
                 if reported_capacity != real_capacity:
                     logger.warning(
@@ -909,6 +969,41 @@ class OVF(VMDescription, XML):
                         filename, reported_capacity, real_capacity)
                     self.set_capacity_of_disk(disk_item, real_capacity)
 
+    @staticmethod
+    def _actual_capacity(file_ref):
+        """Get the actual capacity of the given disk file.
+
+        Helper method for :func:`_refresh_file_references`.
+
+        Args:
+          file_ref (FileReference): Disk file to inspect.
+
+        Returns:
+          str: Capacity in bytes, or None if it could not be determined.
+        """
+        if file_ref.file_path is not None:
+            return DiskRepresentation.from_file(file_ref.file_path).capacity
+        if isinstance(file_ref, FileInTAR):
+            # Rather than extract the disk file (could be quite
+            # large) from the TAR, just read its header in place.
+            with file_ref.open('rb') as obj:
+                info = DiskRepresentation.identify(obj)
+            if info is not None and info[2] is not None:
+                return str(info[2])
+            logger.debug("Unable to determine capacity of disk '%s' within %s",
+                         file_ref.filename, file_ref.container_path)
+        return None
+
+    def _refresh_file_sizes(self):
+        """Update the size of each File to match its FileReference.
+
+        Helper method for :func:`write` and :func:`tar`.
+        """
+        for filename, file_ref in self.file_references.items():
+            file_elem = self._find_file(self.FILE_HREF, filename)
+            assert file_elem is not None
+            file_elem.set(self.FILE_SIZE, str(file_ref.size))
+
     def _refresh_networks(self):
         """Make sure all defined networks are actually used by NICs.
 
@@ -1161,8 +1256,7 @@ class OVF(VMDescription, XML):
         # Find placeholder disks as well
         for disk in disk_list:
             file_id = disk.get(self.DISK_FILE_REF)
-            file_obj = self.find_child(self.references, self.FILE,
-                                       attrib={self.FILE_ID: file_id})
+            file_obj = self._find_file(self.FILE_ID, file_id)
             if file_obj is not None:
                 continue   # already reported on above
             disk_cap_string = pretty_bytes(self.get_capacity_from_disk(disk))
@@ -1476,6 +1570,12 @@ class OVF(VMDescription, XML):
             wrapper = textwrap.TextWrapper(width=width,
                                            initial_indent='    ',
                                            subsequent_indent=' ' * 21)
+        nic_counts = self.hardware.get_item_count_per_profile('ethernet',
+                                                              profile_ids)
+        serial_counts = self.hardware.get_item_count_per_profile('serial',
+                                                                 profile_ids)
+        disk_counts = self.hardware.get_item_count_per_profile('harddisk',
+                                                               profile_ids)
         index = 0
         for profile_id in profile_ids:
             cpus = 0
@@ -1489,10 +1589,9 @@ class OVF(VMDescription, XML):
                 mem_bytes = programmatic_bytes_to_int(
                     ram_item.get_value(self.VIRTUAL_QUANTITY, [profile_id]),
                     ram_item.get_value(self.ALLOCATION_UNITS, [profile_id]))
-            nics = self.hardware.get_item_count('ethernet', profile_id)
-            serials = self.hardware.get_item_count('serial', profile_id)
-            disk_count = self.hardware.get_item_count('harddisk',
-                                                      profile_id)
+            nics = nic_counts[profile_id]
+            serials = serial_counts[profile_id]
+            disk_count = disk_counts[profile_id]
             disks_size = 0
             if self.disk_section is not None:
                 for disk in self.disk_section.findall(self.DISK):
@@ -1536,6 +1635,19 @@ class OVF(VMDescription, XML):
             width, (verbosity_option != 'brief'))
         return "\n".join([header] + str_list)
 
+    @contextmanager
+    def batch_edit(self):
+        """Group a series of hardware edits into a single batch.
+
+        Item validation is deferred until the batch completes; see
+        :meth:`OVFHardware.batch_edit`.
+
+        Yields:
+          OVF: this OVF
+        """
+        with self.hardware.batch_edit():
+            yield self
+
     def create_configuration_profile(self, pid, label, description):
         """Create or update a configuration profile with the given ID.
 
@@ -1560,6 +1672,7 @@ class OVF(VMDescription, XML):
         logger.debug("New profile %s created - clear config_profiles cache",
                      pid)
         self._configuration_profiles = None
+        self._config_profile_mask = None
 
     def delete_configuration_profile(self, profile):
         """Delete the profile with the given ID.
@@ -1594,6 +1707,7 @@ class OVF(VMDescription, XML):
         logger.debug("Profile %s deleted - clear config_profiles cache",
                      profile)
         self._configuration_profiles = None
+        self._config_profile_mask = None
 
     # TODO - how to insert a doc about the profile_list (see vm_description.py)
 
@@ -1976,9 +2090,9 @@ class OVF(VMDescription, XML):
 
         Returns:
           DiskRepresentation: :attr:`disk_image`, if no conversion was
-          required, or a new :class:`~COT.disks.DiskRepresentation` instance
-          representing a converted image that has been created in
-          :attr:`output_dir`.
+          required, or a new :class:`~COT.disks.vmdk.DeferredVMDK` instance
+          representing the converted image that will be created when the
+          VM is written out.
         """
         if kind != 'harddisk':
             logger.debug("No disk conversion needed")
@@ -1990,12 +2104,17 @@ class OVF(VMDescription, XML):
             logger.debug("No disk conversion needed")
             return disk_image
 
-        logger.debug("Converting %s (%s, %s) to streamOptimized VMDK",
-                     disk_image.path, disk_image.disk_format,
-                     disk_image.disk_subformat)
-        return disk_image.convert_to(new_format='vmdk',
-                                     new_subformat='streamOptimized',
-                                     new_directory=self.working_dir)
+        # Convert when writing out the OVF/OVA, alongside any other disks
+        # being converted, instead of now. A RAW image can then be written
+        # directly to its final destination as well.
+        (prefix, _) = os.path.splitext(os.path.basename(disk_image.path))
+        deferred = DeferredVMDK(
+            disk_image, os.path.join(self.working_dir, prefix + ".vmdk"))
+        logger.debug("Deferring conversion of %s (%s, %s) to streamOptimized "
+                     "VMDK until output is written", disk_image.path,
+                     disk_image.disk_format, disk_image.disk_subformat)
+        self._deferred_disks[deferred.path] = deferred
+        return deferred
 
     def search_from_filename(self, filename):
         """From the given filename, try to find any existing objects.
@@ -2023,8 +2142,7 @@ class OVF(VMDescription, XML):
         logger.debug("Looking for existing disk info based on filename %s",
                      filename)
 
-        file_obj = self.find_child(self.references, self.FILE,
-                                   attrib={self.FILE_HREF: filename})
+        file_obj = self._find_file(self.FILE_HREF, filename)
 
         if file_obj is None:
             return (file_obj, disk, ctrl_item, disk_item)
@@ -2077,8 +2195,7 @@ class OVF(VMDescription, XML):
         ctrl_item = None
         disk_item = None
 
-        file_obj = self.find_child(self.references, self.FILE,
-                                   attrib={self.FILE_ID: file_id})
+        file_obj = self._find_file(self.FILE_ID, file_id)
 
         disk = self.find_disk_from_file_id(file_id)
 
@@ -2160,26 +2277,19 @@ class OVF(VMDescription, XML):
             logger.debug("Looking for Disk and File matching disk Item")
             # From disk Item to Disk
             disk_id = os.path.basename(host_resource)
-            if self.disk_section is not None:
-                disk = self.find_child(self.disk_section, self.DISK,
-                                       attrib={self.DISK_ID: disk_id})
+            disk = self._find_disk(self.DISK_ID, disk_id)
 
             if disk is not None:
                 # From Disk to File
                 file_id = disk.get(self.DISK_FILE_REF)
-                file_obj = self.find_child(self.references, self.FILE,
-                                           attrib={self.FILE_ID: file_id})
+                file_obj = self._find_file(self.FILE_ID, file_id)
         elif (host_resource.startswith(self.HOST_RSRC_FILE_REF) or
               host_resource.startswith(self.OLD_HOST_RSRC_FILE_REF)):
             logger.debug("Looking for File and Disk matching disk Item")
             # From disk Item to File
             file_id = os.path.basename(host_resource)
-            file_obj = self.find_child(self.references, self.FILE,
-                                       attrib={self.FILE_ID: file_id})
-
-            if self.disk_section is not None:
-                disk = self.find_child(self.disk_section, self.DISK,
-                                       attrib={self.DISK_FILE_REF: file_id})
+            file_obj = self._find_file(self.FILE_ID, file_id)
+            disk = self._find_disk(self.DISK_FILE_REF, file_id)
         else:
             logger.error(
                 "Unrecognized HostResource format '%s'; unable to identify "
@@ -2347,6 +2457,7 @@ class OVF(VMDescription, XML):
             if href in self.file_references.keys():
                 del self.file_references[href]
 
+            self._unindex_child(self._file_index, file_obj)
             file_obj.clear()
         elif disk is None:
             file_obj = ET.SubElement(self.references, self.FILE)
@@ -2367,8 +2478,7 @@ class OVF(VMDescription, XML):
             file_index = len(all_files)
             while disk_index < len(all_disks):
                 tmp_file_id = all_disks[disk_index].get(self.DISK_FILE_REF)
-                next_file = self.find_child(self.references, self.FILE,
-                                            attrib={self.FILE_ID: tmp_file_id})
+                next_file = self._find_file(self.FILE_ID, tmp_file_id)
                 if next_file is not None:
                     file_index = all_files.index(next_file)
                     break
@@ -2377,18 +2487,27 @@ class OVF(VMDescription, XML):
             file_obj = ET.Element(self.FILE)
             self.references.insert(file_index, file_obj)
 
-        file_size_string = str(os.path.getsize(file_path))
         file_name = os.path.basename(file_path)
+        deferred = self._deferred_disks.pop(file_path, None)
+        if deferred is not None:
+            # Generated at write time; size is an upper bound until then
+            file_ref = DeferredFile(
+                os.path.dirname(os.path.abspath(file_path)), file_name,
+                deferred.source.path, deferred.write_to, deferred.max_size,
+                memory_needed=deferred.memory_needed,
+                checksum_algorithm=self.checksum_algorithm)
+        else:
+            # Make a note of the file's location - we'll copy it at write time
+            file_ref = FileOnDisk(
+                os.path.dirname(os.path.abspath(file_path)), file_name,
+                checksum_algorithm=self.checksum_algorithm)
 
         file_obj.set(self.FILE_ID, file_id)
         file_obj.set(self.FILE_HREF, file_name)
-        file_obj.set(self.FILE_SIZE, file_size_string)
+        file_obj.set(self.FILE_SIZE, str(file_ref.size))
+        self._index_child(self._file_index, file_obj)
 
-        # Make a note of the file's location - we'll copy it at write time.
-        # The file_path is always a FileOnDisk
-        self.file_references[file_name] = FileOnDisk(
-            os.path.dirname(os.path.abspath(file_path)), file_name,
-            checksum_algorithm=self.checksum_algorithm)
+        self.file_references[file_name] = file_ref
 
         return file_obj
 
@@ -2407,9 +2526,11 @@ class OVF(VMDescription, XML):
         """
         self.references.remove(file_obj)
         del self.file_references[file_obj.get(self.FILE_HREF)]
+        self._unindex_child(self._file_index, file_obj)
 
         if disk is not None:
             self.disk_section.remove(disk)
+            self._unindex_child(self._disk_index, disk)
 
         if disk_drive is not None:
             # For a CD-ROM drive, we can simply unmap the file.
@@ -2443,6 +2564,7 @@ class OVF(VMDescription, XML):
                               "Existing element will be deleted.")
                 if self.disk_section is not None:
                     self.disk_section.remove(disk)
+                    self._unindex_child(self._disk_index, disk)
                     if not self.disk_section.findall(self.DISK):
                         logger.notice("No Disks left - removing DiskSection")
                         self.envelope.remove(self.disk_section)
@@ -2463,6 +2585,7 @@ class OVF(VMDescription, XML):
 
         if disk is not None:
             disk_id = disk.get(self.DISK_ID)
+            self._unindex_child(self._disk_index, disk)
             disk.clear()
         else:
             disk_id = file_id
@@ -2472,6 +2595,7 @@ class OVF(VMDescription, XML):
 
         disk.set(self.DISK_ID, disk_id)
         disk.set(self.DISK_FILE_REF, file_id)
+        self._index_child(self._disk_index, disk)
         disk.set(self.DISK_FORMAT,
                  ("http://www.vmware.com/interfaces/"
                   "specifications/vmdk.html#streamOptimized"))
@@ -2732,10 +2856,15 @@ class OVF(VMDescription, XML):
             for file_obj in self.references.findall(self.FILE):
                 file_name = file_obj.get(self.FILE_HREF)
                 file_ref = self.file_references[file_name]
+                checksum = file_ref.checksum
+                if checksum is None:
+                    # Not generated yet - tar() will fill in the real value
+                    checksum = "0" * len(file_checksum(
+                        io.BytesIO(), self.checksum_algorithm))
 
                 mfobj.write("{algo}({file})= {sum}\n"
                             .format(algo=self.checksum_algorithm.upper(),
-                                    file=file_name, sum=file_ref.checksum)
+                                    file=file_name, sum=checksum)
                             .encode('utf-8'))
 
         logger.debug("Manifest generated successfully")
@@ -2768,7 +2897,7 @@ class OVF(VMDescription, XML):
                 " working directory before overwriting it.", self.input_file)
             for filename in self.file_references:
                 file_ref = self.file_references[filename]
-                if file_ref.file_path is None:
+                if isinstance(file_ref, FileInTAR):
                     file_ref.copy_to(self.working_dir)
                     self.file_references[filename] = FileReference.create(
                         self.working_dir, filename,
@@ -2776,17 +2905,89 @@ class OVF(VMDescription, XML):
                         expected_checksum=file_ref.checksum,
                         expected_size=file_ref.size)
 
+        # Files generated while writing the archive, such as converted
+        # disks, are of unknown size and checksum until then. In that case,
+        # the descriptor and manifest are rewritten in place afterwards.
+        deferred = [file_ref for file_ref in self.file_references.values()
+                    if isinstance(file_ref, DeferredFile) and file_ref.pending]
+        data_offsets = {}
+
+        # If there are several, all but the largest are generated
+        # concurrently into the working directory, while the largest is
+        # generated directly into the archive, using whatever CPUs the
+        # others leave free.
+        jobs = {}
+        if len(deferred) > 1:
+            largest = max(deferred, key=lambda file_ref: file_ref.max_size)
+            threads = conversion_scheduler.threads_per_job(len(deferred))
+            for file_ref in deferred:
+                if file_ref is not largest:
+                    jobs[file_ref.filename] = self._submit_deferred(
+                        file_ref, file_ref.container_path, threads)
+        try:
+            self._write_tar(tar_file, ovf_descriptor, prefix, jobs,
+                            data_offsets)
+        finally:
+            # Don't leave anything writing into the working directory
+            for job in jobs.values():
+                job.wait()
+
+        if deferred:
+            self._update_tar_metadata(tar_file, ovf_descriptor, data_offsets)
+
+    @staticmethod
+    def _submit_deferred(file_ref, dest_dir, threads):
+        """Schedule a deferred disk to be generated into a directory.
+
+        Helper method for :func:`write` and :func:`tar`.
+
+        Args:
+          file_ref (DeferredFile): Disk to generate.
+          dest_dir (str): Directory to generate it into.
+          threads (int): Number of threads it may use.
+
+        Returns:
+          COT.disks.scheduler.ConversionJob: The scheduled generation.
+        """
+        memory = None
+        if file_ref.memory_needed is not None:
+            memory = file_ref.memory_needed(threads)
+        return conversion_scheduler.submit(
+            file_ref.filename, file_ref.copy_to, (dest_dir,),
+            memory=memory, threads=threads)
+
+    def _write_tar(self, tar_file, ovf_descriptor, prefix, jobs,
+                   data_offsets):
+        """Write the descriptor and all referenced files into a TAR file.
+
+        Helper method for :func:`tar`.
+
+        Args:
+          tar_file (str): Path of the OVA archive to create.
+          ovf_descriptor (str): Path of the OVF descriptor.
+          prefix (str): Path of the descriptor, minus its extension.
+          jobs (dict): Filename to the
+            :class:`~COT.disks.scheduler.ConversionJob` generating that
+            file, to be waited for before adding it to the archive.
+          data_offsets (dict): Updated with the path of the descriptor and
+            manifest files to the offset of their respective contents
+            within the archive.
+        """
         # Be sure to dereference any links to the actual file content!
         with tarfile.open(tar_file, 'w', dereference=True) as tarf:
             # OVF is always first
             logger.debug("Adding OVF descriptor %s to %s",
                          ovf_descriptor, tar_file)
             tarf.add(ovf_descriptor, os.path.basename(ovf_descriptor))
+            data_offsets[ovf_descriptor] = tarf.offset - tar_entry_size(
+                os.path.getsize(ovf_descriptor)) + tarfile.BLOCKSIZE
             # Add manifest if present
             manifest_path = prefix + '.mf'
             if os.path.exists(manifest_path):
                 logger.debug("Adding manifest to %s", tar_file)
                 tarf.add(manifest_path, os.path.basename(manifest_path))
+                data_offsets[manifest_path] = tarf.offset - tar_entry_size(
+                    os.path.getsize(manifest_path)) + tarfile.BLOCKSIZE
             if os.path.exists("{0}.cert".format(prefix)):
                 logger.warning("COT doesn't know how to re-sign a certificate"
                                " file, so the existing certificate will be"
@@ -2795,10 +2996,50 @@ class OVF(VMDescription, XML):
             for file_obj in self.references.findall(self.FILE):
                 file_name = file_obj.get(self.FILE_HREF)
                 file_ref = self.file_references[file_name]
+                if file_name in jobs:
+                    jobs[file_name].result()
                 logger.debug("Adding associated file %s to %s",
                              file_name, tar_file)
                 file_ref.add_to_archive(tarf)
 
+    def _update_tar_metadata(self, tar_file, ovf_descriptor, data_offsets):
+        """Rewrite the descriptor and manifest in an OVA with final values.
+
+        The sizes and checksums of generated files are unknown when the
+        descriptor and manifest (which precede them in the archive) are
+        written, so they are initially written with placeholder values of
+        at least the same length, then overwritten in place here.
+        Any change in the length of the descriptor is made up for with
+        trailing whitespace; the manifest length is unchanged.
+
+        Helper method for :func:`tar`.
+
+        Args:
+          tar_file (str): Path of the OVA archive to update.
+          ovf_descriptor (str): Path of the OVF descriptor.
+          data_offsets (dict): Path of the descriptor and manifest files to
+            the offset of their respective contents within the archive.
+        """
+        logger.verbose("Updating file sizes and checksums in %s", tar_file)
+        length = os.path.getsize(ovf_descriptor)
+        self._refresh_file_sizes()
+        self.write_xml(ovf_descriptor)
+        padding = length - os.path.getsize(ovf_descriptor)
+        assert padding >= 0
+        with open(ovf_descriptor, 'ab') as ovfobj:
+            ovfobj.write(b" " * padding)
+        manifest_path = os.path.splitext(ovf_descriptor)[0] + '.mf'
+        if manifest_path in data_offsets:
+            length = os.path.getsize(manifest_path)
+            self.generate_manifest(ovf_descriptor)
+            assert os.path.getsize(manifest_path) == length
+
+        with open(tar_file, 'r+b') as tarobj:
+            for (path, offset) in data_offsets.items():
+                with open(path, 'rb') as fileobj:
+                    tarobj.seek(offset)
+                    tarobj.write(fileobj.read())
+
     def _ensure_section(self, section_tag, info_string,
                         attrib=None, parent=None):
         """If the OVF doesn't already have the given Section, create it.
@@ -2943,11 +3184,132 @@ class OVF(VMDescription, XML):
         Returns:
           xml.etree.ElementTree.Element: Disk matching the file, or None
         """
-        if file_id is None or self.disk_section is None:
+        if file_id is None:
+            return None
+
+        return self._find_disk(self.DISK_FILE_REF, file_id)
+
+    def _find_file(self, attr, value):
+        """Find the File whose given attribute has the given value.
+
+        Looks up :attr:`_file_index`, rebuilding it first if needed.
+
+        Args:
+          attr (str): :attr:`FILE_HREF` or :attr:`FILE_ID`
+          value (str): Attribute value to look for
+
+        Returns:
+          xml.etree.ElementTree.Element: Matching File, or None
+
+        Raises:
+          LookupError: if more than one File matches
+        """
+        if self._file_index is None:
+            self._file_index = self._build_child_index(
+                self.references, self.FILE, (self.FILE_HREF, self.FILE_ID))
+        return self._lookup_child(self._file_index, self.references,
+                                  self.FILE, attr, value)
+
+    def _find_disk(self, attr, value):
+        """Find the Disk whose given attribute has the given value.
+
+        Looks up :attr:`_disk_index`, rebuilding it first if needed.
+
+        Args:
+          attr (str): :attr:`DISK_ID` or :attr:`DISK_FILE_REF`
+          value (str): Attribute value to look for
+
+        Returns:
+          xml.etree.ElementTree.Element: Matching Disk, or None
+
+        Raises:
+          LookupError: if more than one Disk matches
+        """
+        if self.disk_section is None:
             return None
+        if self._disk_index is None:
+            self._disk_index = self._build_child_index(
+                self.disk_section, self.DISK,
+                (self.DISK_ID, self.DISK_FILE_REF))
+        return self._lookup_child(self._disk_index, self.disk_section,
+                                  self.DISK, attr, value)
+
+    @staticmethod
+    def _build_child_index(parent, tag, attrs):
+        """Index the given children of an element by each of the given attrs.
+
+        Args:
+          parent (xml.etree.ElementTree.Element): Parent element
+          tag (str): Child tag to index
+          attrs (tuple): Child attributes to index on
+
+        Returns:
+          dict: Dict of attribute name to a dict of attribute value to the
+          list of matching children.
+
+        .. seealso:: :meth:`_index_child`, :meth:`_unindex_child` to keep
+           the index up to date as children are added and removed.
+        """
+        index = dict((attr, {}) for attr in attrs)
+        for child in parent.findall(tag):
+            OVF._index_child(index, child)
+        return index
+
+    @staticmethod
+    def _index_child(index, child):
+        """Add a child, as its attributes currently are, to the given index.
+
+        Args:
+          index (dict): Index built by :meth:`_build_child_index`, or None
+            if not built yet (in which case this does nothing).
+          child (xml.etree.ElementTree.Element): Child element to add.
+        """
+        if index is None:
+            return
+        for (attr, values) in index.items():
+            values.setdefault(child.get(attr), []).append(child)
+
+    @staticmethod
+    def _unindex_child(index, child):
+        """Remove a child, as its attributes currently are, from an index.
+
+        Args:
+          index (dict): Index built by :meth:`_build_child_index`, or None
+            if not built yet (in which case this does nothing).
+          child (xml.etree.ElementTree.Element): Child element to remove.
+        """
+        if index is None:
+            return
+        for (attr, values) in index.items():
+            value = child.get(attr)
+            matches = [match for match in values.get(value, ())
+                       if match is not child]
+            if matches:
+                values[value] = matches
+            else:
+                values.pop(value, None)
 
-        return self.find_child(self.disk_section, self.DISK,
-                               attrib={self.DISK_FILE_REF: file_id})
+    def _lookup_child(self, index, parent, tag, attr, value):
+        """Look up the unique child with the given attribute value.
+
+        Args:
+          index (dict): Index built by :meth:`_build_child_index`
+          parent (xml.etree.ElementTree.Element): Parent element
+          tag (str): Child tag
+          attr (str): Attribute name
+          value (str): Attribute value
+
+        Returns:
+          xml.etree.ElementTree.Element: Matching child, or None
+
+        Raises:
+          LookupError: if more than one child matches
+        """
+        matches = index[attr].get(value, ())
+        if len(matches) > 1:
+            # Let find_child report the conflict in its usual way
+            return self.find_child(parent, tag, attrib={attr: value})
+        return matches[0] if matches else None
 
     def find_empty_drive(self, drive_type):
         """Find a disk device that exists but contains no data.
@@ -14,8 +14,11 @@
 
 """Unit test cases for COT.vm_description.ovf.OVFHardware class."""
 
+import mock
+
 from COT.tests import COTTestCase
 from COT.vm_description.ovf import OVF
+from COT.vm_description.ovf.item import OVFItem
 
 
 class TestOVFHardware(COTTestCase):
@@ -54,3 +57,155 @@ class TestOVFHardware(COTTestCase):
         """Test that find_item returns None if no matches are found."""
         with OVF(self.input_ovf, None) as ovf:
             self.assertEqual(None, ovf.hardware.find_item(resource_type='usb'))
+
+    def test_update_xml_only_modified_items(self):
+        """Only the Items of modified instances are regenerated."""
+        with OVF(self.input_ovf, None) as ovf:
+            hardware = ovf.hardware
+            before = list(ovf.virtual_hw_section)
+            hardware.update_xml()
+            self.assertEqual(before, list(ovf.virtual_hw_section))
+
+            hardware.item_dict['11'].set_property(ovf.CONNECTION, "foo")
+            hardware.update_xml()
+            after = list(ovf.virtual_hw_section)
+            self.assertEqual(len(before), len(after))
+            for (old, new) in zip(before, after):
+                instance = old.findtext(ovf.RASD + ovf.INSTANCE_ID)
+                if instance == '11':
+                    self.assertIsNot(old, new)
+                    self.assertEqual(
+                        "foo", new.findtext(ovf.RASD + ovf.CONNECTION))
+                else:
+                    self.assertIs(old, new)
+
+    def test_update_xml_deleted_item(self):
+        """Items of deleted instances are removed from the XML."""
+        with OVF(self.input_ovf, None) as ovf:
+            hardware = ovf.hardware
+            before = list(ovf.virtual_hw_section)
+            hardware.delete_item(hardware.item_dict['13'])
+            hardware.update_xml()
+            after = list(ovf.virtual_hw_section)
+            self.assertEqual(before[:-1], after)
+
+    def test_clone_items(self):
+        """Clone several new instances of an existing Item at once."""
+        with OVF(self.input_ovf, None) as ovf:
+            hardware = ovf.hardware
+            parent = hardware.item_dict['11']
+            parent_properties = dict((name, dict(values)) for
+                                     (name, values) in
+                                     parent.properties.items())
+            clones = hardware.clone_items(parent, ['4CPU-4GB-3NIC'], 3)
+            self.assertEqual(['14', '15', '16'],
+                             [instance for (instance, _) in clones])
+            for (instance, item) in clones:
+                self.assertIs(hardware.item_dict[instance], item)
+                self.assertEqual(instance, item.instance_id)
+                self.assertTrue(item.has_profile('4CPU-4GB-3NIC'))
+                self.assertFalse(item.has_profile('1CPU-1GB-1NIC'))
+                self.assertEqual(parent.get_value(ovf.CONNECTION),
+                                 item.get_value(ovf.CONNECTION))
+                self.assertIsNot(parent.properties, item.properties)
+            # Parent is unaffected
+            self.assertEqual(parent_properties, parent.properties)
+            self.assertEqual(1, hardware.get_item_count(
+                'ethernet', '1CPU-1GB-1NIC'))
+            self.assertEqual(6, hardware.get_item_count(
+                'ethernet', '4CPU-4GB-3NIC'))
+
+    def test_instance_id_allocation(self):
+        """InstanceIDs are reserved, reused after deletion, and skipped."""
+        with OVF(self.input_ovf, None) as ovf:
+            hardware = ovf.hardware
+            self.assertEqual(['14', '15', '16'],
+                             hardware.reserve_instance_ids(3))
+            self.assertEqual('17', hardware.find_unused_instance_id())
+            self.assertEqual(['20', '21'],
+                             hardware.reserve_instance_ids(2, start=20))
+            self.assertEqual('17', hardware.find_unused_instance_id())
+            self.assertEqual('22', hardware.find_unused_instance_id(20))
+
+            (instance, _) = hardware.new_item('serial', instance='15')
+            self.assertEqual('15', instance)
+            (instance, _) = hardware.new_item('serial')
+            self.assertEqual('17', instance)
+
+            hardware.delete_item(hardware.item_dict['12'])
+            self.assertEqual('12', hardware.find_unused_instance_id())
+            self.assertEqual('18', hardware.find_unused_instance_id(13))
+            (instance, _) = hardware.clone_items(
+                hardware.item_dict['11'], ['4CPU-4GB-3NIC'], 1)[0]
+            self.assertEqual('12', instance)
+
+    def test_item_counts_track_changes(self):
+        """Per-profile item counts reflect changes to items and profiles."""
+        with OVF(self.input_ovf, None) as ovf:
+            hardware = ovf.hardware
+            self.assertEqual({'1CPU-1GB-1NIC': 1,
+                              '2CPU-2GB-1NIC': 1,
+                              '4CPU-4GB-3NIC': 3,
+                              None: 1},
+                             hardware.get_item_count_per_profile('ethernet',
+                                                                 None))
+
+            hardware.item_dict['12'].remove_profile('4CPU-4GB-3NIC')
+            self.assertEqual(2, hardware.get_item_count('ethernet',
+                                                        '4CPU-4GB-3NIC'))
+
+            hardware.item_dict['13'].add_profile('1CPU-1GB-1NIC')
+            self.assertEqual(2, hardware.get_item_count('ethernet',
+                                                        '1CPU-1GB-1NIC'))
+            self.assertEqual(
+                [hardware.item_dict['11'], hardware.item_dict['13']],
+                hardware.find_all_items('ethernet',
+                                        profile_list=['1CPU-1GB-1NIC']))
+
+            ovf.create_configuration_profile('new', label="new",
+                                             description="new")
+            self.assertEqual(1, hardware.get_item_count('ethernet', 'new'))
+
+            hardware.delete_item(hardware.item_dict['13'])
+            self.assertEqual(1, hardware.get_item_count('ethernet',
+                                                        '1CPU-1GB-1NIC'))
+            self.assertEqual(0, hardware.get_item_count('ethernet',
+                                                        'nonexistent'))
+
+    def test_batch_edit(self):
+        """Items modified in a batch are validated once, at the end."""
+        with OVF(self.input_ovf, None) as ovf:
+            hardware = ovf.hardware
+            cpu = hardware.item_dict['1']
+            nic = hardware.item_dict['11']
+            with mock.patch.object(OVFItem, 'validate',
+                                   autospec=True) as mock_validate:
+                with ovf.batch_edit():
+                    with hardware.batch_edit():
+                        cpu.set_property(ovf.VIRTUAL_QUANTITY, '2')
+                        cpu.set_property(ovf.ELEMENT_NAME, "2 CPUs")
+                    nic.set_property(ovf.ELEMENT_NAME, "eth0")
+                    nic.add_profile('new')
+                    mock_validate.assert_not_called()
+                self.assertEqual(2, mock_validate.call_count)
+                mock_validate.assert_any_call(cpu)
+                mock_validate.assert_any_call(nic)
+
+                # Outside of a batch, each edit is validated immediately
+                mock_validate.reset_mock()
+                cpu.set_property(ovf.VIRTUAL_QUANTITY, '4')
+                mock_validate.assert_called_once_with(cpu)
+            self.assertEqual('4', cpu.get_value(ovf.VIRTUAL_QUANTITY))
+
+    def test_batch_edit_error(self):
+        """Pending validation is discarded if a batch edit fails."""
+        with OVF(self.input_ovf, None) as ovf:
+            hardware = ovf.hardware
+            cpu = hardware.item_dict['1']
+            with mock.patch.object(OVFItem, 'validate',
+                                   autospec=True) as mock_validate:
+                with self.assertRaises(ValueError):
+                    with ovf.batch_edit():
+                        cpu.set_property(ovf.VIRTUAL_QUANTITY, '2')
+                        raise ValueError("oops")
+                mock_validate.assert_not_called()
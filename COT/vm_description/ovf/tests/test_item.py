@@ -24,7 +24,7 @@ from COT.tests import COTTestCase
 
 from COT.vm_description.ovf import OVF
 from COT.vm_description.ovf.name_helper import OVFNameHelper1
-from COT.vm_description.ovf.item import OVFItem
+from COT.vm_description.ovf.item import OVFItem, OVFProfileIndex
 
 
 class TestOVFItem(COTTestCase):
@@ -263,3 +263,132 @@ OVFItem:
         ovf.write()
         ovf.destroy()
         self.check_diff("")
+
+    def test_profile_bitmasks(self):
+        """Profiles are stored as bitmasks but exposed as names."""
+        ovf = OVF(self.input_ovf, None)
+        # InstanceID 12, second NIC, only in profile 4CPU-4GB-3NIC
+        item = ovf.hardware.item_dict['12']
+        index = ovf.profile_index
+        self.assertIs(item.profile_index, index)
+        self.assertEqual(item.properties[ovf.INSTANCE_ID],
+                         {'12': index.bit('4CPU-4GB-3NIC')})
+        self.assertEqual(item.property_profiles(ovf.INSTANCE_ID, '12'),
+                         set(['4CPU-4GB-3NIC']))
+        self.assertTrue(item.has_profile('4CPU-4GB-3NIC'))
+        self.assertFalse(item.has_profile('1CPU-1GB-1NIC'))
+
+        # InstanceID 11, first NIC, in all profiles
+        item = ovf.hardware.item_dict['11']
+        self.assertEqual(item.all_profiles(ovf.INSTANCE_ID), set([None]))
+        for profile in ovf.config_profiles:
+            self.assertTrue(item.has_profile(profile))
+        self.assertFalse(item.has_profile("nonexistent"))
+        ovf.destroy()
+
+    def test_compact_storage(self):
+        """Items use slots and share interned property-name keys."""
+        ovf = OVF(self.input_ovf, None)
+        item1 = ovf.hardware.item_dict['11']
+        item2 = ovf.hardware.item_dict['12']
+        self.assertFalse(hasattr(item1, '__dict__'))
+        with self.assertRaises(AttributeError):
+            item1.foo = 'bar'
+        key1 = [k for k in item1.property_names if k == ovf.CONNECTION][0]
+        key2 = [k for k in item2.property_names if k == ovf.CONNECTION][0]
+        self.assertIs(key1, key2)
+        ovf.destroy()
+
+    def test_get_value_cache(self):
+        """get_value results are cached until the item is modified."""
+        ovf = OVF(self.input_ovf, None)
+        # InstanceID 11, first NIC, in all profiles
+        item = ovf.hardware.item_dict['11']
+        item.value_cache_hits = 0
+        item.value_cache_misses = 0
+        self.assertEqual("VM Network", item.get_value(ovf.CONNECTION))
+        self.assertEqual(0, item.value_cache_hits)
+        self.assertEqual(1, item.value_cache_misses)
+        self.assertEqual("VM Network", item.get_value(ovf.CONNECTION))
+        self.assertEqual(1, item.value_cache_hits)
+        self.assertEqual(1, item.value_cache_misses)
+
+        # Per-profile lookups are cached separately
+        self.assertEqual("VM Network",
+                         item.get_value(ovf.CONNECTION, ['1CPU-1GB-1NIC']))
+        self.assertEqual(2, item.value_cache_misses)
+
+        item.set_property(ovf.CONNECTION, "foo", ['1CPU-1GB-1NIC'])
+        self.assertEqual("foo",
+                         item.get_value(ovf.CONNECTION, ['1CPU-1GB-1NIC']))
+        self.assertEqual(None, item.get_value(ovf.CONNECTION))
+
+        item.remove_profile('1CPU-1GB-1NIC')
+        self.assertEqual(None,
+                         item.get_value(ovf.CONNECTION, ['1CPU-1GB-1NIC']))
+        self.assertEqual("VM Network",
+                         item.get_value(ovf.CONNECTION, ['2CPU-2GB-1NIC']))
+
+        item.add_profile('1CPU-1GB-1NIC')
+        self.assertEqual("VM Network",
+                         item.get_value(ovf.CONNECTION, ['1CPU-1GB-1NIC']))
+        ovf.destroy()
+
+    def test_version_constants(self):
+        """Name helper constants are bound as class attributes."""
+        item = OVFItem(None)
+        self.assertEqual('OVFItem', type(item).__name__)
+        self.assertIsInstance(item, OVFItem)
+        self.assertIn('INSTANCE_ID', vars(type(item)))
+        self.assertEqual('InstanceID', item.INSTANCE_ID)
+
+        with OVF(self.v09_ovf, None) as ovf:
+            self.assertIn('INSTANCE_ID', vars(ovf))
+            self.assertEqual('InstanceId', ovf.INSTANCE_ID)
+            for item in ovf.hardware.item_dict.values():
+                self.assertEqual('InstanceId', item.INSTANCE_ID)
+                self.assertEqual(ovf.ITEM_CHILDREN, item.ITEM_CHILDREN)
+                self.assertEqual(ovf.ITEM_CHILDREN,
+                                 item.clone().ITEM_CHILDREN)
+
+        with self.assertRaises(AttributeError):
+            item.NOT_A_CONSTANT
+
+    def test_get_nonintersecting_set_list(self):
+        """Profiles are grouped by the values they share."""
+        with OVF(self.input_ovf, None) as ovf:
+            # InstanceID 11, first NIC, in all profiles
+            item = ovf.hardware.item_dict['11']
+            self.assertEqual([''], item.get_nonintersecting_set_list())
+
+            item.set_property(ovf.CONNECTION, "foo",
+                              ['1CPU-1GB-1NIC', '2CPU-2GB-1NIC'])
+            self.assertEqual(['', '1CPU-1GB-1NIC 2CPU-2GB-1NIC'],
+                             item.get_nonintersecting_set_list())
+
+            item.set_property(ovf.ELEMENT_NAME, "bar", ['2CPU-2GB-1NIC'])
+            self.assertEqual(['', '1CPU-1GB-1NIC', '2CPU-2GB-1NIC'],
+                             item.get_nonintersecting_set_list())
+
+
+class TestOVFProfileIndex(COTTestCase):
+    """Unit test cases for the OVFProfileIndex class."""
+
+    def test_mask_round_trip(self):
+        """Convert between profile names and bitmasks."""
+        index = OVFProfileIndex(['foo', 'bar'])
+        self.assertEqual(index.bit(None), OVFProfileIndex.WILDCARD)
+        self.assertEqual(index.bit('foo'), 2)
+        self.assertEqual(index.bit('bar'), 4)
+        self.assertEqual(index.mask([]), 0)
+        self.assertEqual(index.mask(['foo', 'bar']), 6)
+        self.assertEqual(index.profiles(0), set())
+        self.assertEqual(index.profiles(7), set([None, 'foo', 'bar']))
+
+    def test_new_profile(self):
+        """Previously unseen profiles are assigned the next free bit."""
+        index = OVFProfileIndex(['foo'])
+        self.assertEqual(index.mask(['baz']), 4)
+        self.assertEqual(index.bit('baz'), 4)
+        self.assertEqual(index.bit('foo'), 2)
+        self.assertEqual(index.profiles(6), set(['foo', 'baz']))
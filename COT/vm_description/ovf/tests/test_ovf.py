@@ -24,12 +24,16 @@ import tempfile
 import shutil
 import subprocess
 import tarfile
+import threading
 import mock
 
 from COT.tests import COTTestCase
 from COT.vm_description.ovf import OVF
 from COT.vm_description import VMInitError
 from COT.data_validation import ValueUnsupportedError
+from COT.disks import RAW
+from COT.disks.cache import conversion_cache
+from COT.disks.vmdk import DeferredVMDK, StreamOptimizedWriter
 from COT.helpers import helpers, HelperError
 
 logger = logging.getLogger(__name__)
@@ -266,9 +270,9 @@ ovf:size="{cfg_size}" />
 
         self.assertLogged(msg="Size of file '%s' has changed")
         self.assertLogged(msg="checksum of file '%s' has changed")
-        # TODO: When the disk is in the input OVA we can't validate capacity.
-        # self.assertLogged(msg="Capacity of disk.*seems to have changed.*"
-        #                  "The updated OVF will reflect this change.")
+        # Capacity is validated even though the disk is in the input OVA
+        self.assertLogged(msg="Capacity of disk.*seems to have changed.*"
+                          "The updated OVF will reflect this change.")
 
     def test_tar_untar(self):
         """Output OVF to OVA and vice versa."""
@@ -452,6 +456,20 @@ ovf:size="{cfg_size}" />
                 tarf.addfile(tari, fileobj)
         self.assertRaises(VMInitError, OVF, fake_file, None)
 
+    def check_invalid_hardware(self, fake_file):
+        """Check that the given OVF's hardware is rejected on first access.
+
+        Args:
+          fake_file (str): Copy of input.ovf, in another directory, whose
+              hardware Items are invalid.
+        """
+        with OVF(fake_file, None) as ovf:
+            self.assertRaises(VMInitError, getattr, ovf, 'hardware')
+            # Still rejected on subsequent access
+            self.assertRaises(VMInitError, getattr, ovf, 'hardware')
+        for filename in ("input.vmdk", "input.iso", "sample_cfg.txt"):
+            self.assertLogged(args=(filename,), **self.NONEXISTENT_FILE)
+
     def test_invalid_ovf_contents(self):
         """Check for rejection of OVF files with valid XML but invalid data."""
         # Multiple Items under same profile with same InstanceID
@@ -465,7 +483,7 @@ ovf:size="{cfg_size}" />
             self.assertRaises(HelperError,
                               helpers['ovftool'].call,
                               ['--schemaValidate', fake_file])
-        self.assertRaises(VMInitError, OVF, fake_file, None)
+        self.check_invalid_hardware(fake_file)
 
         # Item referencing a nonexistent Configuration
         with open(fake_file, "w") as fileobj:
@@ -477,7 +495,7 @@ ovf:size="{cfg_size}" />
             self.assertRaises(HelperError,
                               helpers['ovftool'].call,
                               ['--schemaValidate', fake_file])
-        self.assertRaises(VMInitError, OVF, fake_file, None)
+        self.check_invalid_hardware(fake_file)
 
         # TODO - inconsistent order of File versus Disk?
         # TODO - Sections in wrong order?
@@ -538,3 +556,114 @@ class TestOVFAPI(COTTestCase):
         with OVF(self.input_ovf, None) as ovf:
             self.assertRaises(ValueUnsupportedError,
                               ovf.find_empty_drive, 'floppy')
+
+    def test_file_disk_lookup(self):
+        """Look up Files, Disks, and Items as the descriptor is edited."""
+        with OVF(self.input_ovf, None) as ovf:
+            (file1, disk1, _, drive1) = ovf.search_from_filename("input.vmdk")
+            self.assertEqual(file1.get(ovf.FILE_ID), "file1")
+            self.assertEqual(disk1.get(ovf.DISK_ID), "vmdisk1")
+            self.assertEqual(drive1.get_value(ovf.HOST_RESOURCE),
+                             "ovf:/disk/vmdisk1")
+            self.assertEqual(ovf.find_item_from_disk(disk1), drive1)
+            (file2, disk2, _, drive2) = ovf.search_from_file_id("file2")
+            self.assertEqual(file2.get(ovf.FILE_HREF), "input.iso")
+            self.assertIsNone(disk2)
+            self.assertEqual(ovf.find_item_from_file(file2), drive2)
+
+            # Lookups must reflect changes made through the OVF APIs
+            ovf.remove_file(file2, disk_drive=drive2)
+            self.assertEqual(ovf.search_from_file_id("file2"),
+                             (None, None, None, None))
+            self.assertIsNone(ovf.find_item_from_file(file2))
+
+            # pylint: disable=protected-access
+            file_index = ovf._file_index
+            new_file = ovf.add_file(self.blank_vmdk, "file2")
+            self.assertEqual(ovf.search_from_filename("blank.vmdk")[0],
+                             new_file)
+            self.assertIsNone(ovf.find_disk_from_file_id("file2"))
+            # The index is updated in place rather than rebuilt
+            self.assertIs(ovf._file_index, file_index)
+
+            # Overwriting a File replaces its old href and id in the index
+            ovf.add_file(self.input_iso, "file3", file_obj=new_file)
+            self.assertIsNone(ovf.search_from_filename("blank.vmdk")[0])
+            self.assertIsNone(ovf.search_from_file_id("file2")[0])
+            self.assertEqual(ovf.search_from_file_id("file3")[0], new_file)
+            ovf.add_file(self.blank_vmdk, "file2", file_obj=new_file)
+
+            drive2.set_property(ovf.HOST_RESOURCE, "ovf:/file/file2")
+            self.assertEqual(ovf.find_item_from_file(new_file), drive2)
+
+    def test_convert_disks_concurrently(self):
+        """Disks of different formats are converted concurrently on write."""
+        started = []
+        all_started = threading.Event()
+
+        def wait_for_both(name):
+            """Wait until both conversions are in progress at once."""
+            started.append(name)
+            if len(started) == 2:
+                all_started.set()
+            self.assertTrue(all_started.wait(10))
+
+        def convert(disk_image, new_format, new_directory, new_subformat):
+            """Stand-in for conversion by qemu-img."""
+            wait_for_both(disk_image.disk_format)
+            path = os.path.join(new_directory, "converted.vmdk")
+            with open(path, 'wb') as fileobj:
+                fileobj.write(b"qcow2 as VMDK")
+            return mock.Mock(path=path)
+
+        def write(*_):
+            """Stand-in for native conversion."""
+            wait_for_both('raw')
+            return 0
+
+        raw_path = os.path.join(self.temp_dir, "disk1.img")
+        qcow2_path = os.path.join(self.temp_dir, "disk2.qcow2")
+        for path in (raw_path, qcow2_path):
+            with open(path, 'wb') as fileobj:
+                fileobj.truncate(1048576)
+        disks = [RAW(raw_path),
+                 mock.Mock(path=qcow2_path, disk_format='qcow2',
+                           disk_subformat=None, capacity="16777216")]
+        output = os.path.join(self.temp_dir, "out.ovf")
+        with mock.patch.dict(os.environ, {'COT_CONVERSION_JOBS': '2'}), \
+                mock.patch.object(conversion_cache, 'convert',
+                                  side_effect=convert), \
+                mock.patch.object(StreamOptimizedWriter, 'write',
+                                  side_effect=write), \
+                OVF(self.minimal_ovf, output) as ovf:
+            for disk in disks:
+                deferred = ovf.convert_disk_if_needed(disk, 'harddisk')
+                self.assertIsInstance(deferred, DeferredVMDK)
+                file_id = os.path.basename(deferred.path)
+                ovf.add_file(deferred.path, file_id)
+                ovf.add_disk(deferred, file_id, 'harddisk')
+            # Nothing is converted until the OVF is written out
+            self.assertEqual(started, [])
+        self.assertEqual(sorted(started), ['qcow2', 'raw'])
+        with open(os.path.join(self.temp_dir, "disk2.vmdk"), 'rb') as fileobj:
+            self.assertEqual(fileobj.read(), b"qcow2 as VMDK")
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir,
+                                                    "disk1.vmdk")))
+
+    def test_lazy_hardware(self):
+        """Hardware is only parsed when it is first needed."""
+        with OVF(self.input_ovf, None) as ovf:
+            # pylint: disable=protected-access
+            self.assertIsNone(ovf._hardware)
+            self.assertEqual(ovf.version_short, "DEV")
+            self.assertIsNone(ovf._hardware)
+            hardware = ovf.hardware
+            self.assertIsNotNone(hardware)
+            self.assertIs(ovf.hardware, hardware)
+
+        # Writing out an OVF whose hardware was never touched doesn't need
+        # to parse the hardware either
+        with OVF(self.input_ovf, self.temp_file) as ovf:
+            ovf.product = "Hello"
+            ovf.write()
+            self.assertIsNone(ovf._hardware)
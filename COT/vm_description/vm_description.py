@@ -26,6 +26,7 @@
 from __future__ import print_function
 
 import atexit
+from contextlib import contextmanager
 import logging
 import os
 import os.path
@@ -574,6 +575,19 @@ class VMDescription(object):
         raise NotImplementedError("add_disk_device not implemented")
 
     # API methods needed for edit-hardware
+    @contextmanager
+    def batch_edit(self):
+        """Group a series of hardware edits into a single batch.
+
+        Subclasses may defer consistency checks on the edited hardware
+        until the batch completes. The default implementation simply
+        runs the enclosed edits.
+
+        Yields:
+          VMDescription: this VM
+        """
+        yield self
+
     def create_configuration_profile(self, pid, label, description):
         """Create/update a configuration profile with the given ID.
 